@@ -66,10 +66,12 @@
 
 
 
-import os
+from collections import OrderedDict
 import numpy as np
-import pandas as pd
-from glob import glob
+import track_store
+
+# Middle region of the arena (normalized x) used for interaction analysis.
+MIDDLE_REGION = (0.313, 0.704)
 
 def check_overlap(box1, box2):
     """
@@ -105,6 +107,21 @@ def filter_middle_region(data, x_min, x_max):
     ])
 
 
+def load_tracks(directory):
+    """
+    Load the track store of the run whose label files are in 'directory'.
+    """
+    return track_store.open_tracks(directory)
+
+def frame_data(tracks, frame_index):
+    """
+    Return the detections of one frame as an array with columns
+    [x_center, y_center, width, height, ant ID], skipping untracked boxes.
+    """
+    rows = tracks.frame(frame_index)
+    rows = rows[rows['track_id'] >= 0]
+    return np.column_stack([rows['x'], rows['y'], rows['w'], rows['h'], rows['track_id']])
+
 def merge_intervals(frames, tolerance):
     """
     Given a sorted list of frame indices, merge indices that are within
@@ -143,18 +160,17 @@ def track_ant_interactions(directory, merge_tolerance=20, min_segment_length=10)
       total_interactions (int): The number of unique (merged) interactions detected.
     """
     # Middle region x-center cutoffs
-    x_min, x_max = 0.313, 0.704
+    x_min, x_max = MIDDLE_REGION
 
-    # Get list of text files (one per frame), sorted in order.
-    files = sorted(glob(os.path.join(directory, "*.txt")))
+    # Load the run's track store (one memory-mapped file instead of one .txt per frame).
+    tracks = load_tracks(directory)
     
     # Dictionary to hold, for each ant pair, a list of frame indices where they overlapped.
     pair_frames = {}
 
-    for frame_index, file in enumerate(files):
-        # Read the data and drop the first column.
-        # After dropping, columns are: [x_center, y_center, width, height, ant ID]
-        data = pd.read_csv(file, sep='\s+', header=None).iloc[:, 1:].values
+    for frame_index in range(len(tracks)):
+        # Columns are: [x_center, y_center, width, height, ant ID]
+        data = frame_data(tracks, frame_index)
         
         # Filter out detections not in the middle region.
         filtered_data = filter_middle_region(data, x_min, x_max)
@@ -187,11 +203,315 @@ def track_ant_interactions(directory, merge_tolerance=20, min_segment_length=10)
     print(f"Total unique interactions tracked: {total_interactions}")
     return total_interactions
 
-# Directory containing the text files (each file corresponds to one frame)
-directory = "runs/detect/full/labels"
+# Number of box-pair comparisons evaluated per block (frames x slots x slots in
+# overlapping_pairs_dense, candidate pairs in sweep_overlaps); bounds the temporary arrays.
+PAIR_BLOCK_ELEMENTS = 1 << 22
+
+def sweep_overlaps(group, x_lo, x_hi, y_lo, y_hi, block_elements=PAIR_BLOCK_ELEMENTS):
+    """
+    Sort-and-sweep broad phase: every pair of boxes of the same group (frame)
+    that overlap according to check_overlap, without testing all pairs.
+
+    Boxes are sorted by group and by their lower edge along the sweep axis (the
+    axis on which they are more spread out relative to their size). A box can
+    only overlap the boxes after it whose lower edge is at or before its upper
+    edge; those candidates are found for all boxes at once by sorting the upper
+    edges in among the lower edges, and only they get the exact test on both
+    axes. The work grows with the number of candidate pairs instead of with the
+    square of the boxes per frame.
+
+    Parameters:
+      group (np.ndarray): Group (frame) of each box; boxes of different groups never overlap.
+      x_lo, x_hi, y_lo, y_hi (np.ndarray): Box extents, computed as in check_overlap.
+      block_elements (int): Candidate pairs tested per block; bounds the temporary arrays.
+
+    Returns:
+      i, j (np.ndarray): Indices of the overlapping boxes, i < j.
+    """
+    n = len(group)
+    empty = np.empty(0, dtype=np.int64)
+    if n < 2:
+        return empty, empty
+    def spread(lo, hi):
+        return np.ptp(lo) / max(float(np.mean(hi - lo)), 1e-12)
+    if spread(y_lo, y_hi) > spread(x_lo, x_hi):
+        x_lo, x_hi, y_lo, y_hi = y_lo, y_hi, x_lo, x_hi
+
+    # NumPy orders complex numbers by real, then imaginary part: group + 1j * edge is an
+    # exact (group, edge) sort key, and sorts much faster than np.lexsort.
+    group = np.asarray(group, dtype=float)
+    keys = group + 1j * x_lo
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    hi = x_hi[order]
+    other_lo, other_hi = y_lo[order], y_hi[order]
+
+    # Candidates of sorted box k are boxes k + 1 .. end[k] - 1: the boxes of its group whose
+    # lower edge is at or before its upper edge (touching boxes overlap in check_overlap).
+    end = np.searchsorted(keys, group[order] + 1j * hi, side='right')
+    counts = np.maximum(end - np.arange(1, n + 1), 0)
+
+    found_i, found_j = [], []
+    bounds = np.cumsum(counts)
+    first = 0
+    while first < n:
+        # Largest run of boxes whose candidates fit one block (at least one box).
+        base = bounds[first - 1] if first else 0
+        last = max(int(np.searchsorted(bounds, base + block_elements, side='right')), first + 1)
+        block_counts = counts[first:last]
+        k = np.repeat(np.arange(first, last), block_counts)
+        j = k + 1 + np.arange(len(k)) - np.repeat(np.cumsum(block_counts) - block_counts, block_counts)
+        # On the sweep axis the candidates overlap by construction (lo[k] <= lo[j] <= hi[k]),
+        # so only the other axis is left to test.
+        overlap = ~((np.repeat(other_hi[first:last], block_counts) < other_lo[j]) |
+                    (np.repeat(other_lo[first:last], block_counts) > other_hi[j]))
+        a, b = order[k[overlap]], order[j[overlap]]
+        found_i.append(np.minimum(a, b))
+        found_j.append(np.maximum(a, b))
+        first = last
+    return np.concatenate(found_i), np.concatenate(found_j)
+
+def overlapping_pairs(tracks, x_min=MIDDLE_REGION[0], x_max=MIDDLE_REGION[1], block_elements=PAIR_BLOCK_ELEMENTS):
+    """
+    Find every overlapping ant pair in every frame of a track store at once.
+
+    Applies the same middle-region filter and check_overlap test as
+    track_ant_interactions, with the sort-and-sweep broad phase of
+    sweep_overlaps over all frames together.
+
+    Returns:
+      frames, ant_a, ant_b (np.ndarray): One entry per overlapping pair per
+      frame, with ant_a <= ant_b.
+    """
+    rows = tracks.rows
+    ids = rows['track_id']
+    x, y, w, h = (np.asarray(rows[c], dtype=float) for c in ('x', 'y', 'w', 'h'))
+    keep = (ids >= 0) & (x - w / 2 > x_min) & (x + w / 2 < x_max)
+    frame_of = np.asarray(rows['frame'])[keep].astype(np.int64)
+    ids = np.asarray(ids)[keep].astype(np.int64)
+    x, y, w, h = x[keep], y[keep], w[keep], h[keep]
+    # Box extents, computed exactly as in check_overlap.
+    i, j = sweep_overlaps(frame_of, x - w / 2, x + w / 2, y - h / 2, y + h / 2, block_elements)
+    return frame_of[i], np.minimum(ids[i], ids[j]), np.maximum(ids[i], ids[j])
+
+def overlapping_pairs_dense(tracks, x_min=MIDDLE_REGION[0], x_max=MIDDLE_REGION[1], block_elements=PAIR_BLOCK_ELEMENTS):
+    """
+    Exhaustive version of overlapping_pairs that tests every pair of boxes of
+    a frame (kept as a reference and for the benchmarks). Applies the same
+    middle-region filter and check_overlap test as track_ant_interactions,
+    on whole blocks of frames with NumPy broadcasting. Frames are grouped by their number of boxes so each block
+    is padded only to the largest frame it contains.
+
+    Returns:
+      frames, ant_a, ant_b (np.ndarray): One entry per overlapping pair per
+      frame, with ant_a <= ant_b.
+    """
+    rows = tracks.rows
+    ids = rows['track_id']
+    x, y, w, h = (np.asarray(rows[c], dtype=float) for c in ('x', 'y', 'w', 'h'))
+    keep = (ids >= 0) & (x - w / 2 > x_min) & (x + w / 2 < x_max)
+    frame_of = np.asarray(rows['frame'])[keep]
+    ids = np.asarray(ids)[keep].astype(np.int64)
+    x, y, w, h = x[keep], y[keep], w[keep], h[keep]
+    # Box extents, computed exactly as in check_overlap.
+    x_lo, x_hi = x - w / 2, x + w / 2
+    y_lo, y_hi = y - h / 2, y + h / 2
+
+    # Rows are sorted by frame: find each frame's first row and box count.
+    firsts = np.flatnonzero(np.r_[True, frame_of[1:] != frame_of[:-1]]) if len(frame_of) else np.empty(0, dtype=np.int64)
+    counts = np.diff(np.r_[firsts, len(frame_of)])
+    multi = np.flatnonzero(counts >= 2)
+    multi = multi[np.argsort(counts[multi], kind='stable')]
+
+    found_frames, found_a, found_b = [], [], []
+    start = 0
+    while start < len(multi):
+        # Grow the block while the padded comparison cube fits the budget.
+        k = counts[multi[start]]
+        stop = start + 1
+        while stop < len(multi):
+            k_next = counts[multi[stop]]
+            if (stop - start + 1) * k_next * k_next > block_elements:
+                break
+            k = k_next
+            stop += 1
+        group = multi[start:stop]
+        start = stop
+
+        slots = np.arange(k)
+        valid = slots[None, :] < counts[group][:, None]
+        index = np.where(valid, firsts[group][:, None] + slots[None, :], 0)
+        xl, xh, yl, yh = x_lo[index], x_hi[index], y_lo[index], y_hi[index]
+        overlap = ~((xh[:, :, None] < xl[:, None, :]) | (xl[:, :, None] > xh[:, None, :]) |
+                    (yh[:, :, None] < yl[:, None, :]) | (yl[:, :, None] > yh[:, None, :]))
+        overlap &= valid[:, :, None] & valid[:, None, :]
+        overlap &= np.triu(np.ones((k, k), dtype=bool), 1)[None]
+        b, i, j = np.nonzero(overlap)
+        id_i, id_j = ids[index[b, i]], ids[index[b, j]]
+        found_frames.append(frame_of[firsts[group][b]])
+        found_a.append(np.minimum(id_i, id_j))
+        found_b.append(np.maximum(id_i, id_j))
+
+    if not found_frames:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty
+    return (np.concatenate(found_frames).astype(np.int64), np.concatenate(found_a), np.concatenate(found_b))
+
+def merge_pair_intervals(frames, ant_a, ant_b, tolerance):
+    """
+    Vectorized merge_intervals over all ant pairs at once.
+
+    Sorts the (pair, frame) detections and starts a new segment wherever the
+    pair changes or the gap to the previous frame exceeds 'tolerance'.
+
+    Returns:
+      ant_a, ant_b, start, end (np.ndarray): One entry per merged segment.
+    """
+    order = np.lexsort((frames, ant_b, ant_a))
+    frames, ant_a, ant_b = frames[order], ant_a[order], ant_b[order]
+    new_segment = np.ones(len(frames), dtype=bool)
+    new_segment[1:] = ((ant_a[1:] != ant_a[:-1]) | (ant_b[1:] != ant_b[:-1]) |
+                       (frames[1:] - frames[:-1] > tolerance))
+    starts = np.flatnonzero(new_segment)
+    ends = np.append(starts[1:], len(frames))[:len(starts)] - 1
+    return ant_a[starts], ant_b[starts], frames[starts], frames[ends]
+
+def interaction_intervals(directory, merge_tolerance=20, min_segment_length=10):
+    """
+    Batched version of track_ant_interactions that returns the interactions
+    themselves: arrays ant_a, ant_b, start_frame, end_frame with one entry per
+    merged segment lasting at least min_segment_length frames.
+    """
+    tracks = load_tracks(directory)
+    frames, ant_a, ant_b = overlapping_pairs(tracks)
+    ant_a, ant_b, start, end = merge_pair_intervals(frames, ant_a, ant_b, merge_tolerance)
+    long_enough = (end - start + 1) >= min_segment_length
+    return ant_a[long_enough], ant_b[long_enough], start[long_enough], end[long_enough]
+
+def track_ant_interactions_batched(directory, merge_tolerance=20, min_segment_length=10):
+    """
+    Same result as track_ant_interactions, computed with the batched engine
+    (overlapping_pairs + merge_pair_intervals) instead of per-frame Python loops.
+    """
+    ant_a, _, _, _ = interaction_intervals(directory, merge_tolerance, min_segment_length)
+    total_interactions = len(ant_a)
+    print(f"Total unique interactions tracked: {total_interactions}")
+    return total_interactions
+
+def frame_overlaps(data, x_min=MIDDLE_REGION[0], x_max=MIDDLE_REGION[1]):
+    """
+    Overlapping ant pairs of a single frame, with the same middle-region filter
+    and check_overlap test as track_ant_interactions.
+
+    Parameters:
+      data (np.ndarray): Detections with columns [x_center, y_center, width, height, ant ID].
+
+    Returns:
+      ant_a, ant_b (np.ndarray): One entry per overlapping pair, with ant_a <= ant_b.
+    """
+    data = np.asarray(data, dtype=float).reshape(-1, 5)
+    x, y, w, h, ids = data.T
+    inside = (x - w / 2 > x_min) & (x + w / 2 < x_max)
+    x, y, w, h, ids = x[inside], y[inside], w[inside], h[inside], ids[inside].astype(np.int64)
+    i, j = sweep_overlaps(np.zeros(len(x), dtype=np.int64), x - w / 2, x + w / 2, y - h / 2, y + h / 2)
+    # Same order as testing the pairs row by row.
+    order = np.lexsort((j, i))
+    i, j = i[order], j[order]
+    return np.minimum(ids[i], ids[j]), np.maximum(ids[i], ids[j])
+
+class InteractionCounter:
+    """
+    Counts ant interactions online, one frame at a time, e.g. from inside the
+    tracking loop, instead of re-reading the whole run afterwards.
+
+    Every ant pair has at most one open interval. A new overlap within
+    merge_tolerance frames of the interval's end extends it; otherwise the
+    interval is closed and a new one opened, exactly like merge_intervals.
+    Intervals whose end is more than merge_tolerance frames behind the current
+    frame can no longer grow and are closed as the run advances. Closed
+    intervals of at least min_segment_length frames are interactions, so after
+    finish() the count equals track_ant_interactions on the same run.
+    """
 
-# You may need to adjust merge_tolerance and min_segment_length to get closer to 30–40 total interactions.
-ant_interactions_count = track_ant_interactions(directory, merge_tolerance=200, min_segment_length=270)
+    def __init__(self, merge_tolerance=20, min_segment_length=10, x_min=MIDDLE_REGION[0], x_max=MIDDLE_REGION[1]):
+        self.merge_tolerance = merge_tolerance
+        self.min_segment_length = min_segment_length
+        self.x_min = x_min
+        self.x_max = x_max
+        # pair -> [start, end], least recently extended first.
+        self._open = OrderedDict()
+        self._open_long_enough = 0
+        self.interactions = []
+        self.last_frame = None
+
+    def _long_enough(self, start, end):
+        return end - start + 1 >= self.min_segment_length
+
+    def _close(self, pair):
+        start, end = self._open.pop(pair)
+        if self._long_enough(start, end):
+            self._open_long_enough -= 1
+            self.interactions.append((pair[0], pair[1], start, end))
+
+    def update(self, frame_index, data):
+        """
+        Add the detections of one frame (columns [x_center, y_center, width,
+        height, ant ID], see frame_data). Frames must come in increasing order;
+        skipped frames count as frames without overlaps.
+        """
+        if self.last_frame is not None and frame_index <= self.last_frame:
+            raise ValueError(f"Frame {frame_index} added after frame {self.last_frame}.")
+        self.last_frame = frame_index
+
+        # Intervals that ended more than merge_tolerance frames ago are final.
+        while self._open:
+            pair, (start, end) = next(iter(self._open.items()))
+            if frame_index - end <= self.merge_tolerance:
+                break
+            self._close(pair)
+
+        ant_a, ant_b = frame_overlaps(data, self.x_min, self.x_max)
+        for pair in zip(ant_a.tolist(), ant_b.tolist()):
+            interval = self._open.get(pair)
+            if interval is None:
+                self._open[pair] = [frame_index, frame_index]
+                self._open_long_enough += self._long_enough(frame_index, frame_index)
+                continue
+            was_long_enough = self._long_enough(*interval)
+            interval[1] = frame_index
+            self._open.move_to_end(pair)
+            self._open_long_enough += self._long_enough(*interval) and not was_long_enough
+
+    def update_rows(self, frame_index, rows):
+        """
+        Same as update, for an (n, 7) array of cls, x, y, w, h, conf, track_id
+        (track_store.rows_from_boxes / parse_label_lines). Untracked boxes are skipped.
+        """
+        rows = np.asarray(rows, dtype=float).reshape(-1, 7)
+        rows = rows[rows[:, 6] >= 0]
+        self.update(frame_index, rows[:, [1, 2, 3, 4, 6]])
+
+    def live_count(self):
+        """
+        Interactions so far: closed ones plus open intervals that are already
+        long enough (they can only grow, so they will count at the end).
+        """
+        return len(self.interactions) + self._open_long_enough
+
+    def finish(self):
+        """Close every open interval at the end of the video; returns the final count."""
+        for pair in list(self._open):
+            self._close(pair)
+        return len(self.interactions)
+
+if __name__ == "__main__":
+    import sys
+    import run_catalog
+    # Labels of the run given on the command line (directory or job ID), else the latest run in the catalog.
+    directory = run_catalog.resolve_labels(sys.argv[1] if len(sys.argv) > 1 else "latest")
+
+    # You may need to adjust merge_tolerance and min_segment_length to get closer to 30–40 total interactions.
+    ant_interactions_count = track_ant_interactions_batched(directory, merge_tolerance=200, min_segment_length=270)
 
 """
 merge_tolerance: If two overlapping detections for a given pair are separated by no more than this many frames, they are merged into one event.
@@ -1,22 +1,113 @@
-from flask import Flask, render_template, request, redirect, url_for, flash #type:ignore
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, send_file #type:ignore
 import os
-import subprocess
 import signal
 import false_positive
+import inference_backend
 import test_track
-from ultralytics import YOLO #type:ignore
+import tracklet_stitching
+import tracking_service
+import model_registry
+import result_cache
+import run_catalog
+import run_metrics
+import run_tracking
+import track_summary
+import cv2 #type:ignore
+import numpy as np #type:ignore
 
 app = Flask(__name__)
 app.secret_key = "your_secret_key"
 
 UPLOAD_FOLDER = 'uploads'
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Number of processes used to re-render the tracking video after FP/TP edits.
+app.config['RENDER_WORKERS'] = int(os.environ.get('RENDER_WORKERS', '1'))
+# Frames per detector call of tracking jobs (> 1 decodes frames ahead on a background thread).
+app.config['TRACKING_BATCH'] = int(os.environ.get('TRACKING_BATCH', '1'))
+# Number of tracking jobs that may run at the same time.
+app.config['MAX_CONCURRENT_JOBS'] = int(os.environ.get('MAX_CONCURRENT_JOBS', str(tracking_service.MAX_CONCURRENT_JOBS)))
+# Rows of the track table shown at most on the review page (after filtering).
+app.config['TRACK_TABLE_ROWS'] = int(os.environ.get('TRACK_TABLE_ROWS', '500'))
+# Days finished jobs keep their directory in jobs/ (removed at startup); 0 keeps every job.
+app.config['JOB_RETENTION_DAYS'] = float(os.environ.get('JOB_RETENTION_DAYS',
+                                                        str(tracking_service.JOB_RETENTION_DAYS)))
 
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
-yolo_process = None
-uploaded_video_path = os.path.join(app.config['UPLOAD_FOLDER'], 'video.mp4')
+# Tracking results are cached by video and model configuration; RESULT_CACHE_MB=0 disables the cache.
+app.config['RESULT_CACHE_DIR'] = os.environ.get('RESULT_CACHE_DIR', result_cache.CACHE_DIR)
+app.config['RESULT_CACHE_MB'] = int(os.environ.get('RESULT_CACHE_MB', str(result_cache.MAX_CACHE_BYTES // 1024 ** 2)))
+
+cache = None
+if app.config['RESULT_CACHE_MB'] > 0:
+    cache = result_cache.ResultCache(app.config['RESULT_CACHE_DIR'], app.config['RESULT_CACHE_MB'] * 1024 ** 2)
+catalog = run_catalog.default_catalog()
+tracking = tracking_service.TrackingService(max_workers=app.config['MAX_CONCURRENT_JOBS'], cache=cache,
+                                            catalog=catalog)
+@app.before_request
+def start_tracking_service():
+    # Started by the first request rather than at import: the spawned workers import this
+    # module too, and so does the watcher process of Werkzeug's reloader (FLASK_DEBUG=1),
+    # which never serves a request.
+    if tracking.start():
+        # Once, in this process only: jobs interrupted by a pause, a crash or a restart are
+        # listed as paused and continue from their checkpoint when resumed.
+        tracking.recover()
+        tracking.remove_expired_jobs(app.config['JOB_RETENTION_DAYS'])
+
+def current_job():
+    """The tracking job most recently submitted from this browser session, if any."""
+    return tracking.get(session.get('job_id', ''))
+
+def current_run():
+    """
+    Returns (video_path, labels_dir) of the current session's tracking job (looked up
+    in the run catalog if the service no longer knows it, e.g. after a restart),
+    falling back to the most recently finished run in the catalog. video_path is
+    the video recorded with the run, None if there is none.
+    """
+    job = current_job()
+    if job is not None and job.labels_dir is not None:
+        return job.video_path, job.labels_dir
+    record = catalog.job(session['job_id']) if session.get('job_id') else None
+    if record is None:
+        record = catalog.latest()
+    if record is None:
+        return None, None
+    return record['video_path'], record['labels_dir']
+
+def tracking_options(form):
+    """Tracking options chosen in an upload form (see run_tracking.track_video)."""
+    options = {}
+    if app.config['TRACKING_BATCH'] > 1:
+        options['batch'] = app.config['TRACKING_BATCH']
+    stride = form.get('stride', '').strip()
+    if stride:
+        options['stride'] = max(1, int(stride))
+    roi = run_tracking.parse_roi(form.get('roi', ''))
+    if roi is not None:
+        options['roi'] = roi
+    return options
+
+def submit_tracking(file, flag=0, **options):
+    """
+    Saves an uploaded video into a new job's input directory and queues the job
+    (which finishes right away if its results are cached).
+    """
+    job = tracking.create_job(flag, **options)
+    video_digest = result_cache.save_upload(file, job.video_path)
+    tracking.submit(job, video_digest)
+    session['job_id'] = job.id
+    return job
+
+def cancel_tracking():
+    job = current_job()
+    if job is not None and tracking.cancel(job.id):
+        flash('Stop requested; tracking will stop after the current frame.')
+        print(f"Tracking job {job.id} cancelled.")
+    else:
+        flash('No active tracking process.')
 
 @app.route('/')
 def index():
@@ -25,7 +116,6 @@ def index():
 
 @app.route('/upload', methods=['POST'])
 def upload_video():
-    global yolo_process
     if 'file' not in request.files:
         flash('No file part in the request.')
         return redirect(request.url)
@@ -36,57 +126,126 @@ def upload_video():
         return redirect(request.url)
     
     if file:
-        file.save(uploaded_video_path)
         flash('Video uploaded successfully. Now starting the tracking process...')
         
         try:
-            yolo_process = subprocess.Popen(
-                ['python', 'run_tracking.py', uploaded_video_path, "0"],
-                stdout=open(os.devnull, 'w'),
-                stderr=open(os.devnull, 'w'),
-                text=True
-            )
-            flash("Tracking process started successfully.")
+            job = submit_tracking(file, flag=0, **tracking_options(request.form))
+            if job.cached:
+                flash(f"This video was already tracked with these settings; job {job.id} uses the cached results.")
+            else:
+                flash(f"Tracking job {job.id} started successfully.")
         except Exception as e:
             flash(f"Error running tracking process: {e}")
             return redirect(url_for('index'))
         
     return redirect(url_for('process_form'))
 
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    return jsonify([job.to_dict() for job in tracking.jobs()])
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = tracking.get(job_id)
+    if job is None:
+        return jsonify({'error': f'Unknown job {job_id}'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/pause', methods=['POST'])
+def pause_job(job_id):
+    if not tracking.pause(job_id):
+        return jsonify({'error': f'Job {job_id} is unknown or not running'}), 409
+    return jsonify(tracking.get(job_id).to_dict())
+
+@app.route('/jobs/<job_id>/resume', methods=['POST'])
+def resume_job(job_id):
+    if not tracking.resume(job_id):
+        return jsonify({'error': f'Job {job_id} is unknown or cannot be resumed'}), 409
+    return jsonify(tracking.get(job_id).to_dict())
+
+@app.route('/jobs/<job_id>/metrics', methods=['GET'])
+def job_metrics(job_id):
+    """Latest stage timings, progress and peak memory of a job's tracking and re-rendering."""
+    job = tracking.get(job_id)
+    if job is None:
+        return jsonify({'error': f'Unknown job {job_id}'}), 404
+    return jsonify({
+        'id': job.id,
+        'status': job.status,
+        'tracking': job.metrics(),
+        'render': run_metrics.read_metrics(os.path.join(job.output_dir, run_metrics.RENDER_METRICS_NAME)),
+    })
+
+def run_summary():
+    """Track summary of the current run (see track_summary), or None if there is no finished run."""
+    video_path, txt_dir = current_run()
+    if txt_dir is None or not os.path.isdir(txt_dir):
+        return None, None
+    return txt_dir, track_summary.load_summary(txt_dir, video_path)
+
 @app.route('/process_form', methods=['GET'])
 def process_form():
-    return render_template('process.html')
+    sort = request.args.get('sort', 'track_id')
+    if sort not in track_summary.COLUMNS:
+        sort = 'track_id'
+    descending = request.args.get('order') == 'desc'
+    min_detections = request.args.get('min_detections', 0, type=int)
+    min_span = request.args.get('min_span', 0, type=int)
+    summary, tracks = None, []
+    try:
+        _, summary = run_summary()
+    except Exception as e:
+        flash(f"Could not summarize the tracks: {e}")
+    if summary is not None:
+        tracks = track_summary.select_tracks(summary, sort, descending, min_detections, min_span)
+    return render_template('process.html', summary=summary, tracks=tracks[:app.config['TRACK_TABLE_ROWS']],
+                           n_selected=len(tracks), sort=sort, descending=descending,
+                           min_detections=min_detections, min_span=min_span)
+
+@app.route('/track_summary', methods=['GET'])
+def track_summary_json():
+    _, summary = run_summary()
+    if summary is None:
+        return jsonify({'error': 'no tracking run'}), 404
+    return jsonify(summary)
+
+@app.route('/track_thumbnails', methods=['GET'])
+def track_thumbnails():
+    txt_dir, summary = run_summary()
+    if summary is None or summary['thumbnails'] is None:
+        return jsonify({'error': 'no track thumbnails'}), 404
+    return send_file(os.path.abspath(track_summary.thumbnails_path_for(txt_dir)), mimetype='image/jpeg', max_age=0)
 
 @app.route('/process', methods=['POST'])
 def process_ids():
-    fp_ids = request.form.get('false_positive_ids', '')
-    tp_ids = request.form.get('true_positive_ids', '')
-    duplicate_choice = request.form.get('duplicate_choice', 'no')
-    
-    # --- Optional: Duplicate the labels directory for backup if requested ---
-    if duplicate_choice.lower() == 'yes':
-        # Find the most recent tracking directory.
-        most_recent = false_positive.get_most_recent_folder("runs/detect")
-        if most_recent is None:
-            flash("Could not find tracking directory for backup.")
-            return redirect(url_for('index'))
-        source_dir = os.path.join(most_recent, "labels")
-        destination_dir = source_dir + "_backup"
-        false_positive.duplicate_directory(source_dir, destination_dir)
-        flash("Directory duplicated for backup.")
+    # IDs ticked in the track table are added to the typed ones.
+    fp_ids = ','.join([request.form.get('false_positive_ids', ''), *request.form.getlist('fp_track')])
+    tp_ids = ','.join([request.form.get('true_positive_ids', ''), *request.form.getlist('tp_track')])
     
-    # --- Find the most recent tracking directory for processing ---
-    most_recent = false_positive.get_most_recent_folder("runs/detect")
-    if most_recent is None:
+    # --- Find the tracking run to process ---
+    video_path, txt_dir = current_run()
+    if txt_dir is None:
         flash("Could not find a valid tracking directory.")
         return redirect(url_for('index'))
-    txt_dir = os.path.join(most_recent, "labels")
     
-    video_path = uploaded_video_path
-    output_video = "updated_tracking_video.mp4"
+    if video_path is None or not os.path.exists(video_path):
+        flash("The video of this tracking run is no longer available.")
+        return redirect(url_for('process_form'))
+    
+    # Output next to the run: in its job's output directory, or in the run directory of a catalog run.
+    job = current_job()
+    if job is not None and job.labels_dir != txt_dir:
+        job = None
+    output_dir = job.output_dir if job else os.path.dirname(txt_dir)
+    output_video = os.path.join(output_dir, "updated_tracking_video.mp4")
+    metrics = None
+    if job:
+        metrics = run_metrics.RunMetrics(job.id, path=os.path.join(job.output_dir, run_metrics.RENDER_METRICS_NAME),
+                                         log_path=job.log_path)
     
     try:
-        processed_video = false_positive.process_video(tp_ids, fp_ids, video_path, txt_dir, output_video, normalized=True)
+        processed_video = false_positive.process_video(tp_ids, fp_ids, video_path, txt_dir, output_video, normalized=True,
+                                                       workers=app.config['RENDER_WORKERS'], metrics=metrics)
         flash(f"Updated tracking video saved as {processed_video}")
     except Exception as e:
         flash(f"Error processing false/true positive IDs: {e}")
@@ -94,50 +253,67 @@ def process_ids():
     
     return redirect(url_for('process_form'))
 
+@app.route('/stitch', methods=['POST'])
+def stitch_ids():
+    _, txt_dir = current_run()
+    if txt_dir is None:
+        flash("Could not find a valid tracking directory.")
+        return redirect(url_for('index'))
+    try:
+        if request.form.get('clear'):
+            tracklet_stitching.clear_run(txt_dir)
+            flash("Track IDs restored to the tracker's IDs.")
+        else:
+            report = tracklet_stitching.stitch_run(txt_dir)
+            flash(f"Stitched {report['tracklets']} tracklets into {report['tracks']} tracks "
+                  f"({report['links']} IDs merged).")
+    except Exception as e:
+        flash(f"Error stitching track IDs: {e}")
+    return redirect(url_for('process_form'))
+
 @app.route('/stop_tracking', methods=['POST'])
 def stop_tracking():
-    global yolo_process
-    if yolo_process and yolo_process.poll() is None:
-        try:
-            yolo_process.kill()  # Kills immediately.
-            yolo_process = None
-            flash('Tracking process stopped immediately.')
-            print("Tracking process killed.")
-        except Exception as e:
-            flash(f"Error stopping the tracking process: {e}")
-            print(f"Error stopping the tracking process: {e}")
-    else:
-        flash('No active tracking process.')
+    cancel_tracking()
     return redirect(url_for('process_form'))
 
 @app.route('/stop_tracking2', methods=['POST'])
 def stop_tracking2():
-    global yolo_process
-    if yolo_process and yolo_process.poll() is None:
-        try:
-            yolo_process.kill()  # Kills immediately.
-            yolo_process = None
-            flash('Tracking process stopped immediately.')
-            print("Tracking process killed.")
-        except Exception as e:
-            flash(f"Error stopping the tracking process: {e}")
-            print(f"Error stopping the tracking process: {e}")
+    cancel_tracking()
+    return redirect(url_for('process_form'))
+
+@app.route('/pause_tracking', methods=['POST'])
+def pause_tracking():
+    job = current_job()
+    if job is not None and tracking.pause(job.id):
+        flash('Pause requested; tracking will stop after the current frame and can be resumed later.')
+        print(f"Tracking job {job.id} paused.")
     else:
         flash('No active tracking process.')
     return redirect(url_for('process_form'))
 
+@app.route('/resume_tracking', methods=['POST'])
+def resume_tracking():
+    job = current_job()
+    if job is not None and tracking.resume(job.id):
+        flash(f"Tracking job {job.id} resumed from its last checkpoint.")
+        print(f"Tracking job {job.id} resumed.")
+    else:
+        flash('No paused tracking process to resume.')
+    return redirect(url_for('process_form'))
+
 @app.route('/skip_tracking', methods=['POST'])
 def skip_tracking():
-    if yolo_process:
-        if yolo_process.poll() is not None:
-            flash('Tracking in progress, unable to skip.')
-    else:
-        flash('Moving to processing.')
-        return redirect(url_for('process_form'))
+    job = current_job()
+    if job is not None and not job.finished:
+        flash('Tracking in progress, unable to skip.')
+        return redirect(url_for('index'))
+    flash('Moving to processing.')
+    return redirect(url_for('process_form'))
     
 @app.route('/skip_tracking2', methods=['POST'])
 def skip_tracking2():
-    if yolo_process and yolo_process.poll() is None:
+    job = current_job()
+    if job is not None and not job.finished:
         flash('Tracking still in progress, unable to skip.')
         return redirect(url_for('index'))
     flash('Moving to brood page.')
@@ -150,11 +326,12 @@ def return_to_upload():
 
 @app.route('/brood_form', methods=['GET'])
 def brood_form():
-    return(render_template('brood.html'))
+    _, txt_dir = current_run()
+    has_plot = txt_dir is not None and os.path.exists(brood_plot_path(txt_dir))
+    return(render_template('brood.html', has_plot=has_plot))
 
 @app.route('/brood', methods=['POST'])
 def brood():
-    global yolo_process
     if 'file' not in request.files:
         flash('No file part in the request.')
         return redirect(request.url)
@@ -165,17 +342,14 @@ def brood():
         return redirect(request.url)
     
     if file:
-        file.save(uploaded_video_path)
         flash('Video uploaded successfully. Now starting the brood tracking process...')
         
         try:
-            yolo_process = subprocess.Popen(
-                ['python', 'run_tracking.py', uploaded_video_path, "0"],
-                stdout=open(os.devnull, 'w'),
-                stderr=open(os.devnull, 'w'),
-                text=True
-            )
-            flash("Tracking process started successfully.")
+            job = submit_tracking(file, flag=0, **tracking_options(request.form))
+            if job.cached:
+                flash(f"This video was already tracked with these settings; job {job.id} uses the cached results.")
+            else:
+                flash(f"Tracking job {job.id} started successfully.")
         except Exception as e:
             flash(f"Error running tracking process: {e}")
             return redirect(url_for('index'))
@@ -184,21 +358,41 @@ def brood():
 
 @app.route('/brood2', methods=['POST'])
 def brood2():
-    most_recent = false_positive.get_most_recent_folder("../runs/detect")
-    if most_recent is None:
+    _, txt_dir = current_run()
+    if txt_dir is None:
         flash("Could not find tracking directory.")
         return redirect(url_for('index'))
     else:
-        flash(most_recent)
-    txt_dir = os.path.join(most_recent, "labels")
+        flash(os.path.dirname(txt_dir))
 
     # 0.535875 0.623067
     larva_pos = request.form.get('larva_pos', '')
-    larva_x = larva_pos.split(",")[0]
-    larva_y = larva_pos.split(",")[1]
-    flash("Larva's x coordinate: ", larva_x)
-    flash("Larva's y coordinate: ", larva_y)
-    test_track.main(txt_dir, larva_x, larva_y)
+    try:
+        larva_x, larva_y = (float(v) for v in larva_pos.split(","))
+    except ValueError:
+        flash("Larva position must be two numbers: x,y")
+        return redirect(url_for('brood_form'))
+    flash(f"Larva's x coordinate: {larva_x}")
+    flash(f"Larva's y coordinate: {larva_y}")
+    try:
+        analysis, _ = test_track.main(txt_dir, larva_x, larva_y, brood_plot_path(txt_dir))
+    except Exception as e:
+        flash(f"Error running brood analysis: {e}")
+        return redirect(url_for('brood_form'))
+    flash(f"Brood analysis done: {len(analysis['two_ant_frames'])} frames with two ants, "
+          f"{len(analysis['frames'])} detections.")
+    return redirect(url_for('brood_form'))
+
+def brood_plot_path(txt_dir):
+    """The brood analysis plot is written next to the run's labels directory."""
+    return os.path.join(os.path.dirname(txt_dir), test_track.BROOD_PLOT)
+
+@app.route('/brood_plot', methods=['GET'])
+def brood_plot():
+    _, txt_dir = current_run()
+    if txt_dir is None or not os.path.exists(brood_plot_path(txt_dir)):
+        return jsonify({'error': 'no brood plot'}), 404
+    return send_file(os.path.abspath(brood_plot_path(txt_dir)), mimetype='image/png', max_age=0)
 
 @app.route('/predict', methods=['POST'])
 def predict():
@@ -211,8 +405,19 @@ def predict():
         flash('No file selected.')
         return redirect(request.url)
     
-    model = YOLO('best3-3(v11m_50).pt')
-    results = model.predict(source=file, save=True, conf=0.1)
+    image = cv2.imdecode(np.frombuffer(file.read(), np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        flash('Could not read the image.')
+        return redirect(url_for('brood_form'))
+
+    # The model is loaded (exported for INFERENCE_BACKEND) and warmed up once per process; only inference runs here.
+    weights = inference_backend.resolve_weights(model_registry.PREDICT_WEIGHTS)
+    with model_registry.registry.use(weights, conf=0.1) as model:
+        results = model.predict(source=image, save=True, conf=0.1, verbose=False)
+
+    for x, y in results[0].boxes.xywhn[:, :2].tolist():
+        flash(f"Detection at {x:.6f},{y:.6f}")
+    return redirect(url_for('brood_form'))
 
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,218 @@
+"""
+Tracks many videos (e.g. a night of recordings) in a pool of worker processes.
+
+Videos come from a directory (searched recursively) or from a manifest: a
+text file with one video path per line ('#' starts a comment) or a JSON list
+of paths. Every video gets a fixed output directory, so reruns and other tools
+find its results without guessing:
+
+  <output>/<video stem>-<hash of the video's absolute path>/
+      labels/, tracks.bin, annotated video   as written by run_tracking.track_video
+      metrics.json, metrics.log              stage timings of the run (see run_metrics)
+  <output>/batch_manifest.json               one record per video: status, fps, frames, ...
+
+The manifest is rewritten after every video, so it is complete up to the last
+finished video even if the batch is interrupted. Videos whose directory holds
+a finished run ("done" in its metrics.json) are skipped unless --force is given;
+any other video is tracked again into an emptied directory.
+
+Each worker limits torch (and OpenMP/MKL) to --threads threads, so workers x
+threads stays within the machine's cores instead of every worker using all of
+them. Workers keep their model loaded between videos.
+
+Usage:
+  python batch_tracking.py recordings/2024-05-01 --flag 0 --workers 4
+  python batch_tracking.py videos.txt --output runs/night1 --workers 2 --threads 8 --stride 2
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import threading
+import time
+
+import run_metrics
+
+OUTPUT_DIR = os.path.join("runs", "batch")
+MANIFEST_NAME = "batch_manifest.json"
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.m4v')
+THREADS_ENV = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS')
+
+
+def find_videos(source):
+    """
+    Video paths of a directory (recursively, sorted) or listed in a manifest
+    (.json list, or text with one path per line; relative paths are relative
+    to the manifest).
+    """
+    if os.path.isdir(source):
+        videos = []
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            videos.extend(os.path.join(root, name) for name in sorted(files)
+                          if name.lower().endswith(VIDEO_EXTENSIONS))
+        return videos
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source) as f:
+        if source.lower().endswith('.json'):
+            paths = json.load(f)
+        else:
+            paths = [line.split('#', 1)[0].strip() for line in f]
+    return [os.path.join(base, path) for path in paths if path]
+
+
+def run_name(video_path):
+    """Output directory name of a video: its stem plus a hash of its absolute path."""
+    digest = hashlib.sha1(os.path.abspath(video_path).encode()).hexdigest()[:8]
+    return f"{os.path.splitext(os.path.basename(video_path))[0]}-{digest}"
+
+
+def default_threads(workers):
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+
+def _init_worker(threads):
+    """Pool initializer: fixes the thread count before torch is imported in this process."""
+    for name in THREADS_ENV:
+        os.environ[name] = str(threads)
+    try:
+        import torch #type:ignore
+        torch.set_num_threads(threads)
+        torch.set_num_interop_threads(1)
+    except (ImportError, RuntimeError):
+        pass
+
+
+def track_one(task):
+    """Worker: tracks one video into its output directory and returns its manifest record."""
+    video_path, output_dir, flag, options = task
+    # Imported here so _init_worker runs before torch is loaded.
+    import ant_interactions
+    import run_tracking
+    name = run_name(video_path)
+    run_dir = os.path.join(output_dir, name)
+    # Ultralytics appends to existing label files, so a rerun (an unfinished run, or --force)
+    # starts from an empty directory instead of adding a second copy of every row.
+    shutil.rmtree(run_dir, ignore_errors=True)
+    os.makedirs(run_dir)
+    metrics = run_metrics.RunMetrics(name, path=os.path.join(run_dir, run_metrics.METRICS_NAME),
+                                     log_path=os.path.join(run_dir, run_metrics.LOG_NAME))
+    interactions = ant_interactions.InteractionCounter()
+    record = {'video': video_path, 'run_dir': run_dir, 'labels_dir': os.path.join(run_dir, 'labels'),
+              'worker': os.getpid()}
+    try:
+        # Without a preview the worker writes nothing outside its run directory.
+        run_tracking.track_video(video_path, flag, threading.Event(), preview_fps=0, project=output_dir,
+                                 name=name, interactions=interactions, metrics=metrics, **options)
+        record['error'] = None
+    except Exception as e:
+        if metrics.status == "running":
+            metrics.finish("failed", str(e))
+        record['error'] = str(e)
+    snapshot = run_metrics.read_metrics(metrics.path) or metrics.snapshot()
+    record.update(status=snapshot['status'], frames=snapshot['frames'], total_frames=snapshot['total_frames'],
+                  seconds=snapshot['elapsed_s'], fps=snapshot['fps'], interactions=interactions.live_count())
+    return record
+
+
+def finished_record(video_path, output_dir):
+    """Manifest record of a video whose run already finished, or None."""
+    run_dir = os.path.join(output_dir, run_name(video_path))
+    snapshot = run_metrics.read_metrics(os.path.join(run_dir, run_metrics.METRICS_NAME))
+    if snapshot is None or snapshot['status'] != "done":
+        return None
+    return {'video': video_path, 'run_dir': run_dir, 'labels_dir': os.path.join(run_dir, 'labels'),
+            'worker': None, 'error': None, 'status': "done", 'frames': snapshot['frames'],
+            'total_frames': snapshot['total_frames'], 'seconds': snapshot['elapsed_s'], 'fps': snapshot['fps'],
+            'interactions': None, 'skipped': True}
+
+
+def write_manifest(path, records, started, workers, threads, flag, options):
+    manifest = {
+        'started': time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(started)),
+        'elapsed_s': round(time.time() - started, 3),
+        'workers': workers,
+        'threads_per_worker': threads,
+        'flag': flag,
+        'options': options,
+        'videos': sorted(records, key=lambda record: record['video']),
+    }
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+    return manifest
+
+
+def run_batch(videos, output_dir=OUTPUT_DIR, flag=0, workers=1, threads=None, force=False, **options):
+    """
+    Tracks every video in a pool of `workers` processes with `threads` torch threads
+    each (default: the cores divided among the workers).
+
+    Parameters:
+      - videos (list): Video paths.
+      - output_dir (str): Where the per-video directories and the manifest are written.
+      - flag (int): Model selection, see run_tracking.load_model.
+      - force (bool): Track videos again even if their directory holds a finished run.
+      - options: stride, roi, batch (see run_tracking.track_video).
+
+    Returns:
+      - manifest (dict): The summary also written to <output_dir>/batch_manifest.json.
+    """
+    threads = threads or default_threads(workers)
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    started = time.time()
+
+    records, tasks = [], []
+    for video in videos:
+        record = None if force else finished_record(video, output_dir)
+        if record is not None:
+            print(f"[skip] {video}: already tracked in {record['run_dir']}")
+            records.append(record)
+        else:
+            tasks.append((video, output_dir, flag, options))
+    write_manifest(manifest_path, records, started, workers, threads, flag, options)
+
+    if tasks:
+        # spawn: workers must not inherit torch threads (or CUDA) from this process.
+        ctx = multiprocessing.get_context('spawn')
+        with ctx.Pool(min(workers, len(tasks)), initializer=_init_worker, initargs=(threads,)) as pool:
+            for record in pool.imap_unordered(track_one, tasks):
+                records.append(record)
+                fps = f"{record['fps']:.1f} fps" if record['fps'] else "-"
+                print(f"[{len(records)}/{len(videos)}] {record['status']:9s} {fps:>12s}  {record['video']}"
+                      + (f"  ({record['error']})" if record['error'] else ""))
+                write_manifest(manifest_path, records, started, workers, threads, flag, options)
+    manifest = write_manifest(manifest_path, records, started, workers, threads, flag, options)
+    print(f"Manifest written to {manifest_path}")
+    return manifest
+
+
+if __name__ == "__main__":
+    import run_tracking
+    parser = argparse.ArgumentParser(description="Track every video of a directory or manifest in parallel.")
+    parser.add_argument("source", help="Directory of videos, or a manifest (.txt one path per line, or .json list).")
+    parser.add_argument("--flag", type=int, default=0, help="0 for best1-2.pt, anything else for best3-3(v11m_50).pt")
+    parser.add_argument("--output", default=OUTPUT_DIR, help="Directory of the per-video outputs and the manifest.")
+    parser.add_argument("--workers", type=int, default=1, help="Videos tracked at the same time.")
+    parser.add_argument("--threads", type=int, help="Torch threads per worker (default: cores / workers).")
+    parser.add_argument("--force", action="store_true", help="Track videos again that already have a finished run.")
+    parser.add_argument("--stride", type=int, default=1,
+                        help="Detect on every stride-th frame only and interpolate the tracks in between.")
+    parser.add_argument("--roi", type=run_tracking.parse_roi, default=None,
+                        help="Crop frames to x_min,y_min,x_max,y_max (normalized) before inference.")
+    parser.add_argument("--batch", type=int, default=1, help="Frames per detector call.")
+    args = parser.parse_args()
+
+    videos = find_videos(args.source)
+    if not videos:
+        parser.error(f"No videos found in {args.source}")
+    options = {'stride': args.stride, 'roi': args.roi, 'batch': args.batch}
+    manifest = run_batch(videos, args.output, args.flag, args.workers, args.threads, args.force, **options)
+    failed = [record for record in manifest['videos'] if record['status'] != "done"]
+    if failed:
+        print(f"{len(failed)} of {len(videos)} videos did not finish.")
+        sys.exit(1)
@@ -0,0 +1,334 @@
+"""
+Benchmarks of the post-tracking analysis pipeline on synthetic runs.
+
+Every stage runs in a fresh process on a synthetic run (see synthetic_data.py),
+so peak RSS belongs to that stage alone. No model or GPU is needed.
+
+Reported per stage and scale:
+  - fps            frames of the run processed per second
+  - peak_rss_mb    peak resident memory of the stage's process (ru_maxrss)
+  - files_opened   files opened from Python while the stage ran (audit 'open'
+                   events; files OpenCV opens in C++ are not counted)
+
+Usage:
+  python benchmark.py                                   # default scales, writes bench_results.json
+  python benchmark.py --scales 1000x2,1000x50 --stages interactions_batched,brood
+  python benchmark.py --output baseline.json            # record a baseline
+  python benchmark.py --compare baseline.json           # flag regressions against it
+  python benchmark.py --density                         # interaction broad phase vs all pairs, by ants per frame
+  python benchmark.py --render                          # parallel vs serial false-positive rendering
+"""
+import argparse
+import importlib
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+from collections import defaultdict
+
+# Keep matplotlib off any display.
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+import numpy as np #type:ignore
+import synthetic_data
+import track_store
+
+DATA_DIR = "bench_data"
+RESULTS_PATH = "bench_results.json"
+# (frames, ants per frame)
+DEFAULT_SCALES = [(1000, 2), (10000, 2), (100000, 2), (1000, 50), (10000, 50), (1000, 500)]
+DEFAULT_CHURN = 0.001
+# --density: interaction detection at increasing numbers of ants per frame.
+DENSITY_SCALES = [(1000, n) for n in (2, 10, 50, 100, 200, 500, 1000)]
+DENSITY_STAGES = ('interactions_dense', 'interactions_sweep')
+# --render: serial and parallel (one worker per core) false-positive rendering.
+RENDER_SCALES = [(2000, 10), (10000, 10)]
+RENDER_STAGES = ('false_positive', 'false_positive_parallel')
+# Stages that need a video only run on runs up to this many frames.
+MAX_VIDEO_FRAMES = 10000
+STAGE_TIMEOUT = 600
+# Relative fps drop / RSS increase reported as a regression by --compare.
+TOLERANCE = 0.2
+
+
+def stage_convert_labels(run, workdir):
+    track_store.convert_labels(run['labels_dir'], os.path.join(workdir, "converted.bin"))
+    return run['frames']
+
+def stage_false_positive(run, workdir, workers=1):
+    import false_positive
+    false_positive.process_video("", "1,2", run['video_path'], run['labels_dir'],
+                                 os.path.join(workdir, "fp.mp4"), workers=workers)
+    return run['frames']
+
+def stage_false_positive_parallel(run, workdir):
+    return stage_false_positive(run, workdir, workers=os.cpu_count() or 1)
+
+def stage_interactions(run, workdir):
+    import ant_interactions
+    ant_interactions.track_ant_interactions(run['labels_dir'])
+    return run['frames']
+
+def stage_interactions_batched(run, workdir):
+    import ant_interactions
+    ant_interactions.track_ant_interactions_batched(run['labels_dir'])
+    return run['frames']
+
+def stage_interactions_dense(run, workdir):
+    """Overlapping pairs by testing every pair of boxes per frame (no broad phase)."""
+    import ant_interactions
+    ant_interactions.overlapping_pairs_dense(track_store.open_tracks(run['labels_dir']))
+    return run['frames']
+
+def stage_interactions_sweep(run, workdir):
+    """Overlapping pairs with the sort-and-sweep broad phase."""
+    import ant_interactions
+    ant_interactions.overlapping_pairs(track_store.open_tracks(run['labels_dir']))
+    return run['frames']
+
+def stage_brood(run, workdir):
+    import test_track
+    test_track.main(run['labels_dir'], 0.5, 0.5, os.path.join(workdir, test_track.BROOD_PLOT))
+    return run['frames']
+
+def stage_stitch(run, workdir):
+    import tracklet_stitching
+    tracks = track_store.TrackStore(run['store_path'], remap=False)
+    tracklet_stitching.stitch_tracks(tracks)
+    return run['frames']
+
+def stage_trajectory(run, workdir):
+    """Replays the run's tracks through trajectory.TrajectoryRenderer on blank frames."""
+    import trajectory
+    tracks = track_store.TrackStore(run['store_path'])
+    width, height = synthetic_data.VIDEO_SIZE
+    blank = np.zeros((height, width, 3), dtype=np.uint8)
+    renderer = trajectory.TrajectoryRenderer((width, height))
+    for i in range(len(tracks)):
+        rows = tracks.frame(i)
+        rows = rows[rows['track_id'] >= 0]
+        renderer.update(i, rows['track_id'].tolist(), np.column_stack([rows['x'] * width, rows['y'] * height]))
+        renderer.draw(blank.copy())
+    return len(tracks)
+
+# name -> (function, needs a video, module imported before measuring)
+STAGES = {
+    'convert_labels': (stage_convert_labels, False, 'track_store'),
+    'false_positive': (stage_false_positive, True, 'false_positive'),
+    'false_positive_parallel': (stage_false_positive_parallel, True, 'false_positive'),
+    'interactions': (stage_interactions, False, 'ant_interactions'),
+    'interactions_batched': (stage_interactions_batched, False, 'ant_interactions'),
+    'interactions_dense': (stage_interactions_dense, False, 'ant_interactions'),
+    'interactions_sweep': (stage_interactions_sweep, False, 'ant_interactions'),
+    'brood': (stage_brood, False, 'test_track'),
+    'stitch': (stage_stitch, False, 'tracklet_stitching'),
+    'trajectory': (stage_trajectory, False, 'trajectory'),
+}
+
+
+def prepare_run(frames, ants, churn=DEFAULT_CHURN, data_dir=DATA_DIR, video=True, seed=0):
+    """Generates (or reuses) the synthetic run for one scale."""
+    run_dir = os.path.join(data_dir, f"{frames}x{ants}_churn{churn:g}_seed{seed}")
+    store_path = os.path.join(run_dir, track_store.STORE_NAME)
+    video_path = os.path.join(run_dir, f"{synthetic_data.VIDEO_STEM}.mp4")
+    if not os.path.exists(store_path) or (video and not os.path.exists(video_path)):
+        print(f"Generating synthetic run {run_dir} ...")
+        synthetic_data.generate_run(run_dir, frames, ants, id_churn=churn, video=video, seed=seed)
+    return {
+        'frames': frames,
+        'ants': ants,
+        'run_dir': run_dir,
+        'labels_dir': os.path.join(run_dir, "labels"),
+        'store_path': store_path,
+        'video_path': video_path if os.path.exists(video_path) else None,
+    }
+
+
+def _peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS.
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def _run_stage(name, run, workdir, queue):
+    """Child process: runs one stage and reports its measurements."""
+    counter = {'open': 0, 'active': False}
+
+    def audit(event, args):
+        if event == 'open' and counter['active']:
+            counter['open'] += 1
+    sys.addaudithook(audit)
+
+    function, _, module = STAGES[name]
+    # Imports would otherwise dominate the open() count.
+    importlib.import_module(module)
+    rss_before = _peak_rss_mb()
+    counter['active'] = True
+    start = time.perf_counter()
+    frames = function(run, workdir)
+    seconds = time.perf_counter() - start
+    counter['active'] = False
+    queue.put({
+        'seconds': seconds,
+        'fps': frames / seconds if seconds > 0 else None,
+        'peak_rss_mb': _peak_rss_mb(),
+        'rss_before_mb': rss_before,
+        'files_opened': counter['open'],
+    })
+
+
+def run_stage(name, run, timeout=STAGE_TIMEOUT):
+    """Runs a stage in a fresh spawned process; returns its result record."""
+    workdir = os.path.join(run['run_dir'], "bench_" + name)
+    os.makedirs(workdir, exist_ok=True)
+    record = {'stage': name, 'frames': run['frames'], 'ants': run['ants']}
+
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    process = ctx.Process(target=_run_stage, args=(name, run, workdir, queue))
+    process.start()
+    process.join(timeout)
+    if process.is_alive():
+        process.terminate()
+        process.join()
+        record['status'] = 'timeout'
+    elif process.exitcode != 0:
+        record['status'] = f'failed (exit code {process.exitcode})'
+    else:
+        record.update(queue.get())
+        record['status'] = 'ok'
+    return record
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """
+    Prints fps and peak RSS of `results` relative to `baseline` and returns the
+    list of regressions (fps dropped or RSS grew by more than `tolerance`).
+    """
+    previous = {(r['stage'], r['frames'], r['ants']): r for r in baseline['results']}
+    regressions = []
+    for record in results:
+        old = previous.get((record['stage'], record['frames'], record['ants']))
+        if old is None or record['status'] != 'ok' or old['status'] != 'ok':
+            continue
+        fps_ratio = record['fps'] / old['fps']
+        rss_ratio = record['peak_rss_mb'] / old['peak_rss_mb']
+        label = f"{record['stage']} {record['frames']}x{record['ants']}"
+        print(f"{label:40s} fps x{fps_ratio:.2f}  rss x{rss_ratio:.2f}  "
+              f"files {old['files_opened']} -> {record['files_opened']}")
+        if fps_ratio < 1 - tolerance or rss_ratio > 1 + tolerance:
+            regressions.append(label)
+    return regressions
+
+
+def print_density(results):
+    """Speed-up of the broad phase (interactions_sweep) over testing all pairs, per density."""
+    by_scale = defaultdict(dict)
+    for record in results:
+        if record['status'] == 'ok':
+            by_scale[(record['frames'], record['ants'])][record['stage']] = record['fps']
+    print(f"{'ants/frame':>10s} {'all pairs fps':>14s} {'broad phase fps':>16s} {'speed-up':>9s}")
+    for (frames, ants), fps in sorted(by_scale.items(), key=lambda item: item[0][1]):
+        dense, sweep = fps.get('interactions_dense'), fps.get('interactions_sweep')
+        if dense and sweep:
+            print(f"{ants:>10d} {dense:>14.1f} {sweep:>16.1f} {sweep / dense:>8.2f}x")
+
+
+def print_render(results):
+    """Speed-up of parallel false-positive rendering over the serial render, per scale."""
+    by_scale = defaultdict(dict)
+    for record in results:
+        if record['status'] == 'ok':
+            by_scale[(record['frames'], record['ants'])][record['stage']] = record['fps']
+    print(f"{'frames':>7s} {'serial fps':>11s} {'parallel fps':>13s} {'speed-up':>9s}  ({os.cpu_count()} cores)")
+    for (frames, ants), fps in sorted(by_scale.items()):
+        serial, parallel = fps.get('false_positive'), fps.get('false_positive_parallel')
+        if serial and parallel:
+            print(f"{frames:>7d} {serial:>11.1f} {parallel:>13.1f} {parallel / serial:>8.2f}x")
+
+
+def parse_scales(text):
+    """'1000x2,10000x50' -> [(1000, 2), (10000, 50)]"""
+    scales = []
+    for item in text.split(','):
+        frames, ants = item.lower().split('x')
+        scales.append((int(frames), int(ants)))
+    return scales
+
+
+def main(scales=DEFAULT_SCALES, stages=tuple(STAGES), churn=DEFAULT_CHURN, data_dir=DATA_DIR,
+         max_video_frames=MAX_VIDEO_FRAMES, timeout=STAGE_TIMEOUT):
+    results = []
+    for frames, ants in scales:
+        video = frames <= max_video_frames and any(STAGES[s][1] for s in stages)
+        run = prepare_run(frames, ants, churn, data_dir, video=video)
+        for name in stages:
+            if STAGES[name][1] and run['video_path'] is None:
+                continue
+            record = run_stage(name, run, timeout)
+            results.append(record)
+            if record['status'] == 'ok':
+                print(f"{name:24s} {frames:>7d} frames x {ants:<4d} ants  {record['fps']:12.1f} frames/s  "
+                      f"{record['peak_rss_mb']:8.1f} MB  {record['files_opened']:>7d} files")
+            else:
+                print(f"{name:24s} {frames:>7d} frames x {ants:<4d} ants  {record['status']}")
+    return {
+        'created': time.strftime("%Y-%m-%d %H:%M:%S"),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'churn': churn,
+        'results': results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the analysis pipeline on synthetic runs.")
+    parser.add_argument("--scales", type=parse_scales,
+                        help="Comma-separated FRAMESxANTS, e.g. 1000x2,10000x50.")
+    parser.add_argument("--stages", help=f"Comma-separated stages out of: {', '.join(STAGES)}.")
+    parser.add_argument("--density", action="store_true",
+                        help="Compare interaction detection with and without the broad phase at increasing "
+                             "ants per frame (default scales and stages for this).")
+    parser.add_argument("--render", action="store_true",
+                        help="Compare parallel with serial false-positive rendering (default scales and stages "
+                             "for this).")
+    parser.add_argument("--churn", type=float, default=DEFAULT_CHURN,
+                        help="Probability per ant and frame of the tracker assigning a new ID.")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="Where the synthetic runs are generated and kept.")
+    parser.add_argument("--max-video-frames", type=int, default=MAX_VIDEO_FRAMES,
+                        help="Largest run for which a video is generated and rendering stages run.")
+    parser.add_argument("--timeout", type=float, default=STAGE_TIMEOUT, help="Seconds before a stage is abandoned.")
+    parser.add_argument("--output", default=RESULTS_PATH, help="JSON file the results are written to.")
+    parser.add_argument("--compare", help="Baseline JSON to compare the results against.")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+                        help="Relative fps drop or RSS growth counted as a regression.")
+    args = parser.parse_args()
+
+    if args.scales is None:
+        args.scales = DENSITY_SCALES if args.density else RENDER_SCALES if args.render else DEFAULT_SCALES
+    if args.stages is None:
+        args.stages = ",".join(DENSITY_STAGES if args.density else RENDER_STAGES if args.render else STAGES)
+    stages = [s.strip() for s in args.stages.split(',') if s.strip()]
+    unknown = [s for s in stages if s not in STAGES]
+    if unknown:
+        parser.error(f"Unknown stages: {', '.join(unknown)}")
+
+    report = main(args.scales, stages, args.churn, args.data_dir, args.max_video_frames, args.timeout)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+    if args.density:
+        print_density(report['results'])
+    if args.render:
+        print_render(report['results'])
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report['results'], json.load(f), args.tolerance)
+        if regressions:
+            print("Regressions: " + ", ".join(regressions))
+            sys.exit(1)
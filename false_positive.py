@@ -1,41 +1,293 @@
 import cv2 #type:ignore
-import glob
+import functools
 import os
+import queue
 import shutil
-from pathlib import Path
+import subprocess
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import run_metrics
+import numpy as np #type:ignore
+import track_store
 
-def duplicate_directory(source_dir, destination_dir):
+# Track indexes kept per process (most recently rendered runs), so repeated FP/TP
+# edits of a run reuse the same index without piling up in the long-lived app.
+TRACK_INDEX_CACHE_SIZE = 8
+
+# Threads drawing boxes while one thread decodes and another encodes (see render_range).
+ANNOTATE_WORKERS = 2
+# Memory the decoded frames of one render may take at most.
+MAX_BUFFER_MB = 256
+# Keyframe interval of OpenCV's ffmpeg writer: it starts an intra frame every 12 frames.
+# Parallel renders cut the video only there, so every segment starts on a keyframe that
+# a serial render would have written too.
+WRITER_GOP = 12
+
+def load_tracks(txt_dir):
     """
-    Duplicates the source directory to destination directory.
-    This can be used to back up the directory before processing.
+    Loads the tracking results of a run from its track store (built from the
+    label files in txt_dir if the tracker did not write one).
     """
-    try:
-        shutil.copytree(source_dir, destination_dir, dirs_exist_ok=True)
-        print(f"Directory '{source_dir}' successfully copied to '{destination_dir}'")
-    except FileExistsError:
-        print(f"Error: Directory '{destination_dir}' already exists.")
-    except Exception as e:
-        print(f"An error occurred: {e}")
+    return track_store.open_tracks(txt_dir)
+
+def load_track_index(txt_dir):
+    """
+    Returns the TrackIndex (track ID -> frames and rows) of the run in txt_dir,
+    building it only the first time the run is processed.
+    """
+    tracks = load_tracks(txt_dir)
+    remap_path = track_store.remap_path_for(tracks.path)
+    return _track_index(os.path.abspath(tracks.path), os.path.getmtime(tracks.path),
+                        os.path.getmtime(remap_path) if os.path.exists(remap_path) else None)
+
+@functools.lru_cache(maxsize=TRACK_INDEX_CACHE_SIZE)
+def _track_index(store_path, store_mtime, remap_mtime):
+    """TrackIndex of a store, cached by path and the mtimes of the store and its ID remap table."""
+    return track_store.TrackIndex(track_store.TrackStore(store_path))
+
+def draw_boxes(frame, rows, normalized=True):
+    """
+    Draws the bounding boxes and track IDs of one frame's store rows onto frame.
+    """
+    frame_height, frame_width = frame.shape[:2]
+    for row in rows:
+        track_id = int(row['track_id'])
+
+        x_center = float(row['x'])
+        y_center = float(row['y'])
+        box_width = float(row['w'])
+        box_height = float(row['h'])
+
+        if normalized:
+            x_center *= frame_width
+            y_center *= frame_height
+            box_width *= frame_width
+            box_height *= frame_height
+
+        x1 = int(x_center - box_width / 2)
+        y1 = int(y_center - box_height / 2)
+        x2 = int(x_center + box_width / 2)
+        y2 = int(y_center + box_height / 2)
+
+        cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
+        label = f"ID:{track_id}"
+        cv2.putText(frame, label, (x1, y1 - 10),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
+    return frame
 
-def get_most_recent_folder(directory):
+class BufferPool:
     """
-    Finds the most recently created subdirectory in the given directory
-    that starts with 'track'. Returns its path or None if not found.
+    Fixed set of preallocated frame buffers shared by the render pipeline.
+    get() blocks while every buffer is in use, which bounds the frames in flight.
     """
-    # List only subdirectories that start with "track"
-    folders = [
-        os.path.join(directory, d)
-        for d in os.listdir(directory)
-        if os.path.isdir(os.path.join(directory, d)) and d.startswith("track")
-    ]
-    if not folders:
+    def __init__(self, count, shape):
+        self._free = queue.Queue()
+        for _ in range(count):
+            self._free.put(np.empty(shape, dtype=np.uint8))
+
+    def get(self, stop_event):
+        while not stop_event.is_set():
+            try:
+                return self._free.get(timeout=0.1)
+            except queue.Empty:
+                pass
         return None
-    most_recent_folder = max(folders, key=os.path.getctime)
-    return most_recent_folder
 
-def process_video(true_positive_ids_input, false_positive_ids_input, video_path, txt_dir, output_video, normalized=True):
+    def put(self, buffer):
+        self._free.put(buffer)
+
+def render_range(video_path, store_path, keep, output_video, start=0, stop=None, normalized=True, metrics=None,
+                 annotate_workers=ANNOTATE_WORKERS, max_buffer_mb=MAX_BUFFER_MB):
+    """
+    Renders frames [start, stop) of the video (stop=None: until the end) with the
+    kept rows of the track store drawn on them, and writes them to output_video.
+    If metrics (run_metrics.RunMetrics) is given, decode/draw/encode times are recorded.
+
+    Decoding, drawing and encoding overlap: a decoder thread reads frames into a pool
+    of preallocated buffers, `annotate_workers` threads draw the boxes (OpenCV releases
+    the GIL while drawing) and this thread encodes the frames in order and hands their
+    buffers back. The pool holds at most max_buffer_mb of frames (at least 3), so memory
+    stays bounded however far the decoder gets ahead of the encoder. Frames are drawn
+    and written exactly as before, so the output is byte-identical to a serial render.
+
+    Returns:
+      - frames_written (int): Number of frames rendered.
+    """
+    tracks = track_store.TrackStore(store_path)
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise IOError(f"Cannot open video file: {video_path}")
+    if start > 0:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+        if int(cap.get(cv2.CAP_PROP_POS_FRAMES)) != start:
+            # The backend could not seek exactly; decode up to the start frame instead.
+            cap.release()
+            cap = cv2.VideoCapture(video_path)
+            for _ in range(start):
+                cap.grab()
+
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    out = cv2.VideoWriter(output_video, cv2.VideoWriter_fourcc(*'mp4v'), fps, (frame_width, frame_height))
+    if not out.isOpened():
+        cap.release()
+        raise IOError(f"Cannot write video: {output_video}")
+
+    if metrics is None:
+        metrics = run_metrics.RunMetrics(os.path.basename(output_video))
+    if metrics.total_frames is None:
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        metrics.total_frames = (min(stop, total_frames) if stop is not None else total_frames) - start
+
+    shape = (frame_height, frame_width, 3)
+    frame_bytes = frame_height * frame_width * 3
+    pool = BufferPool(max(3, int(max_buffer_mb * 1024 * 1024) // max(frame_bytes, 1)), shape)
+    to_annotate = queue.Queue()
+    to_encode = queue.Queue()
+    stop_event = threading.Event()
+    errors = []
+
+    def decode():
+        frame_index = start
+        try:
+            while stop is None or frame_index < stop:
+                buffer = pool.get(stop_event)
+                if buffer is None:
+                    break
+                with metrics.time("decode"):
+                    # read() decodes into the buffer when its shape matches the frame.
+                    ret, frame = cap.read(buffer)
+                if not ret:
+                    pool.put(buffer)
+                    break  # end of video
+                to_annotate.put((frame_index, frame, buffer))
+                frame_index += 1
+        except Exception as e:
+            errors.append(e)
+            stop_event.set()
+        finally:
+            for _ in range(annotate_workers):
+                to_annotate.put(None)
+
+    def annotate():
+        try:
+            while True:
+                item = to_annotate.get()
+                if item is None:
+                    break
+                frame_index, frame, buffer = item
+                with metrics.time("draw"):
+                    if frame_index < len(tracks):
+                        first, last = tracks.offsets[frame_index], tracks.offsets[frame_index + 1]
+                        rows = tracks.rows[first:last][keep[first:last]]
+                    else:
+                        rows = tracks.rows[:0]
+
+                    draw_boxes(frame, rows, normalized)
+                to_encode.put((frame_index, frame, buffer))
+        except Exception as e:
+            errors.append(e)
+            stop_event.set()
+        finally:
+            to_encode.put(None)
+
+    threads = [threading.Thread(target=decode, daemon=True)]
+    threads += [threading.Thread(target=annotate, daemon=True) for _ in range(annotate_workers)]
+    for thread in threads:
+        thread.start()
+
+    # Encode on this thread, in frame order; frames drawn out of order wait in `ready`.
+    frame_index = start
+    ready = {}
+    running = annotate_workers
+    try:
+        while running:
+            item = to_encode.get()
+            if item is None:
+                running -= 1
+                continue
+            ready[item[0]] = item
+            while frame_index in ready:
+                _, frame, buffer = ready.pop(frame_index)
+                if not stop_event.is_set():
+                    with metrics.time("encode"):
+                        out.write(frame)
+                    metrics.frame_done()
+                pool.put(buffer)
+                frame_index += 1
+    finally:
+        stop_event.set()
+        for thread in threads:
+            thread.join()
+        cap.release()
+        out.release()
+    if errors:
+        raise errors[0]
+    return frame_index - start
+
+def concat_videos(segment_paths, output_video):
+    """
+    Joins video segments into output_video without re-encoding (ffmpeg concat demuxer).
+    """
+    list_path = output_video + ".segments.txt"
+    with open(list_path, 'w') as f:
+        for path in segment_paths:
+            f.write(f"file '{os.path.abspath(path)}'\n")
+    try:
+        subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0',
+                        '-i', list_path, '-c', 'copy', output_video], check=True)
+    finally:
+        os.remove(list_path)
+
+def segment_bounds(total_frames, workers, gop=WRITER_GOP):
+    """
+    Start frames of up to `workers` frame ranges of about equal length, each a
+    multiple of gop, followed by None (the end of the video).
+    """
+    starts = sorted({round(total_frames * i / workers / gop) * gop for i in range(workers)})
+    return [start for start in starts if start < total_frames or start == 0] + [None]
+
+def render_parallel(video_path, store_path, keep, output_video, workers, normalized=True):
+    """
+    Splits the video into one frame range per worker and renders the ranges in a
+    process pool (each with its own seek and writer), then joins the segments
+    without re-encoding. Ranges start on multiples of WRITER_GOP, where a serial
+    render writes a keyframe too, so the joined video has the serial render's
+    GOPs; only the encoder's rate control starts afresh in each segment, which can
+    change the frames of the GOP after a cut by a few grey levels on a few pixels.
+    Needs ffmpeg (see concat_videos).
     """
-    Processes the tracking results by removing false positive bounding boxes.
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise IOError(f"Cannot open video file: {video_path}")
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+
+    bounds = segment_bounds(total_frames, workers)
+    root, ext = os.path.splitext(output_video)
+    segment_paths = [f"{root}.part{i}{ext}" for i in range(len(bounds) - 1)]
+    try:
+        with ProcessPoolExecutor(max_workers=len(segment_paths)) as pool:
+            futures = [pool.submit(render_range, video_path, store_path, keep, segment_paths[i],
+                                   bounds[i], bounds[i + 1], normalized)
+                       for i in range(len(segment_paths))]
+            frames_written = sum(future.result() for future in futures)
+        concat_videos(segment_paths, output_video)
+    finally:
+        for path in segment_paths:
+            if os.path.exists(path):
+                os.remove(path)
+    return frames_written
+
+def process_video(true_positive_ids_input, false_positive_ids_input, video_path, txt_dir, output_video, normalized=True, workers=1,
+                  metrics=None):
+    """
+    Re-renders the tracking video without the false positive bounding boxes.
+    The label files are never modified: false positives are masked out of the
+    run's track index at render time.
     
     Parameters:
       - true_positive_ids_input (str): Comma-separated true positive IDs.
@@ -44,36 +296,28 @@ def process_video(true_positive_ids_input, false_positive_ids_input, video_path,
       - txt_dir (str): Directory containing YOLO label (.txt) files.
       - output_video (str): Filename for the updated tracking video.
       - normalized (bool): Whether coordinates in the txt files are normalized.
+      - workers (int): Number of processes rendering frame ranges in parallel.
+      - metrics (run_metrics.RunMetrics): Receives the stage timings and progress of the render.
       
     Returns:
       - output_video (str): The name of the saved video with updated bounding boxes.
     """
+    index = load_track_index(txt_dir)
+    tracks = index.store
+
     # --- Determine the set of false positive IDs ---
     if true_positive_ids_input.strip():
         # If the user provided true-positive IDs, calculate false positives as:
         # false_positive_ids = all IDs in the txt files - true_positive_ids.
         try:
             true_positive_ids = set(int(x.strip()) for x in true_positive_ids_input.split(',') if x.strip().isdigit())
+            # IDs read off the tracking video may have been merged by tracklet stitching.
+            true_positive_ids = set(tracks.remap_ids(sorted(true_positive_ids)).tolist())
         except Exception as e:
             print("Error parsing true positive IDs:", e)
             true_positive_ids = set()
-        # Gather all track IDs from the txt files.
-        txt_files = sorted(glob.glob(os.path.join(txt_dir, "*.txt")))
-        all_track_ids = set()
-        for txt_file in txt_files:
-            with open(txt_file, 'r') as f:
-                for line in f:
-                    line = line.strip()
-                    if not line:
-                        continue
-                    parts = line.split()
-                    if len(parts) < 6:
-                        continue
-                    try:
-                        track_id = int(parts[-1])
-                        all_track_ids.add(track_id)
-                    except ValueError:
-                        continue
+        # Gather all track IDs from the track store.
+        all_track_ids = set(index.track_ids.tolist())
         false_positive_ids = all_track_ids - true_positive_ids
         print("All track IDs found:", all_track_ids)
         print("True positive IDs:", true_positive_ids)
@@ -81,6 +325,7 @@ def process_video(true_positive_ids_input, false_positive_ids_input, video_path,
     elif false_positive_ids_input.strip():
         try:
             false_positive_ids = set(int(x.strip()) for x in false_positive_ids_input.split(',') if x.strip().isdigit())
+            false_positive_ids = set(tracks.remap_ids(sorted(false_positive_ids)).tolist())
         except Exception as e:
             print("Error parsing false positive IDs:", e)
             false_positive_ids = set()
@@ -90,29 +335,8 @@ def process_video(true_positive_ids_input, false_positive_ids_input, video_path,
         print("No ID input provided.")
         return
 
-    # --- Step 1: Remove false positive lines from each txt file ---
-    # txt_files = sorted(glob.glob(os.path.join(txt_dir, "*.txt")))
-    txt_files = sorted(Path(txt_dir).iterdir(), key=os.path.getmtime)
-    for txt_file in txt_files:
-        with open(txt_file, 'r') as f:
-            lines = f.readlines()
-        filtered_lines = []
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
-            parts = line.split()
-            if len(parts) < 6:
-                continue
-            try:
-                track_id = int(parts[-1])
-            except ValueError:
-                continue
-            if track_id not in false_positive_ids:
-                filtered_lines.append(line + "\n")
-        with open(txt_file, 'w') as f:
-            f.writelines(filtered_lines)
-    print("False positive lines removed from txt files.")
+    # --- Step 1: Mask out the false positive tracks ---
+    keep = index.keep_mask(false_positive_ids)
 
     # --- Step 2: Re-render the tracking video with updated bounding boxes ---
     # If the output video already exists, delete it
@@ -120,73 +344,29 @@ def process_video(true_positive_ids_input, false_positive_ids_input, video_path,
         os.remove(output_video)
         print(f"Existing file {output_video} removed.")
         
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        raise IOError(f"Cannot open video file: {video_path}")
-
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    # Parallel rendering needs ffmpeg to join the segments without re-encoding.
+    if workers > 1 and shutil.which('ffmpeg') is None:
+        print("ffmpeg not found, falling back to serial rendering.")
+        workers = 1
 
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    out = cv2.VideoWriter(output_video, fourcc, fps, (frame_width, frame_height))
-
-    frame_index = 0
-    total_txt = len(txt_files)
-
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break  # end of video
-
-        if frame_index < total_txt:
-            txt_file = txt_files[frame_index]
-            with open(txt_file, 'r') as f:
-                lines = f.readlines()
-
-            for line in lines:
-                parts = line.strip().split()
-                if len(parts) < 6:
-                    continue
-
-                try:
-                    class_id = int(parts[0])
-                    x_center = float(parts[1])
-                    y_center = float(parts[2])
-                    box_width = float(parts[3])
-                    box_height = float(parts[4])
-                    track_id = int(parts[5])
-                except ValueError:
-                    continue
-
-                if normalized:
-                    x_center *= frame_width
-                    y_center *= frame_height
-                    box_width *= frame_width
-                    box_height *= frame_height
-
-                x1 = int(x_center - box_width / 2)
-                y1 = int(y_center - box_height / 2)
-                x2 = int(x_center + box_width / 2)
-                y2 = int(y_center + box_height / 2)
-
-                cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                label = f"ID:{track_id}"
-                cv2.putText(frame, label, (x1, y1 - 10),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-
-        out.write(frame)
-        frame_index += 1
-
-    cap.release()
-    out.release()
-    cv2.destroyAllWindows()
+    if metrics is None:
+        metrics = run_metrics.RunMetrics(os.path.basename(output_video))
+    try:
+        if workers > 1:
+            # The workers render in other processes, so only the whole render is timed here.
+            with metrics.time("render_parallel"):
+                frames_written = render_parallel(video_path, tracks.path, keep, output_video, workers, normalized)
+            metrics.frames = metrics.total_frames = frames_written
+        else:
+            render_range(video_path, tracks.path, keep, output_video, normalized=normalized, metrics=metrics)
+    except Exception as e:
+        metrics.finish("failed", str(e))
+        raise
+    metrics.finish()
 
     print(f"Updated tracking video saved as {output_video}")
-    return
+    return output_video
 
 if __name__ == '__main__':
-    # For testing duplicate_directory:
-    duplicate_directory("runs/detect/track1/labels", "runs/detect/track1/labels_backup")
-    # For testing process_video, uncomment below:
-    # process_video("", "", "30.mp4", "runs/detect/track1/labels", "updated_tracking_video.mp4", normalized=True)
+    # For testing process_video:
+    process_video("", "3,8", "30.mp4", "runs/detect/track1/labels", "updated_tracking_video.mp4", normalized=True)
@@ -0,0 +1,379 @@
+"""
+CPU inference backends for the YOLO weights: PyTorch, ONNX Runtime or OpenVINO.
+
+The tracking hosts have no GPU, and PyTorch CPU inference is the slowest part
+of tracking. With INFERENCE_BACKEND set, the weights are exported once with
+ultralytics' exporter and the model registry loads the exported artifact
+instead of the .pt file; ultralytics runs it through onnxruntime/openvino, so
+tracking, prediction and the tracker are otherwise unchanged.
+
+Backends (INFERENCE_BACKEND, or --backend):
+  torch          the .pt weights (default)
+  onnx           ONNX Runtime, FP32
+  onnx-int8      ONNX Runtime, INT8 (static quantization, QDQ, per channel)
+  openvino       OpenVINO, FP32
+  openvino-int8  OpenVINO, INT8 (post-training quantization with NNCF)
+
+INT8 models are calibrated on CALIBRATION_FRAMES frames sampled evenly from
+CALIBRATION_VIDEO, one of our own recordings, so the activation ranges fit
+our images rather than COCO's.
+
+Exported artifacts are cached by content:
+
+  exports/<key>/             key: hash of the weights bytes, backend, INT8, image size,
+                             ultralytics version and (INT8) the calibration video's bytes
+  exports/<key>/export.json  what was exported, the artifact's name and the export time
+
+Usage:
+  python inference_backend.py export --flag 0 --backend openvino-int8 --calibration 30.mp4
+  python inference_backend.py benchmark 30.mp4 --flag 0 --backends torch,onnx,openvino,openvino-int8
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import cv2 #type:ignore
+import numpy as np #type:ignore
+import model_registry
+import result_cache
+
+BACKENDS = ('torch', 'onnx', 'onnx-int8', 'openvino', 'openvino-int8')
+BACKEND = os.environ.get('INFERENCE_BACKEND', 'torch')
+EXPORT_DIR = os.environ.get('EXPORT_DIR', 'exports')
+EXPORT_NAME = 'export.json'
+EXPORT_IMGSZ = 640
+CALIBRATION_VIDEO = os.environ.get('CALIBRATION_VIDEO', '2ants_cropped.mp4')
+CALIBRATION_FRAMES = 300
+BENCHMARK_FRAMES = 300
+BENCHMARK_PATH = 'backend_benchmark.json'
+# Letterbox padding value ultralytics uses.
+PAD_VALUE = 114
+
+
+def parse_backend(spec):
+    """Splits a backend name like 'openvino-int8' into ('openvino', True)."""
+    if spec not in BACKENDS:
+        raise ValueError(f"Unknown inference backend {spec!r}; expected one of {', '.join(BACKENDS)}")
+    runtime, _, precision = spec.partition('-')
+    return runtime, precision == 'int8'
+
+
+def export_key(weights, backend, calibration_video=None, imgsz=EXPORT_IMGSZ):
+    """Cache key of an exported model (see the module docstring)."""
+    try:
+        import ultralytics #type:ignore
+        version = ultralytics.__version__
+    except ImportError:
+        version = None
+    _, int8 = parse_backend(backend)
+    parts = {
+        'weights': result_cache.file_digest(weights),
+        'backend': backend,
+        'imgsz': imgsz,
+        'ultralytics': version,
+        'calibration': result_cache.file_digest(calibration_video) if int8 else None,
+    }
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()[:32]
+
+
+def letterbox(image, imgsz=EXPORT_IMGSZ):
+    """
+    Model input of one BGR frame, preprocessed like ultralytics does for exported
+    models: scaled into an imgsz square, padded with PAD_VALUE, RGB, CHW, 0..1.
+    """
+    h, w = image.shape[:2]
+    scale = min(imgsz / h, imgsz / w)
+    new_w, new_h = round(w * scale), round(h * scale)
+    top, left = (imgsz - new_h) // 2, (imgsz - new_w) // 2
+    canvas = np.full((imgsz, imgsz, 3), PAD_VALUE, dtype=np.uint8)
+    canvas[top:top + new_h, left:left + new_w] = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    return np.ascontiguousarray(canvas[:, :, ::-1].transpose(2, 0, 1)[None], dtype=np.float32) / 255
+
+
+def sample_frames(video_path, n):
+    """Up to n frames spread evenly over the video, decoded in one pass (other frames are only grabbed)."""
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise IOError(f"Cannot open video file: {video_path}")
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    # Streams without a frame count give their first n frames.
+    wanted = set(np.linspace(0, total - 1, min(n, total), dtype=int).tolist()) if total > 0 else set(range(n))
+    frames = []
+    position = 0
+    try:
+        while len(frames) < len(wanted) and cap.grab():
+            if position in wanted:
+                ok, image = cap.retrieve()
+                if ok:
+                    frames.append(image)
+            position += 1
+    finally:
+        cap.release()
+    return frames
+
+
+def write_calibration_dataset(frames, directory, names):
+    """
+    Writes frames as a YOLO dataset (images only) for ultralytics' INT8 export.
+
+    Returns:
+      - yaml_path (str): The dataset file to pass as `data`.
+    """
+    images = os.path.join(directory, 'images')
+    os.makedirs(images, exist_ok=True)
+    for i, frame in enumerate(frames):
+        cv2.imwrite(os.path.join(images, f"frame_{i:05d}.jpg"), frame)
+    yaml_path = os.path.join(directory, 'calibration.yaml')
+    with open(yaml_path, 'w') as f:
+        f.write(f"path: {os.path.abspath(directory)}\ntrain: images\nval: images\nnames:\n")
+        for index, name in sorted(names.items()):
+            f.write(f"  {index}: {name}\n")
+    return yaml_path
+
+
+def quantize_onnx(onnx_path, output_path, frames, imgsz=EXPORT_IMGSZ):
+    """
+    Statically quantizes an ONNX model to INT8 with onnxruntime, calibrated on
+    frames. Ultralytics' metadata (names, stride, imgsz) is copied over, so the
+    quantized model loads like the exported one.
+    """
+    import onnx #type:ignore
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static #type:ignore
+
+    class FrameReader(CalibrationDataReader):
+        def __init__(self, input_name):
+            self.input_name = input_name
+            self.frames = iter(frames)
+
+        def get_next(self):
+            frame = next(self.frames, None)
+            return None if frame is None else {self.input_name: letterbox(frame, imgsz)}
+
+    model = onnx.load(onnx_path)
+    input_name = model.graph.input[0].name
+    quantize_static(onnx_path, output_path, FrameReader(input_name), quant_format=QuantFormat.QDQ,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8, per_channel=True)
+    quantized = onnx.load(output_path)
+    del quantized.metadata_props[:]
+    quantized.metadata_props.extend(model.metadata_props)
+    onnx.save(quantized, output_path)
+    return output_path
+
+
+def export(weights, backend, calibration_video=CALIBRATION_VIDEO, imgsz=EXPORT_IMGSZ, export_dir=EXPORT_DIR):
+    """
+    Exports weights for a backend, or returns the cached export.
+
+    Parameters:
+      - weights (str): .pt weights file.
+      - backend (str): One of BACKENDS other than 'torch'.
+      - calibration_video (str): Video INT8 backends are calibrated on.
+      - imgsz (int): Input size of the exported model.
+
+    Returns:
+      - path (str): The exported model (an .onnx file or an OpenVINO model directory) to load with YOLO().
+    """
+    runtime, int8 = parse_backend(backend)
+    if runtime == 'torch':
+        return weights
+    if int8 and not (calibration_video and os.path.exists(calibration_video)):
+        raise ValueError(f"INT8 export needs a calibration video; {calibration_video!r} not found "
+                         "(set CALIBRATION_VIDEO).")
+    key = export_key(weights, backend, calibration_video, imgsz)
+    entry_dir = os.path.join(export_dir, key)
+    entry = read_export(entry_dir)
+    if entry is not None:
+        return os.path.join(entry_dir, entry['artifact'])
+
+    from ultralytics import YOLO #type:ignore
+    start = time.perf_counter()
+    # Exported next to a private copy of the weights, so concurrent exports never share files.
+    tmp_dir = f"{entry_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    try:
+        local_weights = shutil.copy2(weights, tmp_dir)
+        model = YOLO(local_weights)
+        frames = sample_frames(calibration_video, CALIBRATION_FRAMES) if int8 else None
+        # Dynamic input shapes let track_video_frames send batches of frames.
+        if runtime == 'onnx':
+            artifact = model.export(format='onnx', imgsz=imgsz, dynamic=True, simplify=True)
+            if int8:
+                artifact = quantize_onnx(artifact, os.path.splitext(artifact)[0] + '_int8.onnx', frames, imgsz)
+        else:
+            data = None
+            if int8:
+                data = write_calibration_dataset(frames, os.path.join(tmp_dir, 'calibration'), model.names)
+            artifact = model.export(format='openvino', imgsz=imgsz, dynamic=True, int8=int8, data=data)
+        entry = {
+            'weights': os.path.abspath(weights),
+            'backend': backend,
+            'imgsz': imgsz,
+            'calibration_video': os.path.abspath(calibration_video) if int8 else None,
+            'calibration_frames': len(frames) if int8 else 0,
+            'artifact': os.path.relpath(artifact, tmp_dir),
+            'seconds': round(time.perf_counter() - start, 3),
+            'created': time.time(),
+        }
+        os.remove(local_weights)
+        shutil.rmtree(os.path.join(tmp_dir, 'calibration'), ignore_errors=True)
+        with open(os.path.join(tmp_dir, EXPORT_NAME), 'w') as f:
+            json.dump(entry, f, indent=2)
+        if os.path.exists(entry_dir):
+            # Another process finished the same export first.
+            shutil.rmtree(tmp_dir)
+        else:
+            os.replace(tmp_dir, entry_dir)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    print(f"Exported {weights} for {backend} in {entry['seconds']:.1f}s: {entry_dir}")
+    return os.path.join(entry_dir, read_export(entry_dir)['artifact'])
+
+
+def read_export(entry_dir):
+    try:
+        with open(os.path.join(entry_dir, EXPORT_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def resolve_weights(weights, backend=None):
+    """
+    What the model registry should load for weights under a backend (default
+    INFERENCE_BACKEND): the weights themselves for torch, else the cached export.
+    """
+    backend = backend or BACKEND
+    if parse_backend(backend)[0] == 'torch':
+        return weights
+    return export(weights, backend)
+
+
+def detection_rows(result):
+    """ROW_DTYPE records (normalized x, y, w, h, conf) of a prediction result."""
+    import track_store
+    rows = track_store.rows_from_boxes(result.boxes)
+    records = np.zeros(len(rows), dtype=track_store.ROW_DTYPE)
+    for i, column in enumerate(('cls', 'x', 'y', 'w', 'h', 'conf')):
+        records[column] = rows[:, i]
+    return records
+
+
+def agreement(reference, candidate):
+    """
+    Detection agreement of a backend with the reference (PyTorch) backend over the
+    same frames: boxes are matched per frame on center distance (stride_report.match_frame).
+
+    Returns:
+      - report (dict): Recall and precision of the candidate's boxes against the
+        reference's, mean IoU and mean absolute confidence difference of the matches.
+    """
+    import stride_report
+    reference_boxes = candidate_boxes = 0
+    ious, conf_deltas = [], []
+    for ref_rows, rows in zip(reference, candidate):
+        reference_boxes += len(ref_rows)
+        candidate_boxes += len(rows)
+        ref_index, index, _ = stride_report.match_frame(ref_rows, rows)
+        columns = ('x', 'y', 'w', 'h')
+        ious.append(stride_report.box_iou(np.column_stack([ref_rows[c][ref_index] for c in columns]),
+                                          np.column_stack([rows[c][index] for c in columns])))
+        conf_deltas.append(np.abs(ref_rows['conf'][ref_index] - rows['conf'][index]))
+    ious = np.concatenate(ious) if ious else np.empty(0)
+    conf_deltas = np.concatenate(conf_deltas) if conf_deltas else np.empty(0)
+    return {
+        'reference_boxes': reference_boxes,
+        'boxes': candidate_boxes,
+        'matched_boxes': len(ious),
+        'recall': len(ious) / reference_boxes if reference_boxes else None,
+        'precision': len(ious) / candidate_boxes if candidate_boxes else None,
+        'mean_iou': float(ious.mean()) if len(ious) else None,
+        'mean_conf_delta': float(conf_deltas.mean()) if len(conf_deltas) else None,
+    }
+
+
+def benchmark(video_path, weights, backends=BACKENDS, n_frames=BENCHMARK_FRAMES, conf=0.1,
+              calibration_video=None):
+    """
+    Runs every backend on the same frames of a clip and compares fps and
+    detections with the first backend (normally torch).
+
+    Frames are decoded before timing, so fps is model time only (preprocessing,
+    inference and postprocessing, batch 1). Export time is reported separately.
+
+    Returns:
+      - report (dict): Per backend: fps, mean ms per frame, export seconds, and agreement.
+    """
+    from ultralytics import YOLO #type:ignore
+    frames = sample_frames(video_path, n_frames)
+    if not frames:
+        raise ValueError(f"No frames read from {video_path}")
+    results = []
+    detections = {}
+    for backend in backends:
+        start = time.perf_counter()
+        artifact = export(weights, backend, calibration_video or video_path)
+        export_s = time.perf_counter() - start
+        # A fresh model per backend, warmed up on the first frame before timing.
+        model = YOLO(artifact, task='detect')
+        model.predict(frames[0], conf=conf, verbose=False)
+        rows = []
+        start = time.perf_counter()
+        for frame in frames:
+            rows.append(detection_rows(model.predict(frame, conf=conf, verbose=False)[0]))
+        seconds = time.perf_counter() - start
+        detections[backend] = rows
+        results.append({
+            'backend': backend,
+            'artifact': artifact,
+            'export_s': round(export_s, 3),
+            'fps': len(frames) / seconds,
+            'ms_per_frame': 1000 * seconds / len(frames),
+        })
+        print(f"{backend:14s} {results[-1]['fps']:8.1f} fps")
+    reference = backends[0]
+    for result in results:
+        result['agreement'] = agreement(detections[reference], detections[result['backend']])
+        result['speedup'] = result['fps'] / results[0]['fps']
+    return {'video': video_path, 'weights': weights, 'frames': len(frames), 'conf': conf,
+            'reference': reference, 'threads': os.cpu_count(), 'backends': results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export YOLO weights for CPU runtimes and benchmark them.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="Export (or find the cached export of) a model.")
+    export_parser.add_argument("--backend", default=BACKEND, choices=BACKENDS)
+    bench_parser = commands.add_parser("benchmark", help="Compare fps and detections of backends on a clip.")
+    bench_parser.add_argument("video", help="Clip to run every backend on.")
+    bench_parser.add_argument("--backends", default=",".join(BACKENDS),
+                              help="Comma-separated backends; the first is the reference.")
+    bench_parser.add_argument("--frames", type=int, default=BENCHMARK_FRAMES, help="Frames sampled from the clip.")
+    bench_parser.add_argument("--output", default=BENCHMARK_PATH, help="JSON report.")
+    for sub in (export_parser, bench_parser):
+        sub.add_argument("--flag", type=int, default=0, help="0 for best1-2.pt, anything else for best3-3(v11m_50).pt")
+        sub.add_argument("--weights", help="Weights file (overrides --flag).")
+        sub.add_argument("--calibration", help="Video INT8 models are calibrated on "
+                                               "(default: CALIBRATION_VIDEO, or the benchmark clip).")
+    args = parser.parse_args()
+
+    weights = args.weights or model_registry.weights_for_flag(args.flag)
+    if args.command == "export":
+        print(export(weights, args.backend, args.calibration or CALIBRATION_VIDEO))
+    else:
+        backends = [backend.strip() for backend in args.backends.split(",") if backend.strip()]
+        for backend in backends:
+            parse_backend(backend)
+        report = benchmark(args.video, weights, backends, args.frames, calibration_video=args.calibration)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"{'backend':14s} {'fps':>8s} {'speedup':>8s} {'recall':>7s} {'precision':>9s} {'IoU':>6s}")
+        for result in report['backends']:
+            agree = result['agreement']
+            print(f"{result['backend']:14s} {result['fps']:8.1f} {result['speedup']:7.2f}x "
+                  f"{agree['recall'] or 0:7.3f} {agree['precision'] or 0:9.3f} {agree['mean_iou'] or 0:6.3f}")
+        print(f"Report written to {args.output}")
@@ -0,0 +1,176 @@
+"""
+Process-wide registry of loaded YOLO models.
+
+Loading weights (and running the first, slow inference) is far more expensive
+than a single prediction, so the app, the tracking workers and the trajectory
+script share models through this registry instead of building YOLO(...) per
+call. Models are keyed by weights path plus inference options, warmed up with
+one dummy inference when loaded, and evicted least-recently-used first once
+their estimated memory exceeds the budget.
+
+Usage:
+    model = model_registry.get_model(model_registry.PREDICT_WEIGHTS)
+
+    # or, to keep other threads off the model while it is in use:
+    with model_registry.registry.use(model_registry.PREDICT_WEIGHTS) as model:
+        results = model.predict(image, conf=0.1)
+"""
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np #type:ignore
+
+# Weights selected by the `flag` argument of run_tracking (0 or anything else).
+TRACKING_WEIGHTS = {0: 'best1-2.pt', 1: 'best3-3(v11m_50).pt'}
+PREDICT_WEIGHTS = 'best3-3(v11m_50).pt'
+
+MEMORY_BUDGET = int(os.environ.get('MODEL_MEMORY_BUDGET_MB', '2048')) * 1024 * 1024
+WARMUP_IMGSZ = 640
+
+
+def weights_for_flag(flag):
+    """Weights file used for a run_tracking flag."""
+    return TRACKING_WEIGHTS[0] if flag == 0 else TRACKING_WEIGHTS[1]
+
+
+def estimate_model_bytes(model, weights):
+    """
+    Memory held by a loaded model: its parameters and buffers for PyTorch
+    models, the size of the weights file or directory otherwise (e.g. models
+    exported for ONNX Runtime or OpenVINO, whose weights live outside torch).
+    """
+    try:
+        module = model.model
+        size = sum(t.numel() * t.element_size() for t in list(module.parameters()) + list(module.buffers()))
+        if size:
+            return size
+    except Exception:
+        pass
+    if os.path.isdir(weights):
+        return sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(weights) for name in files)
+    return os.path.getsize(weights) if os.path.exists(weights) else 0
+
+
+class _Entry:
+    def __init__(self, model, size):
+        self.model = model
+        self.size = size
+        self.lock = threading.RLock()
+
+
+class ModelRegistry:
+    """
+    Thread-safe LRU cache of loaded models.
+
+    Parameters:
+      - memory_budget (int): Bytes of model memory to keep loaded; the most recently
+        used model is always kept even if it alone exceeds the budget.
+      - warmup (bool): Run one dummy inference right after loading.
+      - loader (callable): Builds a model from (weights, task); defaults to ultralytics.YOLO.
+    """
+
+    def __init__(self, memory_budget=MEMORY_BUDGET, warmup=True, loader=None):
+        self.memory_budget = memory_budget
+        self.warmup = warmup
+        self.loader = loader
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading = {}
+
+    @staticmethod
+    def _key(weights, task, slot, options):
+        return (os.path.abspath(weights), task, slot, tuple(sorted(options.items())))
+
+    def _load(self, weights, task):
+        if self.loader is not None:
+            return self.loader(weights, task)
+        from ultralytics import YOLO #type:ignore
+        return YOLO(weights, task=task)
+
+    def _warm_up(self, model, options):
+        imgsz = options.get('imgsz', WARMUP_IMGSZ)
+        size = imgsz if isinstance(imgsz, (tuple, list)) else (imgsz, imgsz)
+        dummy = np.zeros((size[0], size[1], 3), dtype=np.uint8)
+        model.predict(dummy, verbose=False, save=False, **options)
+
+    def get(self, weights, task=None, slot=None, **options):
+        """
+        Returns the model for weights + options, loading and warming it up on first use.
+
+        Parameters:
+          - weights (str): Path of the weights file.
+          - task (str): Optional ultralytics task passed to YOLO().
+          - slot (hashable): Distinguishes otherwise identical entries, e.g. to give a
+            tracker its own model instance instead of sharing one.
+          - options: Inference options (conf, imgsz, device, ...) used for the warm-up
+            inference and as part of the key.
+        """
+        key = self._key(weights, task, slot, options)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry.model
+            # One loader per key; other threads asking for it wait on its event.
+            loading = self._loading.get(key)
+            if loading is None:
+                loading = self._loading[key] = threading.Event()
+                is_loader = True
+            else:
+                is_loader = False
+
+        if not is_loader:
+            loading.wait()
+            return self.get(weights, task, slot, **options)
+
+        try:
+            model = self._load(weights, task)
+            if self.warmup:
+                self._warm_up(model, options)
+            entry = _Entry(model, estimate_model_bytes(model, weights))
+            with self._lock:
+                self._entries[key] = entry
+                self._evict()
+        finally:
+            with self._lock:
+                del self._loading[key]
+            loading.set()
+        return model
+
+    @contextmanager
+    def use(self, weights, task=None, slot=None, **options):
+        """Context manager holding the model's lock while it is used."""
+        model = self.get(weights, task, slot, **options)
+        with self._lock:
+            entry = self._entries.get(self._key(weights, task, slot, options))
+        lock = entry.lock if entry is not None and entry.model is model else threading.RLock()
+        with lock:
+            yield model
+
+    def _evict(self):
+        """Drops least recently used models until the budget is met (call with _lock held)."""
+        total = sum(entry.size for entry in self._entries.values())
+        while total > self.memory_budget and len(self._entries) > 1:
+            key, entry = self._entries.popitem(last=False)
+            total -= entry.size
+            print(f"Evicted model {key[0]} from the model registry.")
+
+    def loaded(self):
+        """(weights, size in bytes) of the loaded models, least recently used first."""
+        with self._lock:
+            return [(key[0], entry.size) for key, entry in self._entries.items()]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Shared registry of this process.
+registry = ModelRegistry()
+
+
+def get_model(weights, task=None, slot=None, **options):
+    """Shortcut for registry.get."""
+    return registry.get(weights, task, slot, **options)
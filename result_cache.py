@@ -0,0 +1,227 @@
+"""
+Content-addressed cache of tracking results.
+
+Tracking the same video again with the same model and settings gives the
+same labels, so the tracking service looks results up here before queueing a
+job. The key is a SHA-256 over
+
+  - the video's bytes (hashed while the upload is saved, see save_upload),
+  - the weights file's bytes,
+  - the tracker config file's bytes and the ultralytics version,
+  - the remaining settings of run_tracking.tracking_config (conf, stride, roi, ...).
+
+Layout:
+
+  cache/<key>/track/      copy of the run directory (labels, track store, annotated video)
+  cache/<key>/entry.json  key, settings, size in bytes, creation and last use time
+
+A hit fills the job's own run directory from the entry (hardlinks where the
+file system allows, copies otherwise), so what a job writes next to its run
+(ID remap table, track summary, plots) never ends up in the cache, and
+evicting an entry never removes a run that a job or the run catalog points at.
+Files of a run are replaced (written to a temporary file and renamed), never
+rewritten in place, so a job cannot change a linked file of the cache.
+
+The cache is bounded by size on disk: after every insert, the least recently
+used entries are deleted until the total is below max_bytes. A hit counts as
+a use, so entries that keep being re-checked stay.
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+CACHE_DIR = 'cache'
+MAX_CACHE_BYTES = 20 * 1024 ** 3
+ENTRY_NAME = 'entry.json'
+RUN_NAME = 'track'
+CHUNK_SIZE = 1024 * 1024
+
+# (path, size, mtime) -> digest of files hashed by this process (weights, tracker configs).
+_file_digests = {}
+
+
+def file_digest(path):
+    """SHA-256 of a file, read in chunks; remembered until the file changes."""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+    if key not in _file_digests:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+        _file_digests[key] = digest.hexdigest()
+    return _file_digests[key]
+
+
+def save_upload(file, path):
+    """
+    Saves an uploaded file (werkzeug FileStorage or any object with a binary
+    stream/read()) to path, hashing it on the way.
+
+    Returns:
+      - digest (str): SHA-256 of the file's bytes.
+    """
+    stream = getattr(file, 'stream', file)
+    digest = hashlib.sha256()
+    with open(path, 'wb') as out:
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+            out.write(chunk)
+    return digest.hexdigest()
+
+
+def tracker_digest(tracker):
+    """Hash of the tracker config ultralytics resolves `tracker` to, and of the ultralytics version."""
+    try:
+        import ultralytics #type:ignore
+        from ultralytics.utils import ROOT #type:ignore
+        version = ultralytics.__version__
+        path = tracker if os.path.exists(tracker) else os.path.join(ROOT, 'cfg', 'trackers', tracker)
+    except ImportError:
+        version, path = None, tracker
+    content = file_digest(path) if os.path.exists(path) else tracker
+    return f"{content}:{version}"
+
+
+def cache_key(video_digest, config):
+    """
+    Key of a video's tracking results under a configuration (see
+    run_tracking.tracking_config). Weights are hashed by content when the file
+    is present, so a retrained model with the same file name gets new keys.
+    """
+    config = dict(config)
+    weights = config.pop('weights')
+    tracker = config.pop('tracker')
+    parts = {
+        'video': video_digest,
+        'weights': file_digest(weights) if os.path.exists(weights) else weights,
+        'tracker': tracker_digest(tracker),
+        'config': config,
+    }
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class ResultCache:
+    """
+    Tracking results on disk, keyed by cache_key and evicted least recently used
+    first once they take more than max_bytes.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key, ENTRY_NAME)
+
+    def _read_entry(self, key):
+        try:
+            with open(self._entry_path(key)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_entry(self, key, entry):
+        path = self._entry_path(key)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(entry, f, indent=2)
+        os.replace(path + '.tmp', path)
+
+    def get(self, key, run_dir=None):
+        """
+        Returns the cached entry for key and marks it as used, or None on a miss.
+        Given a run_dir, the cached run (labels, track store, ...) is linked into it
+        and the entry's 'run_dir' is run_dir; otherwise 'run_dir' is the cache's own
+        copy, which is only valid until the entry is evicted.
+        """
+        with self._lock:
+            entry = self._read_entry(key)
+            if entry is None:
+                return None
+            cached_run = os.path.join(self.cache_dir, key, RUN_NAME)
+            if run_dir is not None:
+                # Under the lock, so the entry cannot be evicted halfway through.
+                shutil.copytree(cached_run, run_dir, copy_function=_link_or_copy, dirs_exist_ok=True)
+            entry['last_used'] = time.time()
+            entry['hits'] = entry.get('hits', 0) + 1
+            self._write_entry(key, entry)
+        entry['run_dir'] = run_dir if run_dir is not None else cached_run
+        return entry
+
+    def put(self, key, run_dir, **info):
+        """
+        Copies a finished run directory into the cache under key, then evicts least
+        recently used entries beyond max_bytes. `info` (e.g. the interaction count)
+        is stored with the entry and returned by get().
+
+        Returns:
+          - entry (dict): The stored entry, or None if the run alone is larger than max_bytes.
+        """
+        size = directory_size(run_dir)
+        if size > self.max_bytes:
+            return None
+        entry_dir = os.path.join(self.cache_dir, key)
+        # Copy next to the entry first, so a concurrent get() never sees a partial run.
+        tmp_dir = f"{entry_dir}.tmp-{os.getpid()}-{threading.get_ident()}"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        shutil.copytree(run_dir, os.path.join(tmp_dir, RUN_NAME))
+        now = time.time()
+        entry = dict(info, key=key, size=size, created=now, last_used=now, hits=0)
+        with open(os.path.join(tmp_dir, ENTRY_NAME), 'w') as f:
+            json.dump(entry, f, indent=2)
+        with self._lock:
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            os.replace(tmp_dir, entry_dir)
+            self._evict()
+        entry['run_dir'] = os.path.join(entry_dir, RUN_NAME)
+        return entry
+
+    def entries(self):
+        """All entries, least recently used first."""
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            entry = self._read_entry(key)
+            if entry is not None:
+                entries.append(entry)
+        return sorted(entries, key=lambda entry: entry['last_used'])
+
+    def total_bytes(self):
+        return sum(entry['size'] for entry in self.entries())
+
+    def _evict(self):
+        entries = self.entries()
+        total = sum(entry['size'] for entry in entries)
+        for entry in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(os.path.join(self.cache_dir, entry['key']), ignore_errors=True)
+            total -= entry['size']
+            print(f"Evicted cached tracking result {entry['key']} ({entry['size'] / 1024 ** 2:.1f} MB)")
+
+    def clear(self):
+        with self._lock:
+            for entry in self.entries():
+                shutil.rmtree(os.path.join(self.cache_dir, entry['key']), ignore_errors=True)
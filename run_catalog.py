@@ -0,0 +1,247 @@
+"""
+Catalog of tracking runs in a small SQLite database (runs.db).
+
+Every run track_video finishes is recorded with its output paths, model,
+tracker config, frame count and timings. Tracking service jobs are recorded
+with the run holding their results (several jobs share a run when the result
+cache is hit). The app resolves runs through indexed queries on this catalog
+instead of listing and stat-ing runs/detect, which was slow with many runs
+and picked the wrong folder when jobs overlapped.
+
+Tables:
+  runs  run_dir (unique), name, video_path, video_hash, model, tracker, config (JSON),
+        labels_dir, status, frames, total_frames, fps, elapsed_s, stages (JSON),
+        created, finished
+  jobs  job_id (unique), run_dir, video_path, video_hash, cached, created
+
+The database is opened in WAL mode, so worker processes can record runs
+while the app reads. Runs tracked before the catalog existed can be added with
+
+  python run_catalog.py import runs/detect
+  python run_catalog.py list
+"""
+import argparse
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+CATALOG_PATH = os.environ.get('RUN_CATALOG', 'runs.db')
+# Seconds a writer waits for another process's transaction.
+BUSY_TIMEOUT = 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    run_dir TEXT NOT NULL UNIQUE,
+    name TEXT,
+    video_path TEXT,
+    video_hash TEXT,
+    model TEXT,
+    tracker TEXT,
+    config TEXT,
+    labels_dir TEXT,
+    status TEXT,
+    frames INTEGER,
+    total_frames INTEGER,
+    fps REAL,
+    elapsed_s REAL,
+    stages TEXT,
+    created REAL,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS runs_finished ON runs (status, finished);
+CREATE INDEX IF NOT EXISTS runs_video_hash ON runs (video_hash);
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    run_dir TEXT,
+    video_path TEXT,
+    video_hash TEXT,
+    cached INTEGER NOT NULL DEFAULT 0,
+    created REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_run_dir ON jobs (run_dir);
+"""
+
+RUN_COLUMNS = ('run_dir', 'name', 'video_path', 'video_hash', 'model', 'tracker', 'config', 'labels_dir', 'status',
+               'frames', 'total_frames', 'fps', 'elapsed_s', 'stages', 'created', 'finished')
+JSON_COLUMNS = ('config', 'stages')
+
+
+def _normalize(path):
+    return os.path.abspath(path) if path else path
+
+
+def _row_to_dict(row):
+    if row is None:
+        return None
+    record = dict(row)
+    for column in JSON_COLUMNS:
+        if record.get(column) is not None:
+            record[column] = json.loads(record[column])
+    return record
+
+
+class RunCatalog:
+    """The run catalog stored at `path` (created on first use)."""
+
+    def __init__(self, path=CATALOG_PATH):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        """One short-lived connection per call (safe across Flask threads and processes), committed on success."""
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def record_run(self, run_dir, **fields):
+        """
+        Inserts or updates the run in run_dir. Fields left out (or None) keep their
+        recorded value; config and stages are stored as JSON.
+        """
+        fields = {key: value for key, value in fields.items() if value is not None}
+        unknown = set(fields) - set(RUN_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown run fields: {sorted(unknown)}")
+        for column in JSON_COLUMNS:
+            if column in fields:
+                fields[column] = json.dumps(fields[column], sort_keys=True)
+        for column in ('video_path', 'labels_dir'):
+            if column in fields:
+                fields[column] = _normalize(fields[column])
+        fields.setdefault('created', time.time())
+        fields['run_dir'] = _normalize(run_dir)
+        columns = list(fields)
+        updates = ", ".join(f"{c} = excluded.{c}" for c in columns if c not in ('run_dir', 'created'))
+        with self._connect() as conn:
+            conn.execute(f"INSERT INTO runs ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+                         f"ON CONFLICT (run_dir) DO UPDATE SET {updates}",
+                         [fields[c] for c in columns])
+        return fields['run_dir']
+
+    def record_job(self, job_id, run_dir, video_path=None, video_hash=None, cached=False):
+        """Records which run holds a tracking job's results (and the video's hash on the run)."""
+        run_dir = _normalize(run_dir)
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO jobs (job_id, run_dir, video_path, video_hash, cached, created) "
+                         "VALUES (?, ?, ?, ?, ?, ?)",
+                         (job_id, run_dir, _normalize(video_path), video_hash, int(cached), time.time()))
+            if video_hash is not None:
+                conn.execute("UPDATE runs SET video_hash = ? WHERE run_dir = ? AND video_hash IS NULL",
+                             (video_hash, run_dir))
+
+    def run(self, run_dir):
+        """The record of the run in run_dir, or None."""
+        with self._connect() as conn:
+            return _row_to_dict(conn.execute("SELECT * FROM runs WHERE run_dir = ?",
+                                              (_normalize(run_dir),)).fetchone())
+
+    def job(self, job_id):
+        """The run record of a job with the job's video_path and cached flag, or None."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT runs.*, jobs.video_path AS job_video_path, jobs.cached FROM jobs "
+                               "JOIN runs ON runs.run_dir = jobs.run_dir WHERE jobs.job_id = ?",
+                               (job_id,)).fetchone()
+        record = _row_to_dict(row)
+        if record is not None:
+            record['video_path'] = record.pop('job_video_path') or record['video_path']
+        return record
+
+    def latest(self, status="done"):
+        """The most recently finished run with this status, or None."""
+        with self._connect() as conn:
+            return _row_to_dict(conn.execute("SELECT * FROM runs WHERE status = ? ORDER BY finished DESC LIMIT 1",
+                                              (status,)).fetchone())
+
+    def runs_for_video(self, video_hash):
+        """Runs of the video with this content hash, most recent first."""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM runs WHERE video_hash = ? ORDER BY finished DESC",
+                                (video_hash,)).fetchall()
+        return [_row_to_dict(row) for row in rows]
+
+    def runs(self, limit=100):
+        """The most recently finished runs."""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM runs ORDER BY finished DESC LIMIT ?", (limit,)).fetchall()
+        return [_row_to_dict(row) for row in rows]
+
+    def forget(self, run_dir):
+        """Removes a run (e.g. deleted from disk) and the jobs pointing at it."""
+        run_dir = _normalize(run_dir)
+        with self._connect() as conn:
+            conn.execute("DELETE FROM runs WHERE run_dir = ?", (run_dir,))
+            conn.execute("DELETE FROM jobs WHERE run_dir = ?", (run_dir,))
+
+    def import_directory(self, root):
+        """
+        Records the run directories directly under root (e.g. runs/detect) that hold
+        labels and are not in the catalog yet; a one-time scan for runs tracked
+        before the catalog existed. Returns the number of runs added.
+        """
+        added = 0
+        for name in sorted(os.listdir(root)):
+            run_dir = os.path.join(root, name)
+            labels_dir = os.path.join(run_dir, 'labels')
+            if not os.path.isdir(labels_dir) or self.run(run_dir) is not None:
+                continue
+            finished = os.path.getmtime(labels_dir)
+            self.record_run(run_dir, name=name, labels_dir=labels_dir, status="done", created=finished,
+                            finished=finished)
+            added += 1
+        return added
+
+
+_catalogs = {}
+
+
+def default_catalog():
+    """The catalog at CATALOG_PATH, opened once per process."""
+    if CATALOG_PATH not in _catalogs:
+        _catalogs[CATALOG_PATH] = RunCatalog(CATALOG_PATH)
+    return _catalogs[CATALOG_PATH]
+
+
+def resolve_labels(ref="latest", catalog=None):
+    """
+    Labels directory of a run given as a labels directory, a run directory, a
+    tracking job ID or "latest" (the most recently finished run in the catalog).
+    """
+    if ref and os.path.isdir(ref):
+        labels_dir = os.path.join(ref, 'labels')
+        return labels_dir if os.path.isdir(labels_dir) else ref
+    catalog = catalog or default_catalog()
+    record = catalog.latest() if ref in (None, "", "latest") else catalog.job(ref)
+    if record is None or not record['labels_dir']:
+        raise ValueError(f"No tracking run found for {ref!r} in {catalog.path}.")
+    return record['labels_dir']
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect the catalog of tracking runs.")
+    parser.add_argument("--catalog", default=CATALOG_PATH, help="Catalog database.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_parser = commands.add_parser("import", help="Add the existing runs under a directory.")
+    import_parser.add_argument("root", nargs="?", default=os.path.join("runs", "detect"))
+    list_parser = commands.add_parser("list", help="Show the most recent runs.")
+    list_parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    catalog = RunCatalog(args.catalog)
+    if args.command == "import":
+        print(f"Added {catalog.import_directory(args.root)} runs from {args.root} to {args.catalog}")
+    else:
+        for run in catalog.runs(args.limit):
+            finished = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(run['finished'])) if run['finished'] else "-"
+            fps = f"{run['fps']:.1f}" if run['fps'] else "-"
+            print(f"{finished}  {run['status'] or '-':9s} {run['frames'] or 0:>7d} frames {fps:>8s} fps  "
+                  f"{run['model'] or '-':24s} {run['run_dir']}")
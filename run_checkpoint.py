@@ -0,0 +1,106 @@
+"""
+Checkpoints of frame-by-frame tracking runs (run_tracking.track_video_frames),
+so an interrupted run continues where it stopped instead of from frame 0.
+
+Every CHECKPOINT_INTERVAL frames, and when a run is stopped, the tracking loop
+writes <run_dir>/checkpoint.pkl with everything the rest of the run depends on:
+
+  frame         the next frame to track (all frames before it are written)
+  store         rows and per-frame offsets of the track store so far (TrackStoreWriter.checkpoint)
+  trackers      the ByteTrack trackers of the predictor (pickled) and the global track ID counter
+  last          the last detected frame and its rows, for interpolating strided runs
+  interactions  state of the live interaction counter
+  segments      annotated video segments written so far, one per checkpoint interval
+  video, config frame size/count of the video and tracking settings, checked on resume
+
+The checkpoint is written atomically after the rows it refers to are on disk,
+so a crash at any point leaves the previous checkpoint usable. It is removed
+when the run finishes.
+"""
+import os
+import pickle
+import time
+
+CHECKPOINT_NAME = "checkpoint.pkl"
+# Frames between two checkpoints of a run (0 disables checkpointing).
+CHECKPOINT_INTERVAL = int(os.environ.get("CHECKPOINT_INTERVAL", "1000"))
+VERSION = 1
+
+
+def checkpoint_path(run_dir):
+    return os.path.join(str(run_dir), CHECKPOINT_NAME)
+
+
+def save(run_dir, state):
+    """Writes a run's checkpoint (atomically, flushed to disk before it replaces the previous one)."""
+    path = checkpoint_path(run_dir)
+    state = dict(state, version=VERSION, time=time.time())
+    with open(path + ".tmp", "wb") as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def load(run_dir):
+    """The run's checkpoint, or None if there is none (or it is from another version)."""
+    try:
+        with open(checkpoint_path(run_dir), "rb") as f:
+            state = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+    return state if state.get("version") == VERSION else None
+
+
+def clear(run_dir):
+    path = checkpoint_path(run_dir)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def find(run_dir):
+    """Next frame of the run's checkpoint, or None (for listing resumable runs without loading trackers)."""
+    state = load(run_dir)
+    return state["frame"] if state is not None else None
+
+
+def tracker_state(model):
+    """The ByteTrack state of a model after its last track() call."""
+    from ultralytics.trackers.basetrack import BaseTrack #type:ignore
+    return {"trackers": pickle.dumps(getattr(model.predictor, "trackers", None)), "next_id": BaseTrack._count}
+
+
+class TrackerRestore:
+    """
+    Puts checkpointed trackers back on a model's predictor.
+
+    Ultralytics creates the trackers in an on_predict_start callback that keeps
+    existing trackers when tracking with persist=True. This callback is
+    registered in front of it, so the first track() call finds the restored
+    trackers in place instead of starting fresh ones. The global track ID
+    counter is restored too, so new tracks continue the run's numbering.
+    """
+    def __init__(self, state):
+        self.trackers = pickle.loads(state["trackers"])
+        self.next_id = state["next_id"]
+        self.done = False
+
+    def attach(self, model):
+        """Call before the first model.track() of the resumed run."""
+        # Not set on a warm model's predictor right away: model.track() only registers the
+        # tracker callbacks on a predictor without trackers.
+        model.callbacks.setdefault("on_predict_start", []).insert(0, self.on_predict_start)
+
+    def detach(self, model):
+        if self.on_predict_start in model.callbacks.get("on_predict_start", []):
+            model.callbacks["on_predict_start"].remove(self.on_predict_start)
+
+    def on_predict_start(self, predictor):
+        if self.done or self.trackers is None:
+            return
+        from ultralytics.trackers.basetrack import BaseTrack #type:ignore
+        predictor.trackers = self.trackers
+        predictor.vid_path = [None] * len(self.trackers)
+        BaseTrack._count = self.next_id
+        self.done = True
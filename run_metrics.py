@@ -0,0 +1,146 @@
+"""
+Per-stage timings and progress of tracking and rendering runs.
+
+A RunMetrics object accumulates the time spent in each stage of a loop
+(decode, inference, label write, ...) and the number of frames processed. It
+writes snapshots as JSON so other processes (the Flask app, monitoring) can
+read them while the run is going:
+
+  <dir>/metrics.json   latest snapshot, replaced atomically
+                       (render_metrics.json for re-rendering after FP/TP edits)
+  <dir>/metrics.log    one JSON snapshot per line, every LOG_INTERVAL seconds
+                       and once more when the run finishes
+
+Snapshot format:
+  {"name": ..., "status": "running" | "done" | "failed" | "cancelled", "error": ...,
+   "frames": 120, "total_frames": 900, "elapsed_s": 4.1, "fps": 29.3, "peak_rss_mb": 812.4,
+   "stages": {"inference": {"total_s": 2.5, "count": 120, "mean_ms": 20.8}, ...}}
+"""
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+METRICS_NAME = "metrics.json"
+RENDER_METRICS_NAME = "render_metrics.json"
+LOG_NAME = "metrics.log"
+# Seconds between two snapshots written during a run.
+LOG_INTERVAL = 1.0
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB (None where it is not available)."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS.
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def read_metrics(path):
+    """Latest snapshot written to path, or None if there is none yet."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class RunMetrics:
+    """
+    Stage timings and frame progress of one run.
+
+    Parameters:
+      - name (str): Name of the run (e.g. the job ID), included in every snapshot.
+      - path (str): Where the latest snapshot is written (None: not written).
+      - log_path (str): JSON lines log the snapshots are appended to (None: no log).
+      - log_interval (float): Seconds between snapshots while frames are processed.
+    """
+
+    def __init__(self, name, path=None, log_path=None, log_interval=LOG_INTERVAL):
+        self.name = name
+        self.path = path
+        self.log_path = log_path
+        self.log_interval = log_interval
+        self.status = "running"
+        self.error = None
+        self.frames = 0
+        self.total_frames = None
+        self.stages = {}
+        self._start = time.perf_counter()
+        self._last_flush = None
+        # Pipelined loops add stage times from several threads.
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds, count=1):
+        """Adds `seconds` spent in `stage` (over `count` calls)."""
+        with self._lock:
+            totals = self.stages.setdefault(stage, [0.0, 0])
+            totals[0] += seconds
+            totals[1] += count
+
+    @contextmanager
+    def time(self, stage):
+        """Times the body of a with-block as one call of `stage`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def frame_done(self, n=1):
+        """Counts processed frames; writes a snapshot at most every log_interval seconds."""
+        self.frames += n
+        now = time.perf_counter()
+        if self._last_flush is None or now - self._last_flush >= self.log_interval:
+            self._last_flush = now
+            self.flush()
+
+    def snapshot(self):
+        elapsed = time.perf_counter() - self._start
+        return {
+            "name": self.name,
+            "status": self.status,
+            "error": self.error,
+            "time": time.time(),
+            "frames": self.frames,
+            "total_frames": self.total_frames,
+            "elapsed_s": round(elapsed, 3),
+            "fps": round(self.frames / elapsed, 2) if elapsed > 0 else None,
+            "peak_rss_mb": peak_rss_mb(),
+            "stages": {
+                stage: {"total_s": round(total, 4), "count": count,
+                        "mean_ms": round(total * 1000 / count, 3) if count else None}
+                for stage, (total, count) in list(self.stages.items())
+            },
+        }
+
+    def flush(self):
+        """Writes the current snapshot to path and log_path; returns it."""
+        record = self.snapshot()
+        line = json.dumps(record)
+        if self.path is not None:
+            # Write to a temporary file first so readers never see a half-written snapshot.
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                f.write(line)
+            os.replace(tmp_path, self.path)
+        if self.log_path is not None:
+            with open(self.log_path, "a") as f:
+                f.write(line + "\n")
+        return record
+
+    def finish(self, status="done", error=None):
+        """Records the final status, writes and prints the last snapshot."""
+        self.status = status
+        self.error = error
+        record = self.flush()
+        print(json.dumps(record))
+        return record
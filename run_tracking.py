@@ -1,34 +1,758 @@
 # run_tracking.py
+import argparse
+import os
+import queue
+import shutil
 import sys
-from ultralytics import YOLO  #type:ignore
+import threading
+import time
+from pathlib import Path
+import cv2 #type:ignore
+import numpy as np #type:ignore
+import ant_interactions
+import inference_backend
+import model_registry
+import run_catalog
+import run_checkpoint
+import run_metrics
+import track_store
 
-def main(video_path, flag, stop_event):
+PREVIEW_PATH = "uploads/result.jpg"
+# Default and maximum rate (images per second) at which the preview image is rewritten.
+PREVIEW_FPS = 1.0
+MAX_PREVIEW_FPS = 5.0
+# Model registry slot of models tracking one frame per call (strided/ROI mode): their tracker must
+# persist between calls, which ultralytics fixes when a model tracks for the first time.
+FRAME_TRACK_SLOT = 'track-frames'
+ROI_COLOR = (255, 128, 0)
+# Decoded frames the background reader may hold ahead of the tracking loop (at least one batch).
+PREFETCH_FRAMES = 16
+TRACKER_CONFIG = 'bytetrack.yaml'
+
+class PreviewWriter:
+    """
+    Writes the annotated preview image at most `fps` times per second
+    (capped at MAX_PREVIEW_FPS) instead of once per tracked frame.
+    """
+    def __init__(self, path=PREVIEW_PATH, fps=PREVIEW_FPS):
+        self.path = path
+        fps = min(fps, MAX_PREVIEW_FPS)
+        self.interval = 1.0 / fps if fps > 0 else None
+        self.last_write = None
+
+    def maybe_write(self, result):
+        """Saves an ultralytics Results object as the preview if one is due."""
+        return self._maybe_write(lambda path: result.save(filename=path))
+
+    def maybe_write_frame(self, frame):
+        """Same as maybe_write, for an already annotated BGR image."""
+        return self._maybe_write(lambda path: cv2.imwrite(path, frame))
+
+    def _maybe_write(self, save):
+        if self.interval is None:
+            return False
+        now = time.monotonic()
+        if self.last_write is not None and now - self.last_write < self.interval:
+            return False
+        # Write to a temporary file first so readers never see a half-written image.
+        root, ext = os.path.splitext(self.path)
+        tmp_path = f"{root}.tmp{ext}"
+        save(tmp_path)
+        os.replace(tmp_path, self.path)
+        self.last_write = now
+        return True
+
+class PredictorTimer:
+    """
+    Times the parts of ultralytics' predict loop that Results.speed does not
+    cover, through predictor callbacks: frame decoding (until
+    on_predict_batch_start), the tracker update (the tracker's own
+    on_predict_postprocess_end callback, bracketed by ours) and write_results
+    (label file and annotated video frame, until on_predict_batch_end).
+    """
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.mark = None
+
+    def attach(self, model):
+        """Call after model.track() (which registers the tracker) and before iterating."""
+        callbacks = model.callbacks
+        callbacks.setdefault("on_predict_start", []).append(self.resume)
+        callbacks.setdefault("on_predict_batch_start", []).append(self.on_batch_start)
+        callbacks.setdefault("on_predict_postprocess_end", []).insert(0, self.before_tracker)
+        callbacks["on_predict_postprocess_end"].append(self.after_tracker)
+        callbacks.setdefault("on_predict_batch_end", []).append(self.on_batch_end)
+
+    def detach(self, model):
+        """Removes the callbacks again, so a reused model does not keep timing."""
+        for event, func in (("on_predict_start", self.resume), ("on_predict_batch_start", self.on_batch_start),
+                            ("on_predict_postprocess_end", self.before_tracker),
+                            ("on_predict_postprocess_end", self.after_tracker),
+                            ("on_predict_batch_end", self.on_batch_end)):
+            if func in model.callbacks.get(event, []):
+                model.callbacks[event].remove(func)
+
+    def _lap(self, stage):
+        now = time.perf_counter()
+        if self.mark is not None and stage is not None:
+            self.metrics.add(stage, now - self.mark)
+        self.mark = now
+
+    def resume(self, predictor=None):
+        """Also called by the tracking loop once it is done with a frame."""
+        self._lap(None)
+
+    def on_batch_start(self, predictor):
+        self._lap("decode")
+
+    def before_tracker(self, predictor):
+        self._lap(None)
+
+    def after_tracker(self, predictor):
+        self._lap("tracker")
+
+    def on_batch_end(self, predictor):
+        self._lap("label_write")
+
+def load_model(flag, slot='track'):
+    """
+    Returns the warm YOLO model selected by flag (0: best1-2.pt, otherwise
+    best3-3(v11m_50).pt) from the process's model registry, run by the configured
+    inference backend (see inference_backend). Tracking gets its own instance
+    (slot 'track'), since the tracker state lives on the model.
+    """
+    weights = inference_backend.resolve_weights(model_registry.weights_for_flag(flag))
+    return model_registry.get_model(weights, slot=slot)
+
+def tracking_config(flag, stride=1, roi=None, batch=1):
+    """
+    Everything besides the video that the labels of track_video depend on
+    (result_cache keys tracking results on it). The batch size is left out:
+    batching and checkpoints only change how frames reach the model. At stride 1
+    without an ROI the frame loop gives the labels of ultralytics' own video loop,
+    and batched inference the same tracks and IDs, its boxes differing only by
+    float32 rounding in the last printed digit (tests/test_tracking.py checks both).
+    """
+    # Only stride and ROI change what the detector sees; batch is not part of the key.
+    frames_mode = stride > 1 or roi is not None
+    return {
+        'weights': model_registry.weights_for_flag(flag),
+        # Exported and INT8 models detect slightly differently from the PyTorch weights.
+        'backend': inference_backend.BACKEND,
+        'tracker': TRACKER_CONFIG,
+        # None: ultralytics' default tracking threshold (0.1), in either frame loop.
+        'conf': 0.1 if frames_mode or flag != 0 else None,
+        'frames_mode': frames_mode,
+        'stride': stride,
+        'roi': [float(v) for v in roi] if roi is not None else None,
+    }
+
+def record_run(run_dir, video_path, config, metrics):
+    """
+    Records a finished or cancelled run in the run catalog (see run_catalog). A
+    catalog that cannot be written does not fail the run.
+    """
+    if run_dir is None:
+        return
+    snapshot = metrics.snapshot()
+    try:
+        run_catalog.default_catalog().record_run(
+            run_dir, name=metrics.name, video_path=video_path, model=config['weights'], tracker=config['tracker'],
+            config=config, labels_dir=os.path.join(run_dir, 'labels'), status=snapshot['status'],
+            frames=snapshot['frames'], total_frames=snapshot['total_frames'], fps=snapshot['fps'],
+            elapsed_s=snapshot['elapsed_s'], stages=snapshot['stages'], finished=time.time())
+    except Exception as e:
+        print(f"Could not record the run in the catalog: {e}", file=sys.stderr)
+
+def reset_trackers(model):
+    """
+    Clears the ByteTrack state a reused model kept from its previous video, so
+    the next video starts with fresh tracks and IDs.
+    """
+    for tracker in getattr(model.predictor, "trackers", []):
+        tracker.reset()
+
+def track_video(video_path, flag, stop_event, preview_fps=PREVIEW_FPS, model=None, project=None, name=None,
+                preview_path=PREVIEW_PATH, interactions=None, metrics=None, stride=1, roi=None, batch=1,
+                checkpoint_interval=0, resume=False):
+    """
+    Tracks one video and writes its labels, annotated video and track store.
+
+    Parameters:
+      - video_path (str): Video to track.
+      - flag (int): Model selection, see load_model.
+      - stop_event (threading.Event-like): Checked every frame; stops the run when set.
+      - preview_fps (float): Preview image writes per second.
+      - model (YOLO): Already loaded model to reuse (loaded from flag if None).
+      - project, name (str): Output directory is project/name; by default a new runs/detect/trackN.
+      - preview_path (str): Where the preview image is written.
+      - interactions (ant_interactions.InteractionCounter): Fed every tracked frame, so its
+        live_count() is up to date during the run; finished when the whole video was tracked.
+      - metrics (run_metrics.RunMetrics): Receives per-stage timings and progress; finished with
+        the run's status. A metrics object printing to stdout is used if None.
+      - stride (int): Run the detector on every stride-th frame only and interpolate the
+        tracks in between (see track_video_frames). 1 tracks every frame.
+      - roi (tuple): Normalized (x_min, y_min, x_max, y_max) region the frames are cropped to
+        before inference (see parse_roi); None runs inference on the full frame.
+      - batch (int): Frames per detector call, decoded ahead on a background thread (see
+        track_video_frames). 1 lets ultralytics read the video itself.
+      - checkpoint_interval (int): Frames between checkpoints of the run (see run_checkpoint);
+        a stopped run is checkpointed too. 0 writes no checkpoints.
+      - resume (bool): Continue the run in project/name from its checkpoint, if it has one.
+
+    Returns:
+      - run_dir (str): Directory holding the labels and track store of the run, or None if
+        no frame was tracked. Errors are raised to the caller.
+    """
+    # Checkpoints need the frame loop in this module: ultralytics cannot start reading a video mid-way.
+    if stride > 1 or roi is not None or batch > 1 or checkpoint_interval > 0 or resume:
+        return track_video_frames(video_path, flag, stop_event, stride=stride, roi=roi, batch=batch,
+                                  preview_fps=preview_fps, model=model, project=project, name=name,
+                                  preview_path=preview_path, interactions=interactions, metrics=metrics,
+                                  checkpoint_interval=checkpoint_interval, resume=resume)
+    if metrics is None:
+        metrics = run_metrics.RunMetrics(os.path.basename(video_path))
+    if model is None:
+        with metrics.time("model_load"):
+            model = load_model(flag)
+    reset_trackers(model)
+    # Always name the output directory: a model reused from the registry would otherwise
+    # keep the save_dir of its previous (warm-up) prediction.
+    if project is not None:
+        output_args = dict(project=project, name=name or "track", exist_ok=True)
+    else:
+        output_args = dict(project="runs/detect", name=name or "track", exist_ok=False)
+    # stream=True makes track() return a generator, so only the current frame's
+    # Results are held in memory no matter how long the video is.
+    results = model.track(source=video_path, show=False, show_labels=True, show_boxes=True, save=True,
+                          save_txt=True, stream=True, line_width=1, tracker=TRACKER_CONFIG,
+                          conf=tracking_config(flag)['conf'], persist=True if flag != 0 else None,
+                          **output_args)
+    preview = PreviewWriter(path=preview_path, fps=preview_fps)
+    timer = PredictorTimer(metrics)
+    timer.attach(model)
+
+    writer = None
+    n_frames = None
+    status = "done"
     try:
-        model = YOLO('best1-2.pt') if flag == 0 else YOLO('best3-3(v11m_50).pt')
-        results = model.track(source=video_path, show=False, show_labels=True, show_boxes=True, save=True,
-                              save_txt=True, stream=False, line_width=1, tracker='bytetrack.yaml',
-                              conf=0.1 if flag != 0 else None, persist=True if flag != 0 else None)
-        
-        # Process and save results. If results is an iterator or generator, you must periodically check the stop_event.
+        for frame_index, result in enumerate(results):
+            if stop_event.is_set():
+                print("Stop event detected. Exiting tracking loop.")
+                status = "cancelled"
+                break
+            for stage, ms in result.speed.items():
+                metrics.add(stage, ms / 1000)
+            if metrics.total_frames is None:
+                metrics.total_frames = getattr(model.predictor.dataset, "frames", None)
+            # Alongside the per-frame label files, pack the run into a single track store.
+            with metrics.time("store_write"):
+                if writer is None:
+                    writer = track_store.TrackStoreWriter(os.path.join(result.save_dir, track_store.STORE_NAME))
+                rows = track_store.rows_from_boxes(result.boxes)
+                writer.add_frame(frame_index, rows)
+            if interactions is not None:
+                with metrics.time("interactions"):
+                    interactions.update_rows(frame_index, rows)
+            with metrics.time("preview_write"):
+                preview.maybe_write(result)
+            metrics.frame_done()
+            timer.resume()
+        else:
+            # Completed runs cover the whole video, so frames after the last
+            # detection are recorded as empty rather than missing.
+            n_frames = getattr(model.predictor.dataset, "frames", None)
+            if interactions is not None:
+                interactions.finish()
+    except Exception as e:
+        status = "failed"
+        metrics.error = str(e)
+        raise
+    finally:
+        results.close()
+        timer.detach(model)
+        # Closing the generator early skips ultralytics' own cleanup, so release
+        # the annotated video writers to keep the partial video playable.
+        if model.predictor is not None:
+            for vid_writer in model.predictor.vid_writer.values():
+                if hasattr(vid_writer, "release"):
+                    vid_writer.release()
+        if writer is not None:
+            writer.close(n_frames)
+            print(f"Track store written to {writer.path}")
+        metrics.finish(status, metrics.error)
+    run_dir = os.path.dirname(writer.path) if writer is not None else None
+    record_run(run_dir, video_path, tracking_config(flag), metrics)
+    return run_dir
+
+def interpolate_rows(rows_a, rows_b, frame_a, frame_b):
+    """
+    Linearly interpolates the boxes of the tracks detected in both frame_a and
+    frame_b for every frame in between.
+
+    Parameters:
+      - rows_a, rows_b (np.ndarray): (n, 7) rows (cls, x, y, w, h, conf, track_id) of the two frames.
+
+    Returns:
+      - frames (list): (frame, rows) for frame_a < frame < frame_b. Interpolated rows have
+        conf NaN; tracks missing from either end are not filled in.
+    """
+    rows_a = np.asarray(rows_a, dtype=float).reshape(-1, 7)
+    rows_b = np.asarray(rows_b, dtype=float).reshape(-1, 7)
+    # Untracked detections (track_id -1) are different ants in every frame; never link them.
+    rows_a = rows_a[rows_a[:, 6] >= 0]
+    rows_b = rows_b[rows_b[:, 6] >= 0]
+    ids_a, first_a = np.unique(rows_a[:, 6], return_index=True)
+    ids_b, first_b = np.unique(rows_b[:, 6], return_index=True)
+    _, in_a, in_b = np.intersect1d(ids_a, ids_b, return_indices=True)
+    start = rows_a[first_a[in_a]]
+    end = rows_b[first_b[in_b]]
+
+    frames = []
+    for frame in range(frame_a + 1, frame_b):
+        t = (frame - frame_a) / (frame_b - frame_a)
+        rows = start.copy()
+        rows[:, 1:5] = track_store.label_precision(start[:, 1:5] + (end[:, 1:5] - start[:, 1:5]) * t)
+        rows[:, 5] = np.nan
+        frames.append((frame, rows))
+    return frames
+
+class FrameReader(threading.Thread):
+    """
+    Decodes a video on a background thread into a bounded queue, so decoding
+    overlaps with inference. Iterating yields (frame_index, image, decode_seconds)
+    until the end of the video; frame indices count from `first_frame`, the frame
+    cap is positioned at (see seek).
+    """
+    def __init__(self, cap, prefetch=PREFETCH_FRAMES, first_frame=0):
+        super().__init__(daemon=True)
+        self.cap = cap
+        self.first_frame = first_frame
+        self.queue = queue.Queue(maxsize=prefetch)
+        self.error = None
+        self._stopping = threading.Event()
+
+    def run(self):
+        frame_index = self.first_frame
+        try:
+            while not self._stopping.is_set():
+                start = time.perf_counter()
+                ok, image = self.cap.read()
+                if not ok:
+                    break
+                self._put((frame_index, image, time.perf_counter() - start))
+                frame_index += 1
+        except Exception as e:
+            self.error = e
+        finally:
+            self._put(None)
+
+    def _put(self, item):
+        # Blocks while the queue is full, but gives up once the reader is stopped.
+        while not self._stopping.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def __iter__(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            yield item
+
+    def raise_error(self):
+        """Re-raises a decoding error of the reader thread, if there was one."""
+        if self.error is not None:
+            raise self.error
+
+    def stop(self):
+        self._stopping.set()
+        self.join()
+
+def seek(cap, frame):
+    """Positions a capture at `frame`, grabbing up to it where the container cannot seek."""
+    if frame <= 0:
+        return
+    if cap.set(cv2.CAP_PROP_POS_FRAMES, frame) and int(cap.get(cv2.CAP_PROP_POS_FRAMES)) == frame:
+        return
+    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+    for _ in range(frame):
+        if not cap.grab():
+            raise IOError(f"Cannot seek to frame {frame}: the video is shorter.")
+
+def discard_after_checkpoint(run_dir, labels_dir, stem, frame, segments):
+    """
+    Removes what an interrupted run wrote after its checkpoint at `frame`: label
+    files of later frames and video segments the checkpoint does not list.
+    """
+    for name in os.listdir(labels_dir):
+        number = track_store.label_frame_number(name)
+        if number is not None and number > frame:
+            os.remove(os.path.join(labels_dir, name))
+    for name in os.listdir(run_dir):
+        if name.startswith(f"{stem}.part") and name not in segments:
+            os.remove(os.path.join(run_dir, name))
+
+def join_segments(run_dir, segments, output_name):
+    """
+    Joins the annotated video segments of a checkpointed run into one video
+    (ffmpeg, without re-encoding). Without ffmpeg the segments are kept.
+    """
+    paths = [os.path.join(run_dir, name) for name in segments]
+    output = os.path.join(run_dir, output_name)
+    if len(paths) == 1:
+        os.replace(paths[0], output)
+    elif paths and shutil.which('ffmpeg') is not None:
+        import false_positive
+        false_positive.concat_videos(paths, output)
+        for path in paths:
+            os.remove(path)
+    elif paths:
+        print(f"ffmpeg not found; the annotated video is left in {len(paths)} segments in {run_dir}.")
+
+def parse_roi(text):
+    """
+    Parses a region of interest 'x_min,y_min,x_max,y_max' given in normalized
+    frame coordinates. Returns None for an empty string.
+    """
+    if text is None or not str(text).strip():
+        return None
+    values = tuple(float(v) for v in str(text).split(','))
+    if len(values) != 4:
+        raise ValueError(f"ROI needs 4 values x_min,y_min,x_max,y_max, got {text!r}")
+    x_min, y_min, x_max, y_max = values
+    if not (0 <= x_min < x_max <= 1 and 0 <= y_min < y_max <= 1):
+        raise ValueError(f"ROI {text!r} is not a region inside the frame (normalized 0-1 coordinates).")
+    return values
+
+def roi_pixels(roi, width, height):
+    """Pixel bounds (x0, y0, x1, y1) of a normalized ROI in a width x height frame."""
+    x_min, y_min, x_max, y_max = roi
+    x0, y0 = int(round(x_min * width)), int(round(y_min * height))
+    x1, y1 = max(x0 + 1, int(round(x_max * width))), max(y0 + 1, int(round(y_max * height)))
+    return x0, y0, x1, y1
+
+def rows_to_frame(rows, crop, width, height):
+    """
+    Maps (n, 7) rows normalized to a crop (x0, y0, x1, y1) back to coordinates
+    normalized to the full width x height frame.
+    """
+    x0, y0, x1, y1 = crop
+    crop_width, crop_height = x1 - x0, y1 - y0
+    rows = np.array(rows, dtype=float).reshape(-1, 7)
+    rows[:, 1] = (x0 + rows[:, 1] * crop_width) / width
+    rows[:, 2] = (y0 + rows[:, 2] * crop_height) / height
+    rows[:, 3] = rows[:, 3] * crop_width / width
+    rows[:, 4] = rows[:, 4] * crop_height / height
+    rows[:, 1:5] = track_store.label_precision(rows[:, 1:5])
+    return rows
+
+def annotate_frame(frame, rows):
+    """Draws the boxes and track IDs of (n, 7) normalized rows onto frame."""
+    height, width = frame.shape[:2]
+    for row in rows:
+        x, y, w, h = row[1] * width, row[2] * height, row[3] * width, row[4] * height
+        p1, p2 = (int(x - w / 2), int(y - h / 2)), (int(x + w / 2), int(y + h / 2))
+        cv2.rectangle(frame, p1, p2, (0, 255, 0), 1)
+        if row[6] >= 0:
+            cv2.putText(frame, f"id:{int(row[6])}", (p1[0], p1[1] - 4), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 255, 0), 1)
+    return frame
+
+def track_video_frames(video_path, flag, stop_event, stride=1, roi=None, batch=1, preview_fps=PREVIEW_FPS,
+                       model=None, project=None, name=None, preview_path=PREVIEW_PATH, interactions=None,
+                       metrics=None, checkpoint_interval=0, resume=False):
+    """
+    Frame-by-frame version of track_video, decoding the video itself so it can
+    skip and crop frames before inference.
+
+    With stride > 1 it runs YOLO + ByteTrack only on frames 0, stride, 2*stride, ...
+    (and on the last frame), interpolating each track's box linearly in between. Every
+    frame still gets its label file, track store rows and annotated video frame, so
+    downstream tools see dense tracks; interpolated rows have no confidence (NaN in the store).
+
+    With an roi, frames are cropped to it before inference and the boxes are mapped back
+    to full-frame normalized coordinates, so labels look like those of a full-frame run.
+
+    Frames are decoded ahead on a background thread (FrameReader). With batch > 1, the
+    detector runs on mini-batches of that many frames; ByteTrack still associates the
+    detections frame by frame in video order, so the tracks and IDs match those of
+    batch=1 (boxes may differ by float32 rounding in the last printed digit).
+
+    With checkpoint_interval > 0 the run is checkpointed every that many frames and when
+    it is stopped (see run_checkpoint), and the annotated video is written in one segment
+    per checkpoint, joined when the run finishes. With resume, a run whose directory holds
+    a checkpoint continues from it: the track store, trackers, interaction counter and
+    labels are restored to the checkpoint and decoding starts at its frame.
+
+    Parameters and return value are those of track_video.
+    """
+    from ultralytics.utils import MACOS, WINDOWS #type:ignore
+    from ultralytics.utils.files import increment_path #type:ignore
+
+    if metrics is None:
+        metrics = run_metrics.RunMetrics(os.path.basename(video_path))
+    if model is None:
+        with metrics.time("model_load"):
+            model = load_model(flag, slot=FRAME_TRACK_SLOT)
+    reset_trackers(model)
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise IOError(f"Cannot open video file: {video_path}")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    metrics.total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    crop = roi_pixels(roi, *size) if roi is not None else None
+    config = tracking_config(flag, stride, roi, batch)
+
+    # Same output layout as ultralytics: labels/<stem>_<frame>.txt and the annotated video.
+    if project is not None:
+        run_dir = increment_path(Path(project) / (name or "track"), exist_ok=True)
+    else:
+        run_dir = increment_path(Path("runs/detect") / (name or "track"), exist_ok=False)
+    labels_dir = run_dir / "labels"
+    labels_dir.mkdir(parents=True, exist_ok=True)
+    stem = Path(video_path).stem
+    suffix, fourcc = (".mp4", "avc1") if MACOS else (".avi", "WMV2") if WINDOWS else (".avi", "MJPG")
+    preview = PreviewWriter(path=preview_path, fps=preview_fps)
+
+    video = {'size': list(size), 'frames': metrics.total_frames}
+    state = run_checkpoint.load(run_dir) if resume else None
+    if resume and state is None:
+        print(f"No checkpoint in {run_dir}; tracking from the first frame.")
+    if state is not None and (state['video'] != video or state['config'] != config):
+        raise ValueError(f"The checkpoint in {run_dir} belongs to another video or other tracking settings.")
+    segmented = checkpoint_interval > 0 or state is not None
+    start = state['frame'] if state is not None else 0
+    # Annotated video segments closed at a checkpoint (file names in run_dir).
+    segments = list(state['segments']) if state is not None else []
+    if segmented:
+        discard_after_checkpoint(run_dir, labels_dir, stem, start, segments)
+    if state is not None:
+        seek(cap, start)
+        writer = track_store.TrackStoreWriter.resume(run_dir / track_store.STORE_NAME, state['store'])
+        if interactions is not None and state['interactions'] is not None:
+            interactions.__dict__.update(state['interactions'])
+        restore = run_checkpoint.TrackerRestore(state['trackers'])
+        restore.attach(model)
+        # Progress and fps of this run cover the frames left to track.
+        metrics.total_frames = max(0, metrics.total_frames - start)
+        print(f"Resuming {run_dir} from frame {start}.")
+    else:
+        run_checkpoint.clear(run_dir)
+        writer = track_store.TrackStoreWriter(run_dir / track_store.STORE_NAME)
+        restore = None
+
+    def segment_name(first_frame):
+        return f"{stem}.part{first_frame:07d}{suffix}" if segmented else f"{stem}{suffix}"
+
+    def open_segment(first_frame):
+        return cv2.VideoWriter(str(run_dir / segment_name(first_frame)), cv2.VideoWriter_fourcc(*fourcc), fps, size)
+
+    segment_start = start
+    video_writer = open_segment(segment_start)
+
+    def detect_batch(images):
+        if crop is not None:
+            with metrics.time("crop"):
+                x0, y0, x1, y1 = crop
+                images = [np.ascontiguousarray(image[y0:y1, x0:x1]) for image in images]
+        # One call for the whole mini-batch: ultralytics preprocesses and infers the frames
+        # together, then updates the tracker with each frame's detections in order.
+        with metrics.time("track"):
+            results = model.track(images, persist=True, conf=config['conf'], tracker=TRACKER_CONFIG, verbose=False)
+        batch_rows = []
         for result in results:
+            for stage, ms in result.speed.items():
+                metrics.add(stage, ms / 1000)
+            rows = track_store.rows_from_boxes(result.boxes)
+            batch_rows.append(rows_to_frame(rows, crop, *size) if crop is not None else rows)
+        return batch_rows
+
+    def emit(frame_index, image, rows):
+        with metrics.time("label_write"):
+            lines = track_store.format_label_lines(rows)
+            if lines:
+                with open(labels_dir / f"{stem}_{frame_index + 1}.txt", "w") as f:
+                    f.write("\n".join(lines) + "\n")
+        with metrics.time("store_write"):
+            writer.add_frame(frame_index, rows)
+        if interactions is not None:
+            with metrics.time("interactions"):
+                interactions.update_rows(frame_index, rows)
+        with metrics.time("video_write"):
+            annotate_frame(image, rows)
+            if crop is not None:
+                cv2.rectangle(image, crop[:2], (crop[2] - 1, crop[3] - 1), ROI_COLOR, 1)
+            video_writer.write(image)
+        with metrics.time("preview_write"):
+            preview.maybe_write_frame(image)
+        metrics.frame_done()
+
+    # Frames read but not written yet: [frame index, image, rows, detect?]. Frames are
+    # detected once `batch` detection frames are buffered, then written up to the last
+    # detected one, with the skipped frames in between interpolated.
+    buffer = []
+    last = state['last'] if state is not None else None  # (frame index, rows) of the last written detection
+
+    def flush(final=False):
+        nonlocal buffer, last
+        if final and buffer and not buffer[-1][3]:
+            # Detect on the last frame too, so the tail of the video is interpolated as well.
+            buffer[-1][3] = True
+        targets = [entry for entry in buffer if entry[3]]
+        if not targets:
+            return
+        for entry, rows in zip(targets, detect_batch([entry[1] for entry in targets])):
+            entry[2] = rows
+        cut = max(i for i, entry in enumerate(buffer) if entry[3]) + 1
+        skipped = []
+        for entry in buffer[:cut]:
+            if not entry[3]:
+                skipped.append(entry)
+                continue
+            if skipped:
+                with metrics.time("interpolate"):
+                    filled = interpolate_rows(last[1], entry[2], last[0], entry[0])
+                for (skipped_index, skipped_image, _, _), (_, rows) in zip(skipped, filled):
+                    emit(skipped_index, skipped_image, rows)
+                skipped = []
+            emit(entry[0], entry[1], entry[2])
+            last = (entry[0], entry[2])
+        buffer = buffer[cut:]
+
+    def close_segment():
+        """Closes the current video segment; one without frames is deleted."""
+        nonlocal video_writer
+        video_writer.release()
+        video_writer = None
+        if writer.n_frames > segment_start:
+            segments.append(segment_name(segment_start))
+        else:
+            os.remove(run_dir / segment_name(segment_start))
+
+    def checkpoint(reopen=True):
+        """Checkpoints every frame written so far; call with no frames buffered past the last detection."""
+        nonlocal video_writer, segment_start
+        with metrics.time("checkpoint"):
+            close_segment()
+            run_checkpoint.save(run_dir, {
+                'frame': writer.n_frames,
+                'store': writer.checkpoint(),
+                'trackers': run_checkpoint.tracker_state(model),
+                'last': last,
+                'interactions': dict(interactions.__dict__) if interactions is not None else None,
+                'segments': segments,
+                'video': video,
+                'config': config,
+            })
+            segment_start = writer.n_frames
+            if reopen:
+                video_writer = open_segment(segment_start)
+
+    reader = FrameReader(cap, prefetch=max(PREFETCH_FRAMES, batch), first_frame=start)
+    reader.start()
+    frames_read = start
+    status = "done"
+    try:
+        waited = time.perf_counter()
+        for frame_index, image, decode_seconds in reader:
+            metrics.add("decode", decode_seconds)
+            # Time spent waiting for the decoder; near zero once it keeps ahead of inference.
+            metrics.add("decode_wait", time.perf_counter() - waited)
             if stop_event.is_set():
                 print("Stop event detected. Exiting tracking loop.")
+                status = "cancelled"
+                if checkpoint_interval > 0:
+                    # Frames buffered up to the last detection are still written, so the run resumes after them.
+                    flush()
+                    checkpoint(reopen=False)
+                    print(f"Checkpoint written at frame {writer.n_frames}; resume to continue from there.")
                 break
-            # Process the result.
-            result.save(filename="uploads/result.jpg")
+            frames_read = frame_index + 1
+            buffer.append([frame_index, image, None, frame_index % stride == 0])
+            if sum(entry[3] for entry in buffer) >= batch:
+                flush()
+                if checkpoint_interval > 0 and writer.n_frames - segment_start >= checkpoint_interval:
+                    checkpoint()
+            waited = time.perf_counter()
+        else:
+            reader.raise_error()
+            flush(final=True)
+            if interactions is not None:
+                interactions.finish()
+    except Exception as e:
+        status = "failed"
+        metrics.error = str(e)
+        raise
+    finally:
+        reader.stop()
+        cap.release()
+        if restore is not None:
+            restore.detach(model)
+        if video_writer is not None:
+            if status == "done" and segmented:
+                close_segment()
+            else:
+                # A crashed run's open segment is discarded when it resumes.
+                video_writer.release()
+        # Frames read after a cancelled run's last detection are not written.
+        writer.close(frames_read if status == "done" else None)
+        print(f"Track store written to {writer.path}")
+        if status == "done" and segmented:
+            join_segments(run_dir, segments, f"{stem}{suffix}")
+            run_checkpoint.clear(run_dir)
+        metrics.finish(status, metrics.error)
+    record_run(str(run_dir), video_path, config, metrics)
+    return str(run_dir)
+
+def main(video_path, flag, stop_event, preview_fps=PREVIEW_FPS, stride=1, roi=None, batch=1, checkpoint_interval=0,
+         resume_dir=None):
+    interactions = ant_interactions.InteractionCounter()
+    # A resumed run continues in its own directory.
+    output_args = {}
+    if resume_dir:
+        resume_dir = os.path.normpath(resume_dir)
+        output_args = dict(project=os.path.dirname(resume_dir), name=os.path.basename(resume_dir), resume=True)
+    try:
+        track_video(video_path, flag, stop_event, preview_fps=preview_fps, interactions=interactions, stride=stride,
+                    roi=roi, batch=batch, checkpoint_interval=checkpoint_interval, **output_args)
         print("Tracking completed successfully.")
+        print(f"Total unique interactions tracked: {interactions.live_count()}")
     except Exception as e:
         print(f"Error during tracking: {e}", file=sys.stderr)
 
 if __name__ == "__main__":
-    if len(sys.argv) < 3:
-        print("Usage: python run_tracking.py <video_path> <flag>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Run YOLO + ByteTrack tracking on a video.")
+    parser.add_argument("video_path")
+    parser.add_argument("flag", type=int, help="0 for best1-2.pt, anything else for best3-3(v11m_50).pt")
+    parser.add_argument("--preview-fps", type=float, default=PREVIEW_FPS,
+                        help=f"Preview image writes per second (0 disables, capped at {MAX_PREVIEW_FPS}).")
+    parser.add_argument("--stride", type=int, default=1,
+                        help="Detect on every stride-th frame only and interpolate the tracks in between.")
+    parser.add_argument("--roi", type=parse_roi, default=None,
+                        help="Crop frames to x_min,y_min,x_max,y_max (normalized) before inference, "
+                             f"e.g. {ant_interactions.MIDDLE_REGION[0]},0,{ant_interactions.MIDDLE_REGION[1]},1.")
+    parser.add_argument("--batch", type=int, default=1,
+                        help="Frames per detector call; frames are decoded ahead on a background thread.")
+    parser.add_argument("--checkpoint-interval", type=int, default=0,
+                        help="Checkpoint the run every this many frames (and on Ctrl+C), so it can be resumed.")
+    parser.add_argument("--resume", metavar="RUN_DIR",
+                        help="Continue the checkpointed run in RUN_DIR (e.g. runs/detect/track3).")
+    args = parser.parse_args()
 
-    video_path = sys.argv[1]
-    flag = int(sys.argv[2])
-    # Here, since you’re running from the command line, you might create a dummy Event.
+    # Ctrl+C stops the run cooperatively, so a checkpointed run writes its checkpoint first.
+    import signal
     from threading import Event
     stop_event = Event()
-    print(f"Running tracking on: {video_path} with flag: {flag}")
-    main(video_path, flag, stop_event)
\ No newline at end of file
+    signal.signal(signal.SIGINT, lambda signum, frame: stop_event.set())
+    checkpoint_interval = args.checkpoint_interval
+    if args.resume and not checkpoint_interval:
+        # A resumed run keeps checkpointing, so it can be interrupted again.
+        checkpoint_interval = run_checkpoint.CHECKPOINT_INTERVAL
+    print(f"Running tracking on: {args.video_path} with flag: {args.flag}")
+    main(args.video_path, args.flag, stop_event, preview_fps=args.preview_fps, stride=args.stride, roi=args.roi,
+         batch=args.batch, checkpoint_interval=checkpoint_interval, resume_dir=args.resume)
\ No newline at end of file
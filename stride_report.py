@@ -0,0 +1,177 @@
+"""
+Compares strided tracking runs (run_tracking --stride k) with a full-rate run
+of the same video, to choose the largest stride an experiment tolerates.
+
+Boxes of the two runs are matched frame by frame (Hungarian assignment on
+center distance). Track IDs of the two runs are unrelated, so ID continuity is
+measured through the matches: every time the strided ID matched to a
+reference track changes, that is an ID switch.
+
+Usage:
+  python stride_report.py runs/detect/track1/labels runs/detect/track2/labels [more strided runs ...]
+  python stride_report.py --video 30.mp4 --flag 0 --strides 2,5,10   # tracks the video first
+"""
+import argparse
+import json
+from collections import defaultdict
+
+import numpy as np #type:ignore
+from scipy.optimize import linear_sum_assignment #type:ignore
+import track_store
+
+# Matches whose centers are further apart (in normalized image coordinates) do not count.
+MAX_CENTER_DISTANCE = 0.05
+
+
+def box_iou(a, b):
+    """IoU of matched boxes a[i], b[i] given as (n, 4) x, y, w, h arrays."""
+    a_lo, a_hi = a[:, :2] - a[:, 2:] / 2, a[:, :2] + a[:, 2:] / 2
+    b_lo, b_hi = b[:, :2] - b[:, 2:] / 2, b[:, :2] + b[:, 2:] / 2
+    inter = np.clip(np.minimum(a_hi, b_hi) - np.maximum(a_lo, b_lo), 0, None).prod(axis=1)
+    union = a[:, 2] * a[:, 3] + b[:, 2] * b[:, 3] - inter
+    return np.where(union > 0, inter / np.where(union > 0, union, 1), 0.0)
+
+
+def match_frame(reference, strided, max_distance=MAX_CENTER_DISTANCE):
+    """
+    Matches the boxes of one frame of two runs.
+
+    Returns:
+      ref_index, strided_index, distance (np.ndarray): Matched row indices and their center distance.
+    """
+    if len(reference) == 0 or len(strided) == 0:
+        empty = np.empty(0, dtype=int)
+        return empty, empty, np.empty(0)
+    ref_xy = np.column_stack([reference['x'], reference['y']])
+    strided_xy = np.column_stack([strided['x'], strided['y']])
+    distance = np.linalg.norm(ref_xy[:, None, :] - strided_xy[None, :, :], axis=2)
+    rows, cols = linear_sum_assignment(distance)
+    close = distance[rows, cols] <= max_distance
+    return rows[close], cols[close], distance[rows, cols][close]
+
+
+def compare_runs(reference_labels, strided_labels, max_distance=MAX_CENTER_DISTANCE):
+    """
+    Compares a strided run against a full-rate reference run of the same video.
+
+    Parameters:
+      - reference_labels, strided_labels (str): Labels directories of the two runs.
+      - max_distance (float): Largest center distance of a match.
+
+    Returns:
+      - report (dict): Recall/precision of the strided boxes, center error and IoU of
+        the matched boxes, and ID continuity (switches, strided IDs per reference track).
+    """
+    reference = track_store.open_tracks(reference_labels)
+    strided = track_store.open_tracks(strided_labels)
+    n_frames = min(len(reference), len(strided))
+
+    distances, ious = [], []
+    reference_boxes = strided_boxes = interpolated_boxes = 0
+    last_match = {}
+    ids_per_track = defaultdict(set)
+    id_switches = 0
+    for frame in range(n_frames):
+        ref_rows = reference.frame(frame)
+        ref_rows = ref_rows[ref_rows['track_id'] >= 0]
+        strided_rows = strided.frame(frame)
+        strided_rows = strided_rows[strided_rows['track_id'] >= 0]
+        reference_boxes += len(ref_rows)
+        strided_boxes += len(strided_rows)
+        interpolated_boxes += int(np.isnan(strided_rows['conf']).sum())
+
+        ref_index, strided_index, distance = match_frame(ref_rows, strided_rows, max_distance)
+        distances.append(distance)
+        ious.append(box_iou(
+            np.column_stack([ref_rows[c][ref_index] for c in ('x', 'y', 'w', 'h')]),
+            np.column_stack([strided_rows[c][strided_index] for c in ('x', 'y', 'w', 'h')])))
+        for ref_id, strided_id in zip(ref_rows['track_id'][ref_index].tolist(),
+                                      strided_rows['track_id'][strided_index].tolist()):
+            if ref_id in last_match and last_match[ref_id] != strided_id:
+                id_switches += 1
+            last_match[ref_id] = strided_id
+            ids_per_track[ref_id].add(strided_id)
+
+    distances = np.concatenate(distances) if distances else np.empty(0)
+    ious = np.concatenate(ious) if ious else np.empty(0)
+    matched = len(distances)
+
+    def stats(values):
+        if len(values) == 0:
+            return None
+        return {'mean': float(values.mean()), 'median': float(np.median(values)),
+                'p95': float(np.percentile(values, 95)), 'max': float(values.max())}
+
+    return {
+        'reference': str(reference_labels),
+        'strided': str(strided_labels),
+        'frames': n_frames,
+        'reference_boxes': reference_boxes,
+        'strided_boxes': strided_boxes,
+        'interpolated_boxes': interpolated_boxes,
+        'matched_boxes': matched,
+        'recall': matched / reference_boxes if reference_boxes else None,
+        'precision': matched / strided_boxes if strided_boxes else None,
+        'center_error': stats(distances),
+        'iou': stats(ious),
+        'reference_tracks': len(reference.track_ids()),
+        'strided_tracks': len(strided.track_ids()),
+        'id_switches': id_switches,
+        'id_switches_per_1000_frames': 1000 * id_switches / n_frames if n_frames else None,
+        'strided_ids_per_reference_track': (float(np.mean([len(ids) for ids in ids_per_track.values()]))
+                                            if ids_per_track else None),
+    }
+
+
+def track_and_compare(video_path, flag, strides, max_distance=MAX_CENTER_DISTANCE):
+    """Tracks the video at full rate and at every stride, and compares each strided run."""
+    import threading
+    import run_tracking
+    stop_event = threading.Event()
+    reference = run_tracking.track_video(video_path, flag, stop_event, preview_fps=0)
+    reports = []
+    for stride in strides:
+        run_dir = run_tracking.track_video(video_path, flag, stop_event, preview_fps=0, stride=stride)
+        report = compare_runs(f"{reference}/labels", f"{run_dir}/labels", max_distance)
+        report['stride'] = stride
+        reports.append(report)
+    return reports
+
+
+def print_report(report):
+    center = report['center_error'] or {}
+    iou = report['iou'] or {}
+    print(f"{report['strided']}" + (f" (stride {report['stride']})" if 'stride' in report else ""))
+    print(f"  recall {report['recall'] or 0:.3f}  precision {report['precision'] or 0:.3f}  "
+          f"interpolated boxes {report['interpolated_boxes']}/{report['strided_boxes']}")
+    print(f"  center error mean {center.get('mean', float('nan')):.4f}  p95 {center.get('p95', float('nan')):.4f}  "
+          f"IoU mean {iou.get('mean', float('nan')):.3f}")
+    print(f"  tracks {report['reference_tracks']} -> {report['strided_tracks']}  ID switches {report['id_switches']}  "
+          f"strided IDs per reference track {report['strided_ids_per_reference_track'] or 0:.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare strided tracking runs with a full-rate run.")
+    parser.add_argument("reference_labels", nargs="?", help="Labels directory of the full-rate run.")
+    parser.add_argument("strided_labels", nargs="*", help="Labels directories of strided runs.")
+    parser.add_argument("--video", help="Track this video at full rate and at --strides first.")
+    parser.add_argument("--flag", type=int, default=0, help="Model flag, see run_tracking.")
+    parser.add_argument("--strides", default="2,5,10", help="Comma-separated strides used with --video.")
+    parser.add_argument("--max-distance", type=float, default=MAX_CENTER_DISTANCE,
+                        help="Largest normalized center distance of two matching boxes.")
+    parser.add_argument("--output", help="Write the reports to this JSON file.")
+    args = parser.parse_args()
+
+    if args.video:
+        reports = track_and_compare(args.video, args.flag, [int(s) for s in args.strides.split(',')], args.max_distance)
+    elif args.reference_labels and args.strided_labels:
+        reports = [compare_runs(args.reference_labels, labels, args.max_distance) for labels in args.strided_labels]
+    else:
+        parser.error("Give a reference and strided labels directories, or --video.")
+
+    for report in reports:
+        print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(reports, f, indent=2)
+        print(f"Report written to {args.output}")
@@ -0,0 +1,102 @@
+"""
+Synthetic tracking runs for benchmarking the post-tracking pipeline without
+a model or real recordings.
+
+generate_run() writes a directory laid out like an ultralytics tracking run:
+
+  <run_dir>/labels/<stem>_<frame>.txt   one YOLO label file per frame with detections
+  <run_dir>/tracks.bin                  the matching track store
+  <run_dir>/<stem>.mp4                  optional video with the ants drawn in
+
+Ants perform a random walk in normalized coordinates; with probability
+`id_churn` per ant and frame the tracker "loses" an ant and gives it a new
+ID, and with probability `miss_rate` an ant is not detected in a frame.
+"""
+import os
+import cv2 #type:ignore
+import numpy as np #type:ignore
+import track_store
+
+VIDEO_STEM = "synthetic"
+VIDEO_SIZE = (320, 240)
+VIDEO_FPS = 30
+
+
+def simulate(n_frames, n_ants, id_churn=0.001, miss_rate=0.02, box_size=(0.06, 0.04), step=0.004, seed=0):
+    """
+    Yields (frame, rows) for every frame, rows being an (n, 7) array of
+    cls, x, y, w, h, conf, track_id like track_store.parse_label_lines returns.
+    Coordinates are rounded through '%g' as in ultralytics label files.
+    """
+    rng = np.random.default_rng(seed)
+    positions = rng.random((n_ants, 2))
+    ids = np.arange(1, n_ants + 1)
+    next_id = n_ants + 1
+    sizes = np.array(box_size) * rng.uniform(0.8, 1.2, (n_ants, 2))
+    for frame in range(n_frames):
+        positions = np.clip(positions + rng.normal(0, step, positions.shape), 0.05, 0.95)
+        churned = rng.random(n_ants) < id_churn
+        ids[churned] = np.arange(next_id, next_id + churned.sum())
+        next_id += churned.sum()
+        seen = rng.random(n_ants) >= miss_rate
+        rows = np.column_stack([
+            np.zeros(n_ants), positions, sizes, np.full(n_ants, np.nan), ids,
+        ])[seen]
+        rows[:, 1:5] = np.array([[float("%g" % v) for v in row] for row in rows[:, 1:5].tolist()]).reshape(-1, 4)
+        yield frame, rows
+
+
+def write_labels(labels_dir, frame, rows, stem=VIDEO_STEM):
+    """Writes one frame's rows in ultralytics' tracking label format (no file if empty)."""
+    if len(rows) == 0:
+        return
+    with open(os.path.join(labels_dir, f"{stem}_{frame + 1}.txt"), "w") as f:
+        for row in rows:
+            f.write("%d %g %g %g %g %d\n" % (row[0], row[1], row[2], row[3], row[4], row[6]))
+
+
+def draw_frame(rows, size=VIDEO_SIZE):
+    """A dark frame with one filled ellipse per detection."""
+    width, height = size
+    frame = np.full((height, width, 3), 30, dtype=np.uint8)
+    for row in rows:
+        center = (int(row[1] * width), int(row[2] * height))
+        axes = (max(1, int(row[3] * width / 2)), max(1, int(row[4] * height / 2)))
+        cv2.ellipse(frame, center, axes, 0, 0, 360, (40, 90, 160), -1)
+    return frame
+
+
+def generate_run(run_dir, n_frames, n_ants, id_churn=0.001, miss_rate=0.02, video=True, seed=0):
+    """
+    Writes a synthetic tracking run (labels, track store and optionally a video).
+
+    Returns:
+      - paths (dict): labels_dir, store_path and video_path (None without video).
+    """
+    labels_dir = os.path.join(run_dir, "labels")
+    os.makedirs(labels_dir, exist_ok=True)
+    store_path = os.path.join(run_dir, track_store.STORE_NAME)
+    video_path = os.path.join(run_dir, f"{VIDEO_STEM}.mp4") if video else None
+
+    out = None
+    if video:
+        out = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*'mp4v'), VIDEO_FPS, VIDEO_SIZE)
+    with track_store.TrackStoreWriter(store_path) as writer:
+        for frame, rows in simulate(n_frames, n_ants, id_churn, miss_rate, seed=seed):
+            write_labels(labels_dir, frame, rows)
+            writer.add_frame(frame, rows)
+            if out is not None:
+                out.write(draw_frame(rows))
+        writer.close(n_frames)
+    if out is not None:
+        out.release()
+    return {'labels_dir': labels_dir, 'store_path': store_path, 'video_path': video_path}
+
+
+def generate_video(video_path, n_frames, size=VIDEO_SIZE, fps=VIDEO_FPS, seed=0, n_ants=4):
+    """Writes a video of moving blobs without any labels (for decode/encode benchmarks and tracking checks)."""
+    out = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+    for _, rows in simulate(n_frames, n_ants, id_churn=0, miss_rate=0, seed=seed):
+        out.write(draw_frame(rows, size))
+    out.release()
+    return video_path
@@ -1,11 +1,8 @@
-import os
-import glob
-import math
-import matplotlib.pyplot as plt # type: ignore
+from matplotlib.figure import Figure # type: ignore
 import numpy as np # type: ignore
-from scipy.signal import savgol_filter # type: ignore
-from collections import defaultdict
-from pathlib import Path
+import track_store
+
+BROOD_PLOT = "brood_distances.png"
 
 def handle_outliers(data, mad_factor=3.0):
     """
@@ -34,104 +31,157 @@ def handle_outliers(data, mad_factor=3.0):
 
     return data
 
-def distance(p1, p2):
-    """Calculate Euclidean distance between two points."""
-    return math.sqrt((p1[0] - p2[0])**2 + (p1[1] - p2[1])**2)
-
-def process_file(filepath):
-    with open(filepath, 'r') as f:
-        lines = [line.strip() for line in f if line.strip()]
-    
-    if len(lines) == 2:
-        parts1 = lines[0].split()
-        parts2 = lines[1].split()
-
-        if len(parts1) < 6:
-            return None
-        
-        # return (track ID, x-center, y-center)
-        ant1 = [int(parts1[5]), float(parts1[1]), float(parts1[2])]
-        ant2 = [int(parts2[5]), float(parts2[1]), float(parts2[2])]
-        return ant1, ant2
-    else:
-        return None
-    
-def main(directory, x, y):
-    # Specify the directory containing the txt files.
-    txt_files = sorted(Path(directory).iterdir(), key=os.path.getmtime)
-    l_x_center, l_y_center = x, y
-    # Process only every nth file.
-    interval = 60
-    txt_files = txt_files[::interval]
-
-    ant1_ids = []
-    ant2_ids = []
-    
-    for txt_file in txt_files:
-        result = process_file(txt_file)
-        if result is not None:
-            ant1, ant2 = result
-            if len(ant1_ids) == 0:
-                ant1_ids.append(ant1[0])
-            if len(ant2_ids) == 0:
-                ant2_ids.append(ant2[0])
-            if ant1[0] not in ant1_ids and ant2[0] in ant2_ids:
-                ant1_ids.append(ant1[0])
-            elif ant1[0] in ant1_ids and ant2[0] not in ant2_ids:
-                ant2_ids.append(ant2[0])
-            elif ant1[0] in ant2_ids and ant2[0] not in ant1_ids:
-                ant1_ids.append(ant2[0])
-            elif ant1[0] not in ant2_ids and ant2[0] in ant1_ids:
-                ant2_ids.append(ant1[0])
-
-    # print(ant1_ids)
-    # print(ant2_ids)
-    # Lists to store midpoints for each object across frames.
-    ant1_list, ant2_list = [], []
-    
-    for txt_file in txt_files:
-        result = process_file(txt_file)
-        if result is not None:
-            ant1, ant2 = result
-            if ant1[0] in ant1_ids and ant2[0] in ant2_ids:
-                ant1_list.append(ant1[1:])
-                ant2_list.append(ant2[1:])
-            else:
-                ant1_list.append(ant2[1:])
-                ant2_list.append(ant1[1:])
-    
-    # print(ant1_list[:10])
-    # print(len(ant1_list))
-    # print(ant2_list[:10])
-    # print(len(ant2_list))
-
-    # Compute distances for each frame.
-    l = [l_x_center, l_y_center]
-    dist_ant1_larva = np.array([distance(a1, l) for a1 in ant1_list])
-    dist_ant2_larva = np.array([distance(a2, l) for a2 in ant2_list])
-    dist_ant1_ant2  = np.array([distance(a1, a2) for a1, a2 in zip(ant1_list, ant2_list)])
-    
-    # 1) Outlier removal
-    # dist_ant1_larva_no_outliers = handle_outliers(dist_ant1_larva)
-    # dist_ant2_larva_no_outliers = handle_outliers(dist_ant2_larva)
-    # dist_ant1_ant2_no_outliers  = handle_outliers(dist_ant1_ant2)
-
-    # 2) Savitzky–Golay filtering
-    # dist_ant1_larva_no_outliers = savgol_filter(dist_ant1_larva_no_outliers, 9, 2)
-    # dist_ant2_larva_no_outliers = savgol_filter(dist_ant2_larva_no_outliers, 9, 2)
-    # dist_ant1_ant2_no_outliers  = savgol_filter(dist_ant1_ant2_no_outliers,  9, 2)
-
-    # Plot the distances.
-    frames = list(range(1, len(ant1_list) + 1))
-    plt.figure(figsize=(10, 6))
-    plt.plot(frames, dist_ant1_larva, label="Distance: Ant1 - Larva")
-    plt.plot(frames, dist_ant2_larva, label="Distance: Ant2 - Larva")
-    plt.plot(frames, dist_ant1_ant2, label="Distance: Ant1 - Ant2")
-    plt.xlabel("Frame")
-    plt.ylabel("Scaled Distance")
-    plt.title("Distance vs Frame")
-    plt.legend()
-    plt.show()
+def load_tracks(directory):
+    """Load the track store of the run whose txt files are in `directory`."""
+    return track_store.open_tracks(directory)
+
+def frame_pairs(frames):
+    """
+    Index pairs (i, j), i < j, of all rows that share a frame, for rows sorted
+    by frame. Frames are grouped by their number of rows, so every group is one
+    broadcast instead of a Python loop per frame.
+    """
+    if len(frames) == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+    firsts = np.flatnonzero(np.r_[True, frames[1:] != frames[:-1]])
+    counts = np.diff(np.r_[firsts, len(frames)])
+    pair_i, pair_j = [], []
+    for count in np.unique(counts[counts >= 2]):
+        group = firsts[counts == count]
+        i, j = np.triu_indices(count, 1)
+        pair_i.append((group[:, None] + i[None, :]).ravel())
+        pair_j.append((group[:, None] + j[None, :]).ravel())
+    if not pair_i:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+    pair_i, pair_j = np.concatenate(pair_i), np.concatenate(pair_j)
+    # Back to frame order.
+    order = np.lexsort((pair_j, pair_i))
+    return pair_i[order], pair_j[order]
+
+def assign_ants(id_pairs):
+    """
+    Splits the track IDs of two-ant frames into ant 1 and ant 2 (the tracker
+    gives an ant new IDs when it loses it). Same rules as the original
+    per-frame loop: an unknown ID joins the side opposite to the known one.
+
+    Parameters:
+      id_pairs (np.ndarray): (K, 2) track IDs of the two ants, one row per frame.
+
+    Returns:
+      swapped (np.ndarray): (K,) True where the second ID of the row is ant 1.
+    """
+    ant1_ids, ant2_ids = set(), set()
+    for id1, id2 in id_pairs.tolist():
+        if not ant1_ids:
+            ant1_ids.add(id1)
+        if not ant2_ids:
+            ant2_ids.add(id2)
+        if id1 not in ant1_ids and id2 in ant2_ids:
+            ant1_ids.add(id1)
+        elif id1 in ant1_ids and id2 not in ant2_ids:
+            ant2_ids.add(id2)
+        elif id1 in ant2_ids and id2 not in ant1_ids:
+            ant1_ids.add(id2)
+        elif id1 not in ant2_ids and id2 in ant1_ids:
+            ant2_ids.add(id1)
+    in_order = np.array([id1 in ant1_ids and id2 in ant2_ids for id1, id2 in id_pairs.tolist()], dtype=bool)
+    return ~in_order
+
+def analyze_brood(directory, larva_x, larva_y, interval=1):
+    """
+    Distances between the ants and the larva, and between the ants, computed
+    for every detection of the run at once from its track store.
+
+    Parameters:
+      directory (str): Labels directory of the run.
+      larva_x, larva_y (float): Normalized larva position.
+      interval (int): Use only every interval-th frame (1: every frame).
+
+    Returns:
+      dict of np.ndarray:
+        frames, track_ids, x, y      every tracked detection
+        larva_distance               distance of each detection to the larva
+        pair_frames, pair_a, pair_b  every pair of ants seen in the same frame
+        pair_distance                distance between the two ants of each pair
+        two_ant_frames               frames with exactly two tracked ants
+        ant1_larva, ant2_larva,      the distances of ant 1 and ant 2 in those frames,
+        ant1_ant2                    with ant identities assigned by assign_ants
+    """
+    tracks = load_tracks(directory)
+    rows = tracks.rows
+    frames = np.asarray(rows['frame'], dtype=np.int64)
+    keep = np.asarray(rows['track_id']) >= 0
+    if interval > 1:
+        keep &= frames % interval == 0
+    frames = frames[keep]
+    track_ids = np.asarray(rows['track_id'])[keep].astype(np.int64)
+    x = np.asarray(rows['x'])[keep]
+    y = np.asarray(rows['y'])[keep]
+
+    larva_distance = np.hypot(x - larva_x, y - larva_y)
+
+    pair_i, pair_j = frame_pairs(frames)
+    pair_distance = np.hypot(x[pair_i] - x[pair_j], y[pair_i] - y[pair_j])
+
+    # Frames with exactly two ants: rows i, i + 1 in frame order.
+    firsts = np.flatnonzero(np.r_[True, frames[1:] != frames[:-1]]) if len(frames) else np.empty(0, dtype=np.int64)
+    counts = np.diff(np.r_[firsts, len(frames)])
+    first = firsts[counts == 2]
+    second = first + 1
+    swapped = assign_ants(np.column_stack([track_ids[first], track_ids[second]]))
+    ant1 = np.where(swapped, second, first)
+    ant2 = np.where(swapped, first, second)
+
+    return {
+        'frames': frames,
+        'track_ids': track_ids,
+        'x': x,
+        'y': y,
+        'larva_distance': larva_distance,
+        'pair_frames': frames[pair_i],
+        'pair_a': track_ids[pair_i],
+        'pair_b': track_ids[pair_j],
+        'pair_distance': pair_distance,
+        'two_ant_frames': frames[first],
+        'ant1_larva': larva_distance[ant1],
+        'ant2_larva': larva_distance[ant2],
+        'ant1_ant2': np.hypot(x[ant1] - x[ant2], y[ant1] - y[ant2]),
+    }
+
+def plot_brood(analysis, output_path=BROOD_PLOT):
+    """
+    Plots the ant-larva and ant-ant distances of the two-ant frames to a PNG.
+    Uses a bare matplotlib Figure (Agg canvas), so no display is needed and
+    nothing blocks.
+    """
+    figure = Figure(figsize=(10, 6))
+    ax = figure.subplots()
+    frames = analysis['two_ant_frames'] + 1
+    ax.plot(frames, analysis['ant1_larva'], label="Distance: Ant1 - Larva")
+    ax.plot(frames, analysis['ant2_larva'], label="Distance: Ant2 - Larva")
+    ax.plot(frames, analysis['ant1_ant2'], label="Distance: Ant1 - Ant2")
+    ax.set_xlabel("Frame")
+    ax.set_ylabel("Scaled Distance")
+    ax.set_title("Distance vs Frame")
+    ax.legend()
+    figure.savefig(output_path, format="png")
+    return output_path
+
+def main(directory, x, y, output_path=BROOD_PLOT, interval=1):
+    """
+    Brood analysis of a run: returns the distance arrays (see analyze_brood)
+    and the path of the rendered PNG plot.
+    """
+    analysis = analyze_brood(directory, float(x), float(y), interval)
+    return analysis, plot_brood(analysis, output_path)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    import sys
+    if len(sys.argv) < 4:
+        print("Usage: python test_track.py <labels_dir|job_id|latest> <larva_x> <larva_y> [output.png]")
+        sys.exit(1)
+    import run_catalog
+    directory = run_catalog.resolve_labels(sys.argv[1])
+    print("Plot written to", main(directory, *sys.argv[2:4], *sys.argv[4:5])[1])
@@ -0,0 +1,84 @@
+"""
+Makes the repository's top-level modules importable from the tests, and
+provides what the tracking checks need.
+
+Tracking checks run the real model on CPU and are skipped without ultralytics
+or weights. Weights default to the flag-0 tracking weights at the repository
+root; TRACKING_TEST_WEIGHTS points them elsewhere and TRACKING_TEST_VIDEO
+replaces the synthetic video.
+"""
+import os
+import sys
+
+import numpy as np #type:ignore
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+TRACKING_FRAMES = 90
+# Enough ants in the synthetic video that some of them touch (interactions).
+TRACKING_ANTS = 16
+
+
+@pytest.fixture
+def tracking_setup(tmp_path, monkeypatch):
+    """
+    Weights and video for tracking checks, with the flag-0 weights pointed at
+    them and the run catalog kept in tmp_path.
+
+    Returns:
+      - video_path (str): Video to track.
+    """
+    pytest.importorskip("ultralytics")
+    import model_registry
+    import run_catalog
+    import synthetic_data
+
+    weights = os.environ.get('TRACKING_TEST_WEIGHTS') or os.path.join(ROOT, model_registry.weights_for_flag(0))
+    if not os.path.exists(weights):
+        pytest.skip(f"no tracking weights at {weights} (set TRACKING_TEST_WEIGHTS)")
+    monkeypatch.setitem(model_registry.TRACKING_WEIGHTS, 0, weights)
+    monkeypatch.setattr(run_catalog, 'CATALOG_PATH', str(tmp_path / "runs.db"))
+    video_path = os.environ.get('TRACKING_TEST_VIDEO')
+    if not video_path:
+        video_path = synthetic_data.generate_video(str(tmp_path / "synthetic.mp4"), TRACKING_FRAMES,
+                                                    n_ants=TRACKING_ANTS)
+    return video_path
+
+
+def run_outputs(run_dir):
+    """Label file contents (by file name) and track store rows of a tracking run."""
+    import track_store
+    labels_dir = os.path.join(run_dir, "labels")
+    labels = {}
+    for name in sorted(os.listdir(labels_dir)):
+        with open(os.path.join(labels_dir, name)) as f:
+            labels[name] = f.read()
+    return labels, track_store.TrackStore(os.path.join(run_dir, track_store.STORE_NAME)).rows
+
+
+def assert_same_run(run_a, run_b, rtol=0):
+    """
+    The two runs wrote the same labels and the same track store rows (NaN equal
+    to NaN). With rtol, boxes and confidences only need to agree within rtol;
+    frames, classes and track IDs are always compared exactly.
+    """
+    import track_store
+    labels_a, rows_a = run_outputs(run_a)
+    labels_b, rows_b = run_outputs(run_b)
+    assert labels_a and sorted(labels_a) == sorted(labels_b)
+    if not rtol:
+        assert labels_a == labels_b
+    for name in labels_a:
+        lines_a = track_store.parse_label_lines(labels_a[name].splitlines())
+        lines_b = track_store.parse_label_lines(labels_b[name].splitlines())
+        assert lines_a.shape == lines_b.shape, name
+        np.testing.assert_array_equal(lines_a[:, [0, 6]], lines_b[:, [0, 6]], err_msg=name)
+        np.testing.assert_allclose(lines_a[:, 1:6], lines_b[:, 1:6], rtol=rtol, err_msg=name)
+    assert rows_a.dtype == rows_b.dtype and len(rows_a) == len(rows_b)
+    for field in rows_a.dtype.names:
+        if rows_a.dtype[field].kind == 'f':
+            np.testing.assert_allclose(rows_a[field], rows_b[field], rtol=rtol, err_msg=field)
+        else:
+            np.testing.assert_array_equal(rows_a[field], rows_b[field], err_msg=field)
@@ -0,0 +1,70 @@
+"""
+Regression check: a run that is stopped, resumed, crashes after a checkpoint
+and is resumed again ends with the labels, track store rows and interactions
+of a run that was never interrupted.
+"""
+import threading
+
+import pytest
+
+import ant_interactions
+import run_checkpoint
+import run_tracking
+from conftest import assert_same_run
+
+CHECKPOINT_INTERVAL = 20
+STOP_AFTER = 35
+CRASH_AT = 65
+
+
+class StopAfter:
+    """Stop event that is set once it has been checked `checks` times (once per frame)."""
+
+    def __init__(self, checks):
+        self.checks = checks
+
+    def is_set(self):
+        self.checks -= 1
+        return self.checks < 0
+
+    def set(self):
+        self.checks = 0
+
+
+def counter():
+    # Whole frame, short segments: the small synthetic video still has interactions to compare.
+    return ant_interactions.InteractionCounter(merge_tolerance=5, min_segment_length=2, x_min=0, x_max=1)
+
+
+@pytest.mark.parametrize("stride, batch", [(1, 1), (2, 3)])
+def test_resumed_run_matches_uninterrupted(tracking_setup, tmp_path, monkeypatch, stride, batch):
+    def track(name, stop_event, interactions, **kwargs):
+        return run_tracking.track_video(tracking_setup, 0, stop_event, preview_fps=0, project=str(tmp_path),
+                                        name=name, interactions=interactions, stride=stride, batch=batch,
+                                        checkpoint_interval=CHECKPOINT_INTERVAL, **kwargs)
+
+    reference = counter()
+    reference_dir = track("reference", threading.Event(), reference)
+
+    # Paused after STOP_AFTER frames: checkpointed at the stop.
+    run_dir = track("resumed", StopAfter(STOP_AFTER), counter())
+    assert run_checkpoint.find(run_dir) == STOP_AFTER
+
+    # Crashes at frame CRASH_AT: the last checkpoint is the one before it.
+    update_rows = ant_interactions.InteractionCounter.update_rows
+
+    def crash(self, frame_index, rows):
+        if frame_index == CRASH_AT:
+            raise RuntimeError("crash")
+        return update_rows(self, frame_index, rows)
+
+    with monkeypatch.context() as patch:
+        patch.setattr(ant_interactions.InteractionCounter, 'update_rows', crash)
+        with pytest.raises(RuntimeError):
+            track("resumed", threading.Event(), counter(), resume=True)
+    assert STOP_AFTER < run_checkpoint.find(run_dir) <= CRASH_AT
+
+    resumed = counter()
+    assert track("resumed", threading.Event(), resumed, resume=True) == run_dir
+    assert_same_run(reference_dir, run_dir)
+    assert resumed.interactions == reference.interactions
@@ -0,0 +1,146 @@
+"""
+Regression checks of ant_interactions on synthetic runs (no weights needed).
+"""
+import os
+
+import numpy as np #type:ignore
+import pytest
+
+import ant_interactions
+import synthetic_data
+import track_store
+
+
+@pytest.fixture(scope="module")
+def crowded_run(tmp_path_factory):
+    # Many ants, IDs lost and reassigned, detections missed: pairs overlap, split and come back.
+    run_dir = tmp_path_factory.mktemp("interactions") / "run"
+    return synthetic_data.generate_run(str(run_dir), n_frames=400, n_ants=40, id_churn=0.01, miss_rate=0.1,
+                                       video=False, seed=3)
+
+
+@pytest.mark.parametrize("merge_tolerance, min_segment_length", [(20, 10), (5, 3), (1, 2), (0, 1)])
+def test_batched_count_matches_per_frame_loop(crowded_run, merge_tolerance, min_segment_length):
+    expected = ant_interactions.track_ant_interactions(crowded_run['labels_dir'], merge_tolerance, min_segment_length)
+    assert expected > 0
+    assert ant_interactions.track_ant_interactions_batched(crowded_run['labels_dir'], merge_tolerance,
+                                                           min_segment_length) == expected
+
+
+def edge_case_frames(x_min, x_max):
+    """
+    Frames of (x, y, w, h) boxes where the broad phase is easiest to get wrong:
+    boxes touching on one edge or a corner, identical boxes, boxes on the
+    middle-region boundary, a column spread along y (sweep on y), and crowded
+    frames on a coarse grid, full of exactly touching edges.
+    """
+    frames = [
+        [(0.5, 0.5, 0.25, 0.25), (0.75, 0.5, 0.25, 0.25)],                            # touching in x
+        [(0.5, 0.5, 0.25, 0.25), (0.5, 0.75, 0.25, 0.25)],                            # touching in y
+        [(0.5, 0.5, 0.25, 0.25), (0.75, 0.75, 0.25, 0.25)],                           # touching corners
+        [(0.5, 0.5, 0.25, 0.25), (0.5, 0.5, 0.25, 0.25), (0.5, 0.5, 0.25, 0.25)],     # identical
+        [(0.5, 0.5, 0.125, 0.125), (0.5 + 0.125 + 2 ** -40, 0.5, 0.125, 0.125)],      # just apart
+        [(0.5, 0.1 * k, 0.05, 0.25) for k in range(10)],                              # column: sweep on y
+    ]
+    # Left and right edges on, just inside and just outside the region boundary, overlapping a box inside.
+    w = 0.0625
+    for edge, side in ((x_min, 1), (x_max, -1)):
+        for lo in (np.nextafter(edge, -np.inf), edge, np.nextafter(edge, np.inf)):
+            x = lo + side * w / 2
+            frames.append([(x, 0.5, w, w), (x + side * w / 2, 0.5, w, w)])
+    rng = np.random.default_rng(0)
+    for _ in range(60):
+        n = int(rng.integers(2, 40))
+        frames.append([tuple(v) for v in np.column_stack([rng.integers(1, 32, (n, 2)) / 32,
+                                                          rng.integers(1, 5, (n, 2)) / 32])])
+    return frames
+
+
+def write_store(path, frames):
+    with track_store.TrackStoreWriter(str(path)) as writer:
+        for frame, boxes in enumerate(frames):
+            boxes = np.asarray(boxes, dtype=float).reshape(-1, 4)
+            n = len(boxes)
+            writer.add_frame(frame, np.column_stack([np.zeros(n), boxes, np.full(n, np.nan), np.arange(1, n + 1)]))
+        writer.close(len(frames))
+    return track_store.TrackStore(str(path))
+
+
+def per_frame_pairs(tracks, x_min, x_max):
+    """Overlapping pairs as the original loop finds them: filter_middle_region, then check_overlap on every pair."""
+    pairs = []
+    for frame in range(len(tracks)):
+        data = ant_interactions.filter_middle_region(ant_interactions.frame_data(tracks, frame), x_min, x_max)
+        for i in range(len(data)):
+            for j in range(i + 1, len(data)):
+                if ant_interactions.check_overlap(data[i, :4], data[j, :4]):
+                    a, b = sorted((int(data[i, 4]), int(data[j, 4])))
+                    pairs.append((frame, a, b))
+    return sorted(pairs)
+
+
+@pytest.mark.parametrize("x_min, x_max", [ant_interactions.MIDDLE_REGION, (0.0, 1.0)])
+@pytest.mark.parametrize("block_elements", [ant_interactions.PAIR_BLOCK_ELEMENTS, 7])
+def test_sweep_matches_all_pairs(tmp_path, x_min, x_max, block_elements):
+    tracks = write_store(tmp_path / "tracks.bin", edge_case_frames(x_min, x_max))
+    expected = per_frame_pairs(tracks, x_min, x_max)
+    assert len(expected) > 100
+
+    for find in (ant_interactions.overlapping_pairs, ant_interactions.overlapping_pairs_dense):
+        frames, ant_a, ant_b = find(tracks, x_min, x_max, block_elements)
+        assert sorted(zip(frames.tolist(), ant_a.tolist(), ant_b.tolist())) == expected, find.__name__
+
+    single = []
+    for frame in range(len(tracks)):
+        ant_a, ant_b = ant_interactions.frame_overlaps(ant_interactions.frame_data(tracks, frame), x_min, x_max)
+        single += [(frame, a, b) for a, b in zip(ant_a.tolist(), ant_b.tolist())]
+    assert sorted(single) == expected
+
+
+def write_run(run_dir, frames_rows):
+    """Labels and track store of a run given the (n, 7) rows of every frame, as generate_run writes them."""
+    labels_dir = os.path.join(run_dir, "labels")
+    os.makedirs(labels_dir)
+    with track_store.TrackStoreWriter(os.path.join(run_dir, track_store.STORE_NAME)) as writer:
+        for frame, rows in enumerate(frames_rows):
+            synthetic_data.write_labels(labels_dir, frame, rows)
+            writer.add_frame(frame, rows)
+        writer.close(len(frames_rows))
+    return labels_dir
+
+
+def count_online(labels_dir, merge_tolerance, min_segment_length):
+    """Feeds a run to an InteractionCounter frame by frame, as the tracking loop does."""
+    tracks = track_store.open_tracks(labels_dir)
+    counter = ant_interactions.InteractionCounter(merge_tolerance, min_segment_length)
+    live = []
+    for frame in range(len(tracks)):
+        rows = tracks.frame(frame)
+        counter.update_rows(frame, np.column_stack([rows[c] for c in ('cls', 'x', 'y', 'w', 'h', 'conf', 'track_id')]))
+        live.append(counter.live_count())
+    return counter.finish(), live
+
+
+@pytest.mark.parametrize("merge_tolerance, min_segment_length", [(20, 10), (5, 3), (1, 2), (0, 1)])
+def test_online_count_matches_batched(crowded_run, merge_tolerance, min_segment_length):
+    final, live = count_online(crowded_run['labels_dir'], merge_tolerance, min_segment_length)
+    assert final == ant_interactions.track_ant_interactions_batched(crowded_run['labels_dir'], merge_tolerance,
+                                                                    min_segment_length)
+    # The live count never goes down and never overshoots the final count.
+    assert live == sorted(live) and live[-1] <= final
+
+
+@pytest.mark.parametrize("gap, expected", [(5, 1), (20, 1), (21, 2)])
+def test_pair_lost_and_found_within_merge_gap(tmp_path, gap, expected):
+    # Ants 1 and 2 overlap for 10 frames, ant 2 is not detected for `gap` - 1 frames
+    # (a gap of `gap` frames between overlaps), then they overlap for 10 more frames.
+    both = np.array([[0, 0.5, 0.5, 0.06, 0.04, np.nan, 1], [0, 0.52, 0.5, 0.06, 0.04, np.nan, 2]])
+    frames_rows = [both] * 10 + [both[:1]] * (gap - 1) + [both] * 10 + [both[:1]] * 30
+    labels_dir = write_run(str(tmp_path / "run"), frames_rows)
+
+    assert ant_interactions.track_ant_interactions_batched(labels_dir, 20, 10) == expected
+    assert ant_interactions.track_ant_interactions(labels_dir, 20, 10) == expected
+    final, live = count_online(labels_dir, 20, 10)
+    assert final == expected
+    # Counted live as soon as the first overlap lasted long enough.
+    assert live[9] == 1
@@ -0,0 +1,43 @@
+"""
+Checks of run_tracking.interpolate_rows, which fills the frames a strided run
+skips (no weights needed).
+"""
+import numpy as np #type:ignore
+
+import run_tracking
+
+
+def test_interpolates_tracks_seen_at_both_ends():
+    rows_a = [[0, 0.1, 0.2, 0.05, 0.04, 0.9, 3],
+              [0, 0.5, 0.5, 0.05, 0.04, 0.8, 7]]
+    rows_b = [[0, 0.9, 0.2, 0.05, 0.04, 0.7, 3],
+              [1, 0.3, 0.6, 0.10, 0.08, 0.6, 9]]
+    frames = run_tracking.interpolate_rows(rows_a, rows_b, 10, 14)
+    assert [frame for frame, _ in frames] == [11, 12, 13]
+    for k, (_, rows) in enumerate(frames, start=1):
+        # Only track 3 is in both frames; 7 ends and 9 starts between them.
+        assert rows.shape == (1, 7)
+        np.testing.assert_allclose(rows[0, [0, 6]], [0, 3])
+        np.testing.assert_allclose(rows[0, 1:5], [0.1 + 0.2 * k, 0.2, 0.05, 0.04])
+        assert np.isnan(rows[0, 5])
+
+
+def test_untracked_rows_are_never_linked():
+    untracked = [[0, 0.2, 0.2, 0.05, 0.04, 0.9, -1],
+                 [0, 0.6, 0.6, 0.05, 0.04, 0.9, -1]]
+    assert all(len(rows) == 0 for _, rows in run_tracking.interpolate_rows(untracked, untracked, 0, 3))
+
+    rows_a = untracked + [[0, 0.4, 0.4, 0.05, 0.04, 0.9, 0]]
+    rows_b = [[0, 0.8, 0.8, 0.05, 0.04, 0.9, -1], [0, 0.4, 0.6, 0.05, 0.04, 0.9, 0]]
+    frames = run_tracking.interpolate_rows(rows_a, rows_b, 0, 2)
+    assert len(frames) == 1
+    _, rows = frames[0]
+    np.testing.assert_allclose(rows[:, [1, 2, 6]], [[0.4, 0.5, 0]])
+
+
+def test_adjacent_frames_have_nothing_to_fill():
+    rows = [[0, 0.5, 0.5, 0.05, 0.04, 0.9, 1]]
+    assert run_tracking.interpolate_rows(rows, rows, 4, 5) == []
+    frames = run_tracking.interpolate_rows(np.empty((0, 7)), rows, 0, 3)
+    assert [frame for frame, _ in frames] == [1, 2]
+    assert all(filled.shape == (0, 7) for _, filled in frames)
@@ -0,0 +1,80 @@
+"""
+Regression checks of tracklet_stitching on synthetic runs (no weights needed).
+"""
+import numpy as np #type:ignore
+
+import synthetic_data
+import track_store
+import tracklet_stitching
+
+
+def row_ants(store):
+    """
+    Ant of every row of a synthetic run without missed detections: simulate()
+    writes the ants of a frame in the same order every frame.
+    """
+    return np.concatenate([np.arange(store.offsets[i + 1] - store.offsets[i]) for i in range(len(store))])
+
+
+def write_tracklets(run_dir, tracklets):
+    """
+    A run from (track_id, first_frame, x, y, vx, vy) tracklets of 20 frames,
+    moving at (vx, vy) per frame.
+    """
+    n_frames = max(first for _, first, *_ in tracklets) + 20
+    frames = [[] for _ in range(n_frames)]
+    for track_id, first, x, y, vx, vy in tracklets:
+        for k in range(20):
+            frames[first + k].append([0, x + vx * k, y + vy * k, 0.06, 0.04, np.nan, track_id])
+    labels_dir = run_dir / "labels"
+    labels_dir.mkdir(parents=True)
+    with track_store.TrackStoreWriter(str(run_dir / track_store.STORE_NAME)) as writer:
+        for frame, rows in enumerate(frames):
+            rows = np.array(rows, dtype=float).reshape(-1, 7)
+            synthetic_data.write_labels(str(labels_dir), frame, rows)
+            writer.add_frame(frame, rows)
+        writer.close(n_frames)
+    return str(labels_dir)
+
+
+def test_chain_roots():
+    # 0 -> 2 -> 3, 1 alone, 4 -> 5
+    successor = np.array([2, -1, 3, -1, 5, -1])
+    assert tracklet_stitching.chain_roots(successor).tolist() == [0, 1, 0, 0, 4, 4]
+
+
+def test_links_the_ids_of_one_ant(tmp_path):
+    # 6 ants, each losing its ID about twice over the run.
+    run = synthetic_data.generate_run(str(tmp_path / "run"), n_frames=1000, n_ants=6, id_churn=0.002, miss_rate=0,
+                                      video=False, seed=1)
+    tracker = track_store.TrackStore(run['store_path'], remap=False)
+    tracker_ids = np.array(tracker.rows['track_id'])
+    ants = row_ants(tracker)
+    assert len(np.unique(tracker_ids)) > 12
+
+    report = tracklet_stitching.stitch_run(run['labels_dir'])
+    assert report['links'] == len(np.unique(tracker_ids)) - 6
+
+    # Every ant ends up under one ID, the first one the tracker gave it, and no two ants share one.
+    stitched_ids = np.array(track_store.TrackStore(run['store_path']).rows['track_id'])
+    for ant in range(6):
+        assert np.unique(stitched_ids[ants == ant]).tolist() == [tracker_ids[ants == ant].min()]
+
+    # Clearing the table restores the tracker's IDs.
+    tracklet_stitching.clear_run(run['labels_dir'])
+    np.testing.assert_array_equal(track_store.TrackStore(run['store_path']).rows['track_id'], tracker_ids)
+
+
+def test_links_across_gaps_only_where_the_ant_can_be(tmp_path):
+    labels_dir = write_tracklets(tmp_path / "run", [
+        (1, 0, 0.2, 0.5, 0.004, 0),      # ant moving right ...
+        (2, 29, 0.2 + 0.004 * 29, 0.5, 0.004, 0),   # ... continued after 10 frames, where it was heading
+        (3, 25, 0.8, 0.2, 0, 0),         # starts in the gap, far away: not the same ant
+        (4, 0, 0.5, 0.8, 0, 0.001),      # ant lost ...
+        (5, 19 + 40, 0.5, 0.8 + 0.04, 0, 0.001),    # ... for longer than MAX_GAP: not linked
+    ])
+    table = tracklet_stitching.tracklets(track_store.open_tracks(labels_dir).rows)
+    ends, starts, cost = tracklet_stitching.candidate_links(table)
+    assert list(zip(table['ids'][ends].tolist(), table['ids'][starts].tolist())) == [(1, 2)]
+    successor = tracklet_stitching.solve_links(len(table['ids']), ends, starts, cost)
+    assert table['ids'][tracklet_stitching.chain_roots(successor)].tolist() == [1, 1, 3, 4, 5]
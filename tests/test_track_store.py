@@ -0,0 +1,53 @@
+"""
+Checks of track_store rebuilding a run's store from its labels (no weights needed).
+"""
+import os
+
+import numpy as np #type:ignore
+
+import synthetic_data
+import track_store
+import trajectory
+
+
+def write_run(run_dir, n_frames, last_detection):
+    """A run of n_frames whose label files stop at frame last_detection."""
+    labels_dir = run_dir / "labels"
+    labels_dir.mkdir(parents=True)
+    with track_store.TrackStoreWriter(str(run_dir / track_store.STORE_NAME)) as writer:
+        for frame in range(n_frames):
+            rows = np.empty((0, 7))
+            if frame <= last_detection:
+                rows = np.array([[0, 0.5, 0.5, 0.05, 0.04, 0.9, 1]])
+                synthetic_data.write_labels(str(labels_dir), frame, rows)
+            writer.add_frame(frame, rows)
+        writer.close(n_frames)
+    return str(labels_dir)
+
+
+def make_stale(labels_dir):
+    """Makes the labels newer than the store, so open_tracks rebuilds it."""
+    store_path = track_store.store_path_for(labels_dir)
+    mtime = os.path.getmtime(store_path)
+    os.utime(labels_dir, (mtime + 10, mtime + 10))
+
+
+def test_rebuilt_store_keeps_trailing_empty_frames(tmp_path):
+    labels_dir = write_run(tmp_path / "run", 30, 19)
+    make_stale(labels_dir)
+    tracks = track_store.open_tracks(labels_dir)
+    assert len(tracks) == 30
+    assert len(tracks.rows) == 20
+    # Without a video the trajectory frames still cover the whole run.
+    assert sum(1 for _ in trajectory.label_frames(labels_dir, (64, 48))) == 30
+
+
+def test_rebuilt_store_covers_the_given_frame_count(tmp_path):
+    labels_dir = write_run(tmp_path / "run", 30, 19)
+    os.remove(track_store.store_path_for(labels_dir))
+    assert len(track_store.open_tracks(labels_dir)) == 20
+    make_stale(labels_dir)
+    assert len(track_store.open_tracks(labels_dir, 40)) == 40
+    make_stale(labels_dir)
+    # A smaller count never cuts the run short.
+    assert len(track_store.open_tracks(labels_dir, 10)) == 40
@@ -0,0 +1,73 @@
+"""
+Regression checks of track_summary on synthetic runs (no weights needed).
+"""
+import json
+
+import cv2 #type:ignore
+import numpy as np #type:ignore
+
+import synthetic_data
+import track_store
+import track_summary
+import tracklet_stitching
+
+
+def test_summary_of_synthetic_run(tmp_path):
+    run = synthetic_data.generate_run(str(tmp_path / "run"), n_frames=300, n_ants=5, id_churn=0.005, seed=2)
+    summary = track_summary.build_summary(run['labels_dir'], run['video_path'])
+
+    # The table matches the store, track by track.
+    with open(track_summary.summary_path_for(run['labels_dir'])) as f:
+        assert json.load(f)['tracks'] == summary['tracks']
+    rows = track_store.TrackStore(run['store_path']).rows
+    ids = np.unique(rows['track_id'])
+    assert [track['track_id'] for track in summary['tracks']] == ids.tolist()
+    assert summary['n_frames'] == 300
+    for track in summary['tracks']:
+        own = rows[rows['track_id'] == track['track_id']]
+        assert track['first_frame'] == own['frame'].min() and track['last_frame'] == own['frame'].max()
+        assert track['detections'] == len(own)
+        assert np.isclose(track['mean_w'], own['w'].mean()) and np.isclose(track['mean_h'], own['h'].mean())
+        # Labels without confidences.
+        assert track['mean_conf'] is None
+
+    # One tile per track on the sheet, in track ID order.
+    assert [track['thumbnail'] for track in summary['tracks']] == list(range(len(ids)))
+    sheet = cv2.imread(track_summary.thumbnails_path_for(run['labels_dir']))
+    columns = summary['thumb_columns']
+    assert sheet.shape[:2] == (-(-len(ids) // columns) * track_summary.THUMB_SIZE,
+                               columns * track_summary.THUMB_SIZE)
+
+    # Reused until tracklet stitching rewrites the IDs, then rebuilt with the stitched tracks.
+    assert track_summary.load_summary(run['labels_dir'])['seconds'] == summary['seconds']
+    tracklet_stitching.stitch_run(run['labels_dir'])
+    stitched = track_summary.load_summary(run['labels_dir'], run['video_path'])
+    assert len(stitched['tracks']) < len(summary['tracks'])
+    assert sum(track['detections'] for track in stitched['tracks']) == len(rows)
+
+
+def test_summary_statistics_and_selection():
+    rows = np.zeros(6, dtype=track_store.ROW_DTYPE)
+    rows['frame'] = [0, 0, 1, 1, 2, 3]
+    rows['track_id'] = [1, 2, 1, -1, 1, 2]
+    rows['w'] = [0.1, 0.2, 0.3, 0.9, 0.2, 0.4]
+    rows['h'] = 0.1
+    rows['conf'] = [0.5, np.nan, 0.9, 0.99, 0.9, np.nan]
+    table = track_summary.summarize_tracks(rows)
+    assert table['track_id'].tolist() == [1, 2]
+    assert table['detections'].tolist() == [3, 2]
+    assert table['first_frame'].tolist() == [0, 0] and table['last_frame'].tolist() == [2, 3]
+    assert np.allclose(table['mean_w'], [0.2, 0.3])
+    assert np.isclose(table['mean_conf'][0], 2.3 / 3) and np.isnan(table['mean_conf'][1])
+    # Most confident detection, ties to the larger box; the untracked row never counts.
+    assert table['best_row'].tolist() == [2, 5]
+
+    summary = {'tracks': [
+        {'track_id': 1, 'first_frame': 0, 'last_frame': 2, 'detections': 3, 'mean_conf': 0.7},
+        {'track_id': 2, 'first_frame': 0, 'last_frame': 3, 'detections': 2, 'mean_conf': None},
+        {'track_id': 3, 'first_frame': 5, 'last_frame': 5, 'detections': 1, 'mean_conf': 0.9},
+    ]}
+    select = track_summary.select_tracks
+    assert [t['track_id'] for t in select(summary, 'mean_conf', descending=True)] == [3, 1, 2]
+    assert [t['track_id'] for t in select(summary, 'detections', min_detections=2)] == [2, 1]
+    assert [t['track_id'] for t in select(summary, min_span=4)] == [2]
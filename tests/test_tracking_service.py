@@ -0,0 +1,47 @@
+"""
+Checks of tracking_service's job retention (no workers or weights needed).
+"""
+import os
+
+import run_catalog
+import run_checkpoint
+import tracking_service
+
+DAY = 86400
+
+
+def test_remove_expired_jobs(tmp_path):
+    catalog = run_catalog.RunCatalog(str(tmp_path / "runs.db"))
+    service = tracking_service.TrackingService(jobs_folder=str(tmp_path / "jobs"), catalog=catalog)
+    now = 100 * DAY
+
+    def finished_job(status, age_days):
+        job = service.create_job()
+        os.makedirs(os.path.join(job.track_dir, 'labels'))
+        job.run_dir = job.track_dir
+        job.status = status
+        job.finished_at = now - age_days * DAY
+        catalog.record_run(job.run_dir, name=job.id, labels_dir=job.labels_dir, status="done")
+        catalog.record_job(job.id, job.run_dir, job.video_path)
+        return job
+
+    old = finished_job(tracking_service.DONE, 10)
+    recent = finished_job(tracking_service.DONE, 1)
+    paused = finished_job(tracking_service.PAUSED, 10)
+    # Directories of jobs from before a restart are aged by their last change.
+    unknown = os.path.join(service.jobs_folder, "unknown")
+    interrupted = os.path.join(service.jobs_folder, "interrupted")
+    for job_dir in (unknown, interrupted):
+        os.makedirs(os.path.join(job_dir, 'output', 'track'))
+    with open(run_checkpoint.checkpoint_path(os.path.join(interrupted, 'output', 'track')), "wb"):
+        pass
+    for root, dirs, _ in os.walk(service.jobs_folder):
+        for name in dirs:
+            os.utime(os.path.join(root, name), (now - 10 * DAY, now - 10 * DAY))
+
+    assert service.remove_expired_jobs(0, now=now) == []
+    assert sorted(service.remove_expired_jobs(7, now=now)) == sorted([old.id, "unknown"])
+    assert sorted(os.listdir(service.jobs_folder)) == sorted([recent.id, paused.id, "interrupted"])
+    assert service.get(old.id) is None and service.get(recent.id) is recent
+    assert catalog.job(old.id) is None and catalog.run(old.run_dir) is None
+    assert catalog.job(recent.id)['labels_dir'] == recent.labels_dir
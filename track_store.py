@@ -0,0 +1,465 @@
+"""
+Columnar, memory-mapped store for tracking results.
+
+A tracking run normally leaves one small YOLO label .txt per frame in
+runs/detect/track*/labels. This module packs a whole run into a single file
+(tracks.bin, next to the labels directory) so the analysis scripts can
+memory-map it instead of opening and parsing thousands of files.
+
+File layout (little endian):
+  header   magic (8 bytes), number of rows (uint64), number of frames (uint64)
+  rows     one contiguous array of ROW_DTYPE records, sorted by frame
+  offsets  int64 array of length n_frames + 1; the rows of frame f are
+           rows[offsets[f]:offsets[f + 1]] (empty frames have equal offsets)
+
+Frames are 0-based video frame indices. Ultralytics names label files
+<stem>_<frame>.txt with a 1-based frame number, so label <stem>_1.txt is
+frame 0 in the store.
+
+An optional ID remap table (id_remap.txt, next to the store; written by
+tracklet_stitching.py) merges track IDs the tracker split: one "old new" pair
+per line. TrackStore applies it when the store is opened, so every analysis
+sees the stitched IDs.
+"""
+import os
+import re
+import struct
+import numpy as np #type:ignore
+
+STORE_NAME = "tracks.bin"
+REMAP_NAME = "id_remap.txt"
+
+MAGIC = b"ANTTRK01"
+HEADER = struct.Struct("<8sQQ")
+
+# conf is NaN when the labels were written without confidences,
+# track_id is -1 for detections the tracker did not assign an ID to.
+ROW_DTYPE = np.dtype([
+    ("frame", "<i4"),
+    ("cls", "<i4"),
+    ("x", "<f8"),
+    ("y", "<f8"),
+    ("w", "<f8"),
+    ("h", "<f8"),
+    ("conf", "<f8"),
+    ("track_id", "<i4"),
+])
+
+LABEL_NAME_PATTERN = re.compile(r"_(\d+)\.txt$")
+
+
+def label_frame_number(name):
+    """
+    Return the 1-based frame number encoded in a '<stem>_<frame>.txt' label
+    file name, or None if the name does not follow that pattern.
+    """
+    match = LABEL_NAME_PATTERN.search(os.path.basename(str(name)))
+    return int(match.group(1)) if match else None
+
+
+def store_path_for(labels_dir):
+    """Path of the track store belonging to a run's labels directory."""
+    return os.path.join(os.path.dirname(os.path.normpath(labels_dir)), STORE_NAME)
+
+
+def remap_path_for(store_path):
+    """Path of the ID remap table belonging to a track store."""
+    return os.path.join(os.path.dirname(os.path.abspath(store_path)), REMAP_NAME)
+
+
+def read_remap(path):
+    """
+    Reads an ID remap table.
+
+    Returns:
+      - old_ids, new_ids (np.ndarray): int64 arrays, sorted by old ID (empty if there is no table).
+    """
+    if not os.path.exists(path):
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+    table = np.loadtxt(path, dtype=np.int64, comments="#", ndmin=2).reshape(-1, 2)
+    order = np.argsort(table[:, 0], kind="stable")
+    return table[order, 0], table[order, 1]
+
+
+def write_remap(path, old_ids, new_ids):
+    """Writes an ID remap table (atomically); an empty table removes the file."""
+    if len(old_ids) == 0:
+        if os.path.exists(path):
+            os.remove(path)
+        return path
+    tmp_path = path + ".tmp"
+    np.savetxt(tmp_path, np.column_stack([old_ids, new_ids]).astype(np.int64), fmt="%d",
+               header="old_id new_id")
+    os.replace(tmp_path, path)
+    return path
+
+
+def apply_remap(ids, old_ids, new_ids):
+    """Maps every ID in `ids` found in old_ids to its new ID; other IDs are unchanged."""
+    ids = np.asarray(ids)
+    if len(old_ids) == 0 or len(ids) == 0:
+        return ids
+    i = np.clip(np.searchsorted(old_ids, ids), 0, len(old_ids) - 1)
+    found = old_ids[i] == ids
+    return np.where(found, new_ids[i], ids).astype(ids.dtype)
+
+
+def parse_label_lines(lines):
+    """
+    Parse YOLO label lines into an (n, 7) float array with columns
+    cls, x, y, w, h, conf, track_id.
+
+    Accepted line formats:
+      cls x y w h                 (no track ID)
+      cls x y w h track_id        (ultralytics tracking output)
+      cls x y w h conf track_id   (tracking output with save_conf=True)
+    Malformed lines are skipped.
+    """
+    rows = []
+    for line in lines:
+        parts = line.split()
+        if len(parts) < 5 or len(parts) > 7:
+            continue
+        try:
+            values = [float(p) for p in parts]
+        except ValueError:
+            continue
+        conf = values[5] if len(parts) == 7 else np.nan
+        track_id = values[-1] if len(parts) >= 6 else -1
+        rows.append(values[:5] + [conf, track_id])
+    if not rows:
+        return np.empty((0, 7), dtype=float)
+    return np.array(rows, dtype=float)
+
+
+def label_precision(values):
+    """
+    Round values through '%g' exactly like Results.save_txt writes them, so a
+    store written by the tracker matches one converted from its labels.
+    """
+    values = np.asarray(values, dtype=float)
+    return np.array([float("%g" % v) for v in values.ravel().tolist()]).reshape(values.shape)
+
+
+def format_label_lines(rows):
+    """
+    Inverse of parse_label_lines for tracking output: one 'cls x y w h [track_id]'
+    line per row, formatted like Results.save_txt (conf is not written).
+    """
+    lines = []
+    for row in np.asarray(rows, dtype=float).reshape(-1, 7):
+        line = (row[0], *row[1:5]) + ((row[6],) if row[6] >= 0 else ())
+        lines.append(("%g " * len(line)).rstrip() % line)
+    return lines
+
+
+def rows_from_boxes(boxes):
+    """
+    Convert an ultralytics Boxes object into an (n, 7) array for the store.
+
+    Coordinates are rounded like the label files (see label_precision).
+    """
+    if boxes is None or len(boxes) == 0:
+        return np.empty((0, 7), dtype=float)
+    cls = boxes.cls.cpu().numpy()
+    xywhn = boxes.xywhn.cpu().numpy()
+    conf = boxes.conf.cpu().numpy()
+    ids = boxes.id.cpu().numpy() if boxes.id is not None else np.full(len(cls), -1)
+    rows = np.empty((len(cls), 7), dtype=float)
+    rows[:, 0] = cls
+    rows[:, 1:5] = label_precision(xywhn)
+    rows[:, 5] = conf
+    rows[:, 6] = ids
+    return rows
+
+
+class TrackStoreWriter:
+    """
+    Streams frames into a track store. Rows go straight to disk, only the
+    per-frame offsets are kept in memory. The file is written under a
+    temporary name and moved into place by close().
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._tmp_path = self.path + ".tmp"
+        self._file = open(self._tmp_path, "wb")
+        self._file.write(HEADER.pack(MAGIC, 0, 0))
+        self._offsets = [0]
+        self._n_rows = 0
+
+    @property
+    def n_frames(self):
+        return len(self._offsets) - 1
+
+    def add_frame(self, frame, rows):
+        """
+        Append the detections of 0-based frame `frame`. `rows` is an (n, 7)
+        array as returned by parse_label_lines/rows_from_boxes. Frames must be
+        added in increasing order; skipped frames are recorded as empty.
+        """
+        if frame < self.n_frames:
+            raise ValueError(f"Frame {frame} added out of order (next frame is {self.n_frames}).")
+        while self.n_frames < frame:
+            self._offsets.append(self._n_rows)
+        rows = np.asarray(rows, dtype=float).reshape(-1, 7)
+        records = np.empty(len(rows), dtype=ROW_DTYPE)
+        records["frame"] = frame
+        records["cls"] = rows[:, 0]
+        records["x"] = rows[:, 1]
+        records["y"] = rows[:, 2]
+        records["w"] = rows[:, 3]
+        records["h"] = rows[:, 4]
+        records["conf"] = rows[:, 5]
+        records["track_id"] = rows[:, 6]
+        self._file.write(records.tobytes())
+        self._n_rows += len(records)
+        self._offsets.append(self._n_rows)
+
+    def checkpoint(self):
+        """
+        Flushes the rows written so far to disk and returns the state resume()
+        needs to continue from here (see run_checkpoint).
+        """
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return {"n_rows": self._n_rows, "offsets": np.asarray(self._offsets, dtype=np.int64)}
+
+    @classmethod
+    def resume(cls, path, state):
+        """
+        Reopens the store of an interrupted run at a checkpoint() state. Rows
+        written after the checkpoint (by a run that crashed or was stopped
+        later) are dropped. The store may have been closed meanwhile (a
+        cancelled run leaves a readable partial store) or not (a crash).
+        """
+        writer = cls.__new__(cls)
+        writer.path = str(path)
+        writer._tmp_path = writer.path + ".tmp"
+        if not os.path.exists(writer._tmp_path):
+            os.replace(writer.path, writer._tmp_path)
+        writer._file = open(writer._tmp_path, "r+b")
+        writer._file.truncate(HEADER.size + state["n_rows"] * ROW_DTYPE.itemsize)
+        writer._file.seek(0, os.SEEK_END)
+        writer._offsets = [int(offset) for offset in state["offsets"]]
+        writer._n_rows = state["n_rows"]
+        return writer
+
+    def close(self, n_frames=None):
+        """
+        Finish the store. If `n_frames` is given (e.g. the video's frame count),
+        trailing frames without detections are recorded as empty.
+        """
+        if self._file.closed:
+            return
+        while n_frames is not None and self.n_frames < n_frames:
+            self._offsets.append(self._n_rows)
+        self._file.write(np.asarray(self._offsets, dtype="<i8").tobytes())
+        self._file.seek(0)
+        self._file.write(HEADER.pack(MAGIC, self._n_rows, self.n_frames))
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+            os.remove(self._tmp_path)
+
+
+class TrackStore:
+    """
+    Read-only, memory-mapped view of a track store.
+
+    Attributes:
+      rows (np.ndarray): ROW_DTYPE records of the whole run, sorted by frame.
+      offsets (np.ndarray): Per-frame offsets into `rows` (length n_frames + 1).
+      n_frames (int): Number of frames covered by the store.
+      remap (tuple): (old_ids, new_ids) of the ID remap table applied to rows
+        (empty arrays if there is none, or if the store was opened with remap=False).
+    """
+
+    def __init__(self, path, remap=True):
+        self.path = str(path)
+        with open(self.path, "rb") as f:
+            magic, n_rows, n_frames = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not a track store.")
+        self.n_frames = n_frames
+        offsets_start = HEADER.size + n_rows * ROW_DTYPE.itemsize
+        # np.memmap refuses zero-length maps, so empty runs get plain arrays.
+        if n_rows:
+            self.rows = np.memmap(self.path, dtype=ROW_DTYPE, mode="r", offset=HEADER.size, shape=(n_rows,))
+        else:
+            self.rows = np.empty(0, dtype=ROW_DTYPE)
+        self.offsets = np.memmap(self.path, dtype="<i8", mode="r", offset=offsets_start, shape=(n_frames + 1,))
+        empty = np.empty(0, dtype=np.int64)
+        self.remap = read_remap(remap_path_for(self.path)) if remap else (empty, empty)
+        if len(self.remap[0]) and n_rows:
+            # Stitched IDs differ from the file, so the rows are copied out of the map.
+            self.rows = np.array(self.rows)
+            self.rows["track_id"] = self.remap_ids(self.rows["track_id"])
+
+    def __len__(self):
+        return self.n_frames
+
+    def frame(self, index):
+        """Rows of 0-based frame `index` (empty for frames outside the store)."""
+        if index < 0 or index >= self.n_frames:
+            return self.rows[:0]
+        return self.rows[self.offsets[index]:self.offsets[index + 1]]
+
+    def track_ids(self):
+        """Sorted array of all track IDs in the run."""
+        ids = np.unique(self.rows["track_id"])
+        return ids[ids >= 0]
+
+    def remap_ids(self, ids):
+        """Stitched IDs of tracker IDs (e.g. IDs read off the tracking video)."""
+        return apply_remap(ids, *self.remap)
+
+
+class TrackIndex:
+    """
+    Maps every track ID of a store to its rows, built once per run.
+
+    Rows of one track are kept in frame order, so the frames a track appears
+    in are simply store.rows['frame'][index.rows_of(track_id)].
+    """
+
+    def __init__(self, store):
+        self.store = store
+        ids = np.asarray(store.rows["track_id"])
+        self.order = np.argsort(ids, kind="stable")
+        all_ids, starts = np.unique(ids[self.order], return_index=True)
+        self._ids = all_ids
+        self._bounds = np.append(starts, len(ids))
+        self.track_ids = all_ids[all_ids >= 0]
+
+    def rows_of(self, track_id):
+        """Indices into store.rows of every detection of `track_id`."""
+        i = np.searchsorted(self._ids, track_id)
+        if i == len(self._ids) or self._ids[i] != track_id:
+            return self.order[:0]
+        return self.order[self._bounds[i]:self._bounds[i + 1]]
+
+    def frames_of(self, track_id):
+        """Frames in which `track_id` was detected."""
+        return np.asarray(self.store.rows["frame"][self.rows_of(track_id)])
+
+    def keep_mask(self, excluded_ids=()):
+        """
+        Boolean mask over store.rows that is False for untracked detections
+        and for every track in `excluded_ids`.
+        """
+        mask = np.ones(len(self.store.rows), dtype=bool)
+        for track_id in [-1, *excluded_ids]:
+            mask[self.rows_of(track_id)] = False
+        return mask
+
+
+class LabelIndex:
+    """
+    Frame-number index of a labels directory, parsed once from the
+    '<stem>_<frame>.txt' file names (one directory listing, no per-file stat).
+
+    Frames are 0-based like in the store. Ultralytics writes no file for frames
+    without detections; those frames are explicitly empty here instead of
+    shifting every later file onto the wrong frame.
+    """
+
+    def __init__(self, labels_dir, n_frames=None):
+        self.labels_dir = str(labels_dir)
+        self._paths = {}
+        stems = set()
+        for name in os.listdir(self.labels_dir):
+            number = label_frame_number(name)
+            if number is None or number < 1:
+                continue
+            stems.add(LABEL_NAME_PATTERN.sub("", name))
+            self._paths[number - 1] = os.path.join(self.labels_dir, name)
+        if len(stems) > 1:
+            raise ValueError(f"{self.labels_dir} holds labels of several videos: {sorted(stems)}")
+        last = max(self._paths) + 1 if self._paths else 0
+        self.n_frames = max(last, n_frames or 0)
+
+    def __len__(self):
+        return self.n_frames
+
+    def frames(self):
+        """Sorted 0-based frames that have a label file."""
+        return sorted(self._paths)
+
+    def path(self, frame):
+        """Label file of `frame`, or None if the frame has no detections."""
+        return self._paths.get(frame)
+
+    def detections(self, frame):
+        """Parsed rows of `frame` (see parse_label_lines); empty for frames without a file."""
+        path = self._paths.get(frame)
+        if path is None:
+            return np.empty((0, 7), dtype=float)
+        with open(path, "r") as f:
+            return parse_label_lines(f)
+
+
+def convert_labels(labels_dir, store_path=None, n_frames=None):
+    """
+    Convert a directory of '<stem>_<frame>.txt' label files into a track store.
+
+    Parameters:
+      - labels_dir (str): Directory containing YOLO label (.txt) files.
+      - store_path (str): Output file, defaults to tracks.bin next to labels_dir.
+      - n_frames (int): Optional total frame count of the video.
+
+    Returns:
+      - store_path (str): Path of the written store.
+    """
+    store_path = store_path or store_path_for(labels_dir)
+    index = LabelIndex(labels_dir, n_frames)
+
+    with TrackStoreWriter(store_path) as writer:
+        for frame in index.frames():
+            writer.add_frame(frame, index.detections(frame))
+        writer.close(index.n_frames)
+    print(f"Converted {len(index.frames())} label files from {labels_dir} into {store_path}")
+    return store_path
+
+
+def stored_frame_count(store_path):
+    """Number of frames in the header of a track store, or 0 if there is no readable store."""
+    try:
+        with open(store_path, "rb") as f:
+            magic, _, n_frames = HEADER.unpack(f.read(HEADER.size))
+    except (OSError, struct.error):
+        return 0
+    return n_frames if magic == MAGIC else 0
+
+
+def open_tracks(labels_dir, n_frames=None):
+    """
+    Open the track store of a run, given its labels directory. The store is
+    (re)built from the label files if it is missing or older than the labels.
+
+    Label files end at the last frame with detections, so a rebuilt store keeps
+    the frame count of the store it replaces (trailing empty frames included),
+    or covers n_frames (e.g. the video's frame count) if that is larger.
+    """
+    store_path = store_path_for(labels_dir)
+    if not os.path.exists(store_path) or os.path.getmtime(store_path) < os.path.getmtime(labels_dir):
+        n_frames = max(n_frames or 0, stored_frame_count(store_path))
+        convert_labels(labels_dir, store_path, n_frames or None)
+    return TrackStore(store_path)
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) < 2:
+        print("Usage: python track_store.py <labels_dir> [store_path]")
+        sys.exit(1)
+    convert_labels(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
@@ -0,0 +1,255 @@
+"""
+Per-track summary of a tracking run for the true/false positive review page.
+
+One pass over the run's track store gives, for every track ID: first and last
+frame, number of detections, mean box size and mean confidence (NaN for runs
+converted from labels without confidences). One pass over the video cuts a
+thumbnail of every track, at its most confident detection, into a single
+sprite sheet. Both are written next to the track store:
+
+  track_summary.json    the table, with the store and remap table mtimes it was built from
+  track_thumbnails.jpg  THUMB_SIZE x THUMB_SIZE tiles, THUMB_COLUMNS per row
+
+The tracking service builds the summary when a job finishes; load_summary
+rebuilds it when the store changes or tracklet stitching rewrote the IDs, so
+the review page and process_video never scan the labels for the track IDs.
+
+Usage:
+  python track_summary.py runs/detect/track1/labels --video 30.mp4
+"""
+import argparse
+import json
+import math
+import os
+import time
+
+import cv2 #type:ignore
+import numpy as np #type:ignore
+import track_store
+
+SUMMARY_NAME = "track_summary.json"
+THUMBNAILS_NAME = "track_thumbnails.jpg"
+# Side of a thumbnail tile in pixels and tiles per row of the sprite sheet.
+THUMB_SIZE = 64
+THUMB_COLUMNS = 32
+# Context around the box in a thumbnail, as a fraction of the box's longer side.
+THUMB_PADDING = 0.25
+# Tracks with the most detections that get a thumbnail (JPEG sheets are at most 65535 pixels high).
+MAX_THUMBNAILS = 4096
+# Columns of the summary, in table order; the review page sorts by any of them.
+COLUMNS = ('track_id', 'first_frame', 'last_frame', 'detections', 'mean_w', 'mean_h', 'mean_conf')
+
+
+def summary_path_for(labels_dir):
+    return os.path.join(os.path.dirname(track_store.store_path_for(labels_dir)), SUMMARY_NAME)
+
+
+def thumbnails_path_for(labels_dir):
+    return os.path.join(os.path.dirname(track_store.store_path_for(labels_dir)), THUMBNAILS_NAME)
+
+
+def summarize_tracks(rows):
+    """
+    Per-track statistics of a store's rows (untracked detections are ignored).
+
+    Returns:
+      - table (dict of np.ndarray): The COLUMNS, one entry per track ID in ID order, plus
+        'best_row': index into rows of the track's most confident (then largest) detection.
+    """
+    tracked = np.flatnonzero(np.asarray(rows['track_id']) >= 0)
+    ids = np.asarray(rows['track_id'])[tracked]
+    frames = np.asarray(rows['frame'])[tracked]
+    w = np.asarray(rows['w'])[tracked]
+    h = np.asarray(rows['h'])[tracked]
+    conf = np.asarray(rows['conf'])[tracked]
+    if len(ids) == 0:
+        table = {column: np.empty(0) for column in COLUMNS}
+        table['best_row'] = np.empty(0, dtype=np.int64)
+        return table
+
+    # Rows are stored in frame order, so a stable sort by ID keeps every track in frame order.
+    order = np.argsort(ids, kind="stable")
+    track_ids, starts, counts = np.unique(ids[order], return_index=True, return_counts=True)
+    has_conf = ~np.isnan(conf[order])
+    conf_counts = np.add.reduceat(has_conf, starts)
+    conf_sums = np.add.reduceat(np.where(has_conf, conf[order], 0.0), starts)
+
+    # Best detection: highest confidence (missing counts as lowest), ties to the largest box.
+    best = np.lexsort((w * h, np.nan_to_num(conf, nan=-1.0), ids))
+    last_of_track = np.append(np.flatnonzero(np.diff(ids[best])), len(best) - 1)
+    return {
+        'track_id': track_ids,
+        'first_frame': frames[order][starts],
+        'last_frame': frames[order][starts + counts - 1],
+        'detections': counts,
+        'mean_w': np.add.reduceat(w[order], starts) / counts,
+        'mean_h': np.add.reduceat(h[order], starts) / counts,
+        'mean_conf': np.where(conf_counts > 0, conf_sums / np.maximum(conf_counts, 1), np.nan),
+        'best_row': tracked[best[last_of_track]],
+    }
+
+
+def thumbnail_box(row, width, height):
+    """Pixel bounds (x0, y0, x1, y1) of a square crop around a normalized store row, inside the frame."""
+    side = max(row['w'] * width, row['h'] * height) * (1 + 2 * THUMB_PADDING)
+    cx, cy = row['x'] * width, row['y'] * height
+    x0, y0 = max(0, int(cx - side / 2)), max(0, int(cy - side / 2))
+    x1, y1 = min(width, int(math.ceil(cx + side / 2))), min(height, int(math.ceil(cy + side / 2)))
+    return x0, y0, max(x1, x0 + 1), max(y1, y0 + 1)
+
+
+def fit_tile(crop):
+    """Scales a crop into a black THUMB_SIZE x THUMB_SIZE tile, keeping its aspect ratio."""
+    tile = np.zeros((THUMB_SIZE, THUMB_SIZE, 3), dtype=np.uint8)
+    scale = THUMB_SIZE / max(crop.shape[:2])
+    h = max(1, min(THUMB_SIZE, round(crop.shape[0] * scale)))
+    w = max(1, min(THUMB_SIZE, round(crop.shape[1] * scale)))
+    y, x = (THUMB_SIZE - h) // 2, (THUMB_SIZE - w) // 2
+    tile[y:y + h, x:x + w] = cv2.resize(crop, (w, h), interpolation=cv2.INTER_AREA)
+    return tile
+
+
+def render_thumbnails(video_path, rows, best_rows, output_path):
+    """
+    Cuts the thumbnail of every row in best_rows out of the video into a sprite
+    sheet, decoding the video once: frames without a thumbnail are only grabbed.
+
+    Returns:
+      - n (int): Thumbnails written (tile i belongs to best_rows[i]); 0 if the video cannot be read.
+    """
+    if len(best_rows) == 0:
+        return 0
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return 0
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    n_columns = min(THUMB_COLUMNS, len(best_rows))
+    sheet = np.zeros((math.ceil(len(best_rows) / n_columns) * THUMB_SIZE, n_columns * THUMB_SIZE, 3),
+                     dtype=np.uint8)
+    best = rows[best_rows]
+    by_frame = np.argsort(best['frame'], kind="stable")
+    position = 0
+    try:
+        for tile in by_frame:
+            frame = int(best['frame'][tile])
+            while position < frame and cap.grab():
+                position += 1
+            if position == frame:
+                ok, image = cap.read()
+                if not ok:
+                    break
+                position += 1
+                last_image = image
+            elif position != frame + 1:
+                break
+            x0, y0, x1, y1 = thumbnail_box(best[tile], width, height)
+            y, x = divmod(int(tile), n_columns)
+            sheet[y * THUMB_SIZE:(y + 1) * THUMB_SIZE, x * THUMB_SIZE:(x + 1) * THUMB_SIZE] = \
+                fit_tile(last_image[y0:y1, x0:x1])
+    finally:
+        cap.release()
+    tmp_path = output_path + ".tmp.jpg"
+    cv2.imwrite(tmp_path, sheet, [cv2.IMWRITE_JPEG_QUALITY, 85])
+    os.replace(tmp_path, output_path)
+    return len(best_rows)
+
+
+def _source_mtimes(store_path):
+    remap_path = track_store.remap_path_for(store_path)
+    return os.path.getmtime(store_path), os.path.getmtime(remap_path) if os.path.exists(remap_path) else None
+
+
+def build_summary(labels_dir, video_path=None):
+    """
+    Builds and writes the summary (and, given the run's video, the thumbnails) of a run.
+
+    Returns:
+      - summary (dict): 'tracks' (one dict of COLUMNS plus 'thumbnail', the tile index or
+        None, per track), 'n_frames', 'thumbnails' (sheet file name or None), 'thumb_size',
+        'thumb_columns', the source mtimes and the seconds taken.
+    """
+    start = time.perf_counter()
+    store = track_store.open_tracks(labels_dir)
+    table = summarize_tracks(store.rows)
+    n_tracks = len(table['track_id'])
+
+    # Thumbnails go to the tracks with the most detections, in track ID order on the sheet.
+    with_thumbnail = np.sort(np.argsort(-table['detections'], kind="stable")[:MAX_THUMBNAILS])
+    tiles = np.full(n_tracks, -1, dtype=np.int64)
+    thumbnails_path = thumbnails_path_for(labels_dir)
+    if video_path and os.path.exists(video_path) and render_thumbnails(
+            video_path, store.rows, table['best_row'][with_thumbnail], thumbnails_path):
+        tiles[with_thumbnail] = np.arange(len(with_thumbnail))
+    elif os.path.exists(thumbnails_path):
+        os.remove(thumbnails_path)
+
+    tracks = []
+    for i in range(n_tracks):
+        track = {column: table[column][i].item() for column in COLUMNS}
+        track['mean_conf'] = None if math.isnan(track['mean_conf']) else track['mean_conf']
+        track['thumbnail'] = int(tiles[i]) if tiles[i] >= 0 else None
+        tracks.append(track)
+    store_mtime, remap_mtime = _source_mtimes(store.path)
+    summary = {
+        'tracks': tracks,
+        'n_frames': store.n_frames,
+        'thumbnails': THUMBNAILS_NAME if (tiles >= 0).any() else None,
+        'thumb_size': THUMB_SIZE,
+        'thumb_columns': min(THUMB_COLUMNS, max(1, len(with_thumbnail))),
+        'store_mtime': store_mtime,
+        'remap_mtime': remap_mtime,
+        'seconds': round(time.perf_counter() - start, 3),
+    }
+    path = summary_path_for(labels_dir)
+    with open(path + ".tmp", "w") as f:
+        json.dump(summary, f)
+    os.replace(path + ".tmp", path)
+    return summary
+
+
+def load_summary(labels_dir, video_path=None):
+    """
+    The run's summary, rebuilt only if it is missing or older than the track
+    store or the ID remap table.
+    """
+    try:
+        with open(summary_path_for(labels_dir)) as f:
+            summary = json.load(f)
+        store_path = track_store.store_path_for(labels_dir)
+        if (summary['store_mtime'], summary['remap_mtime']) == _source_mtimes(store_path):
+            return summary
+    except (OSError, ValueError, KeyError):
+        pass
+    return build_summary(labels_dir, video_path)
+
+
+def select_tracks(summary, sort="track_id", descending=False, min_detections=0, min_span=0):
+    """
+    Tracks of a summary sorted by a column, without tracks of fewer than
+    min_detections detections or spanning fewer than min_span frames (e.g.
+    short-lived noise tracks). Tracks without a value sort last.
+    """
+    if sort not in COLUMNS:
+        raise ValueError(f"Unknown column {sort!r}; expected one of {', '.join(COLUMNS)}")
+    tracks = [track for track in summary['tracks'] if track['detections'] >= min_detections
+              and track['last_frame'] - track['first_frame'] + 1 >= min_span]
+    present = sorted((track for track in tracks if track[sort] is not None), key=lambda track: track[sort],
+                     reverse=descending)
+    return present + [track for track in tracks if track[sort] is None]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize the tracks of a run for reviewing false positives.")
+    parser.add_argument("labels_dir", help="Labels directory of the tracking run.")
+    parser.add_argument("--video", help="The run's video, for the thumbnails.")
+    parser.add_argument("--sort", default="detections", choices=COLUMNS, help="Column to sort the table by.")
+    parser.add_argument("--min-detections", type=int, default=0, help="Hide tracks with fewer detections.")
+    args = parser.parse_args()
+
+    summary = build_summary(args.labels_dir, args.video)
+    print(f"{len(summary['tracks'])} tracks summarized in {summary['seconds']:.2f}s")
+    for track in select_tracks(summary, args.sort, descending=True, min_detections=args.min_detections):
+        conf = f"{track['mean_conf']:.2f}" if track['mean_conf'] is not None else "-"
+        print(f"{track['track_id']:>6d}  frames {track['first_frame']:>6d}-{track['last_frame']:<6d} "
+              f"{track['detections']:>6d} detections  {track['mean_w']:.3f}x{track['mean_h']:.3f}  conf {conf}")
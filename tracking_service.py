@@ -0,0 +1,506 @@
+"""
+Long-lived tracking service used by the Flask app.
+
+Instead of starting `python run_tracking.py` for every upload, the app submits
+jobs to a pool of worker processes that import ultralytics/torch once and keep
+their YOLO models loaded between jobs. Every job gets an ID and its own
+directory:
+
+  jobs/<job_id>/job.json            flag, options and video hash of the job (see recover)
+  jobs/<job_id>/input/video.mp4      the uploaded video
+  jobs/<job_id>/output/track/        labels, annotated video, track store and track summary
+                                     (and checkpoint.pkl while the run is unfinished)
+  jobs/<job_id>/output/preview.jpg   throttled preview image
+  jobs/<job_id>/output/metrics.json  latest stage timings and progress (see run_metrics)
+  jobs/<job_id>/output/metrics.log   JSON lines log of those snapshots
+
+With a result cache (see result_cache), a job whose video was already tracked
+with the same model and settings finishes at submit() without tracking: the
+cached results are linked into its own output/track directory. Finished jobs
+are added to the cache.
+With a run catalog (see run_catalog), every finished job is recorded there
+with the run holding its results.
+
+Runs are checkpointed every run_checkpoint.CHECKPOINT_INTERVAL frames. A
+paused job stops after its current frame and is checkpointed; resume() queues
+it again to continue from the checkpoint, as it does for a job that failed or
+was cancelled mid-run. After a restart, recover() lists the jobs of
+jobs_folder with an unfinished run as paused, ready to resume.
+
+Job directories stay until remove_expired_jobs() deletes those of jobs that
+finished more than a retention period ago (the app calls it at startup with
+JOB_RETENTION_DAYS). Queued, running and paused jobs are always kept, and
+cached results live in the result cache, not in the job's directory.
+
+Workers are processes rather than threads because ByteTrack numbers its
+tracks with a class-level counter, which concurrent jobs in one process would
+share.
+"""
+import atexit
+import json
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+import uuid
+
+import ant_interactions
+import result_cache
+import run_checkpoint
+import run_metrics
+import run_tracking
+import track_summary
+
+JOBS_FOLDER = 'jobs'
+JOB_FILE = 'job.json'
+MAX_CONCURRENT_JOBS = 2
+# Models every worker loads as soon as it starts (flags as in run_tracking.load_model).
+PRELOAD_FLAGS = (0,)
+# Seconds between live interaction count updates of a running job.
+PROGRESS_INTERVAL = 1.0
+# Days the directory of a finished job is kept (see TrackingService.remove_expired_jobs); 0 keeps every job.
+JOB_RETENTION_DAYS = 0
+
+# Job states.
+QUEUED, RUNNING, PAUSED, DONE, FAILED, CANCELLED = 'queued', 'running', 'paused', 'done', 'failed', 'cancelled'
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+
+class Job:
+    """A tracking job and its directories."""
+
+    def __init__(self, job_id, flag, jobs_folder=JOBS_FOLDER, options=None):
+        self.id = job_id
+        self.flag = flag
+        # Extra keyword arguments of run_tracking.track_video, e.g. {'stride': 5}.
+        self.options = dict(options or {})
+        self.job_dir = os.path.join(jobs_folder, job_id)
+        self.input_dir = os.path.join(self.job_dir, 'input')
+        self.output_dir = os.path.join(self.job_dir, 'output')
+        self.video_path = os.path.join(self.input_dir, 'video.mp4')
+        self.preview_path = os.path.join(self.output_dir, 'preview.jpg')
+        # Run directory of the job's tracking (fixed, so a resumed run continues in place).
+        self.track_dir = os.path.join(self.output_dir, 'track')
+        self.metrics_path = os.path.join(self.output_dir, run_metrics.METRICS_NAME)
+        self.log_path = os.path.join(self.output_dir, run_metrics.LOG_NAME)
+        self.status = QUEUED
+        self.error = None
+        self.run_dir = None
+        self.submitted_at = None
+        self.started_at = None
+        self.finished_at = None
+        self.stop_event = None
+        # Set by pause(): the worker stopping on stop_event pauses the job instead of cancelling it.
+        self.pause_requested = False
+        self.interactions = None
+        # Result cache key (None: not cached) and whether the results came from the cache.
+        self.cache_key = None
+        self.cached = False
+        # SHA-256 of the video (result_cache.save_upload), if known.
+        self.video_hash = None
+
+    @property
+    def labels_dir(self):
+        return os.path.join(self.run_dir, 'labels') if self.run_dir else None
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATES
+
+    @property
+    def resumable(self):
+        """Paused, or stopped mid-run by cancel() or an error, with a checkpoint to continue from."""
+        return self.status == PAUSED or (self.status in (FAILED, CANCELLED) and not self.cached
+                                         and run_checkpoint.find(self.track_dir) is not None)
+
+    def metrics(self):
+        """Latest stage timings and progress written by the worker (None before it started)."""
+        return run_metrics.read_metrics(self.metrics_path)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'flag': self.flag,
+            'options': self.options,
+            'status': self.status,
+            'error': self.error,
+            'video_path': self.video_path,
+            'run_dir': self.run_dir,
+            'labels_dir': self.labels_dir,
+            'submitted_at': self.submitted_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'interactions': self.interactions,
+            'cached': self.cached,
+            'resumable': self.resumable,
+        }
+
+    def save(self):
+        """Writes job.json, everything recover() needs to resume the job after a restart."""
+        record = {'id': self.id, 'flag': self.flag, 'options': self.options, 'video_hash': self.video_hash,
+                  'cache_key': self.cache_key, 'submitted_at': self.submitted_at}
+        path = os.path.join(self.job_dir, JOB_FILE)
+        with open(path + ".tmp", "w") as f:
+            json.dump(record, f)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, job_dir):
+        """The job saved in job_dir (see save), or None."""
+        try:
+            with open(os.path.join(job_dir, JOB_FILE)) as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        options = record['options']
+        if options.get('roi') is not None:
+            # JSON has no tuples; the ROI is part of the tracking config the checkpoint is checked against.
+            options['roi'] = tuple(options['roi'])
+        job = cls(record['id'], record['flag'], os.path.dirname(job_dir), options)
+        job.video_hash = record.get('video_hash')
+        job.cache_key = record.get('cache_key')
+        job.submitted_at = record.get('submitted_at')
+        return job
+
+
+def _worker_main(job_queue, event_queue, preload_flags):
+    """
+    Worker process loop: keeps one warm model per flag and runs queued jobs
+    until it receives None.
+    """
+    # Models live in this process's model registry, so every job after the first is warm.
+    for flag in preload_flags:
+        try:
+            run_tracking.load_model(flag)
+        except Exception as e:
+            print(f"Could not preload model for flag {flag}: {e}")
+
+    while True:
+        task = job_queue.get()
+        if task is None:
+            break
+        job_id, video_path, flag, output_dir, preview_path, options, stop_event, resume = task
+        if stop_event.is_set():
+            event_queue.put((job_id, CANCELLED, {'finished_at': time.time()}))
+            continue
+        event_queue.put((job_id, RUNNING, {'started_at': time.time()}))
+        metrics = run_metrics.RunMetrics(job_id, path=os.path.join(output_dir, run_metrics.METRICS_NAME),
+                                         log_path=os.path.join(output_dir, run_metrics.LOG_NAME))
+        interactions = ant_interactions.InteractionCounter()
+        reporter = _ProgressReporter(job_id, event_queue, interactions)
+        reporter.start()
+        try:
+            # track_video takes the warm model of the mode it runs in from the registry.
+            run_dir = run_tracking.track_video(video_path, flag, stop_event, project=output_dir, name='track',
+                                               preview_path=preview_path, interactions=interactions,
+                                               metrics=metrics, checkpoint_interval=run_checkpoint.CHECKPOINT_INTERVAL,
+                                               resume=resume, **options)
+            reporter.stop()
+            status = CANCELLED if stop_event.is_set() else DONE
+            if status == DONE and run_dir is not None:
+                # Built while the worker still has the video at hand, so the review page opens at once.
+                _build_summary(os.path.join(run_dir, 'labels'), video_path)
+            event_queue.put((job_id, status, {'run_dir': run_dir, 'interactions': interactions.live_count(),
+                                              'finished_at': time.time()}))
+        except Exception as e:
+            reporter.stop()
+            event_queue.put((job_id, FAILED, {'error': str(e), 'finished_at': time.time()}))
+
+
+def _build_summary(labels_dir, video_path):
+    try:
+        summary = track_summary.build_summary(labels_dir, video_path)
+        print(f"Track summary of {len(summary['tracks'])} tracks built in {summary['seconds']:.2f}s")
+    except Exception as e:
+        print(f"Could not build the track summary of {labels_dir}: {e}")
+
+
+class _ProgressReporter(threading.Thread):
+    """Posts the live interaction count of a running job every PROGRESS_INTERVAL seconds."""
+
+    def __init__(self, job_id, event_queue, interactions):
+        super().__init__(daemon=True)
+        self.job_id = job_id
+        self.event_queue = event_queue
+        self.interactions = interactions
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(PROGRESS_INTERVAL):
+            self.event_queue.put((self.job_id, RUNNING, {'interactions': self.interactions.live_count()}))
+
+    def stop(self):
+        # Joined before the final status is posted, so no RUNNING update can follow it.
+        self._done.set()
+        self.join()
+
+
+class TrackingService:
+    """
+    Job queue in front of a pool of warm tracking worker processes. At most
+    max_workers jobs run at the same time; the rest wait in the queue.
+    """
+
+    def __init__(self, max_workers=MAX_CONCURRENT_JOBS, jobs_folder=JOBS_FOLDER, preload_flags=PRELOAD_FLAGS,
+                 cache=None, catalog=None):
+        self.max_workers = max_workers
+        self.jobs_folder = jobs_folder
+        self.preload_flags = tuple(preload_flags)
+        # result_cache.ResultCache consulted by submit(); None disables caching.
+        self.cache = cache
+        # run_catalog.RunCatalog finished jobs are recorded in; None: not recorded.
+        self.catalog = catalog
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._started = False
+        self._workers = []
+
+    def start(self):
+        """
+        Starts the worker processes (they load their models right away).
+        Returns True if this call started them, False if they were running.
+        """
+        with self._lock:
+            if self._started:
+                return False
+            self._started = True
+            # spawn: forking a process that may already hold torch threads is unsafe.
+            ctx = multiprocessing.get_context('spawn')
+            self._manager = ctx.Manager()
+            self._job_queue = ctx.Queue()
+            self._event_queue = ctx.Queue()
+            for _ in range(self.max_workers):
+                worker = ctx.Process(target=_worker_main, daemon=True,
+                                     args=(self._job_queue, self._event_queue, self.preload_flags))
+                worker.start()
+                self._workers.append(worker)
+        threading.Thread(target=self._collect_events, daemon=True).start()
+        atexit.register(self.shutdown)
+        return True
+
+    def shutdown(self):
+        """Asks the workers to exit once their current job is done."""
+        if not self._started:
+            return
+        for _ in self._workers:
+            self._job_queue.put(None)
+
+    def _collect_events(self):
+        while True:
+            job_id, status, fields = self._event_queue.get()
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is None:
+                    continue
+                if status == CANCELLED and job.pause_requested:
+                    status = PAUSED
+                job.status = status
+                for key, value in fields.items():
+                    setattr(job, key, value)
+                cache_result = status == DONE and job.cache_key is not None and job.run_dir is not None
+            if status in FINISHED_STATES and job.run_dir is not None:
+                self._record_job(job)
+            if cache_result:
+                # Copying the run can take a while; events of other jobs keep flowing meanwhile.
+                threading.Thread(target=self._cache_result, args=(job,), daemon=True).start()
+
+    def _cache_result(self, job):
+        try:
+            self.cache.put(job.cache_key, job.run_dir, interactions=job.interactions, job_id=job.id,
+                           flag=job.flag, options=job.options)
+        except Exception as e:
+            print(f"Could not cache the results of job {job.id}: {e}")
+
+    def _record_cached_run(self, job, config):
+        """Records the run a cache hit linked into the job's directory (nothing was tracked for it)."""
+        if self.catalog is None:
+            return
+        try:
+            self.catalog.record_run(job.run_dir, name=job.id, video_path=job.video_path, video_hash=job.video_hash,
+                                    model=config['weights'], tracker=config['tracker'], config=config,
+                                    labels_dir=job.labels_dir, status="done", elapsed_s=0.0,
+                                    created=job.submitted_at, finished=job.finished_at)
+        except Exception as e:
+            print(f"Could not record the run of job {job.id} in the run catalog: {e}")
+
+    def _record_job(self, job):
+        if self.catalog is None:
+            return
+        try:
+            self.catalog.record_job(job.id, job.run_dir, job.video_path, job.video_hash, job.cached)
+        except Exception as e:
+            print(f"Could not record job {job.id} in the run catalog: {e}")
+
+    def create_job(self, flag=0, **options):
+        """
+        Creates a job and its input/output directories. Save the video to
+        job.video_path, then call submit(job). Options are passed on to
+        run_tracking.track_video (e.g. stride=5).
+        """
+        job = Job(uuid.uuid4().hex, flag, self.jobs_folder, options)
+        os.makedirs(job.input_dir, exist_ok=True)
+        os.makedirs(job.output_dir, exist_ok=True)
+        with self._lock:
+            self._jobs[job.id] = job
+        return job
+
+    def submit(self, job, video_digest=None):
+        """
+        Queues a created job for tracking. With a result cache and the video's
+        digest (result_cache.save_upload), cached results finish the job right away.
+        """
+        job.video_hash = video_digest
+        if self.cache is not None and video_digest is not None:
+            config = run_tracking.tracking_config(job.flag, **job.options)
+            job.cache_key = result_cache.cache_key(video_digest, config)
+            # The job gets its own copy, so its edits stay out of the cache and eviction cannot remove it.
+            entry = self.cache.get(job.cache_key, run_dir=job.track_dir)
+            if entry is not None:
+                now = time.time()
+                with self._lock:
+                    job.run_dir = entry['run_dir']
+                    job.interactions = entry.get('interactions')
+                    job.cached = True
+                    job.submitted_at = job.started_at = job.finished_at = now
+                    job.status = DONE
+                self._record_cached_run(job, config)
+                self._record_job(job)
+                print(f"Job {job.id}: results found in the cache ({job.run_dir}).")
+                return job
+        job.submitted_at = time.time()
+        job.save()
+        self._enqueue(job, resume=False)
+        return job
+
+    def _enqueue(self, job, resume):
+        self.start()
+        job.stop_event = self._manager.Event()
+        self._job_queue.put((job.id, job.video_path, job.flag, job.output_dir, job.preview_path, job.options,
+                             job.stop_event, resume))
+
+    def get(self, job_id):
+        """Returns the job with this ID, or None."""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        """All jobs known to the service, most recent first."""
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda job: job.submitted_at or 0, reverse=True)
+
+    def cancel(self, job_id):
+        """
+        Asks a queued or running job to stop. The worker checks the request
+        every frame. Returns False if the job does not exist or has finished.
+        """
+        job = self.get(job_id)
+        if job is None or job.finished or job.stop_event is None:
+            return False
+        job.stop_event.set()
+        return True
+
+    def pause(self, job_id):
+        """
+        Asks a queued or running job to stop and keep its checkpoint, so resume()
+        continues it. Returns False if the job does not exist or has finished.
+        """
+        job = self.get(job_id)
+        if job is None or job.finished or job.status == PAUSED or job.stop_event is None:
+            return False
+        job.pause_requested = True
+        job.stop_event.set()
+        return True
+
+    def resume(self, job_id):
+        """
+        Queues a paused job (or one stopped mid-run, see Job.resumable) again; the
+        worker continues its run from the checkpoint. Returns False if the job
+        does not exist or cannot be resumed.
+        """
+        job = self.get(job_id)
+        if job is None or not job.resumable:
+            return False
+        with self._lock:
+            job.status = QUEUED
+            job.pause_requested = False
+            job.error = None
+            job.finished_at = None
+        self._enqueue(job, resume=True)
+        return True
+
+    def recover(self):
+        """
+        Registers the jobs in jobs_folder whose run was interrupted (by a pause, a
+        crash or a restart of the app) and still has its video, as paused jobs.
+        Call once at startup. Returns the recovered jobs.
+        """
+        if not os.path.isdir(self.jobs_folder):
+            return []
+        recovered = []
+        for name in sorted(os.listdir(self.jobs_folder)):
+            job_dir = os.path.join(self.jobs_folder, name)
+            if self.get(name) is not None or not os.path.exists(run_checkpoint.checkpoint_path(
+                    os.path.join(job_dir, 'output', 'track'))):
+                continue
+            job = Job.load(job_dir)
+            if job is None or not os.path.exists(job.video_path):
+                continue
+            job.status = PAUSED
+            job.run_dir = job.track_dir
+            with self._lock:
+                self._jobs[job.id] = job
+            recovered.append(job)
+            print(f"Job {job.id}: interrupted at frame {run_checkpoint.find(job.track_dir)}, can be resumed.")
+        return recovered
+
+    def remove_expired_jobs(self, max_age_days=JOB_RETENTION_DAYS, now=None):
+        """
+        Deletes the directories in jobs_folder of jobs that finished more than
+        max_age_days ago, and forgets their runs in the run catalog. Jobs this
+        service does not know (e.g. from before a restart) are aged by the last
+        change to their directories. Queued, running and paused jobs, and
+        unknown jobs with a checkpoint (call recover() first), are kept.
+
+        Returns:
+          - removed (list): IDs of the removed jobs.
+        """
+        if max_age_days <= 0 or not os.path.isdir(self.jobs_folder):
+            return []
+        now = time.time() if now is None else now
+        removed = []
+        for name in sorted(os.listdir(self.jobs_folder)):
+            job_dir = os.path.join(self.jobs_folder, name)
+            if not os.path.isdir(job_dir):
+                continue
+            job = self.get(name)
+            track_dir = os.path.join(job_dir, 'output', 'track')
+            if job is not None:
+                if not job.finished:
+                    continue
+                last_used = job.finished_at or _last_modified(job_dir)
+            elif os.path.exists(run_checkpoint.checkpoint_path(track_dir)):
+                continue
+            else:
+                last_used = _last_modified(job_dir)
+            if now - last_used < max_age_days * 86400:
+                continue
+            try:
+                shutil.rmtree(job_dir)
+            except OSError as e:
+                print(f"Could not remove the directory of job {name}: {e}")
+                continue
+            if self.catalog is not None:
+                self.catalog.forget(job.run_dir if job is not None and job.run_dir else track_dir)
+            with self._lock:
+                self._jobs.pop(name, None)
+            removed.append(name)
+        if removed:
+            print(f"Removed {len(removed)} jobs finished more than {max_age_days:g} days ago.")
+        return removed
+
+
+def _last_modified(job_dir):
+    """Latest modification time of a job's directory and its input, output and track directories."""
+    paths = [job_dir] + [os.path.join(job_dir, *parts) for parts in (('input',), ('output',), ('output', 'track'))]
+    return max(os.path.getmtime(path) for path in paths if os.path.exists(path))
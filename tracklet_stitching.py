@@ -0,0 +1,246 @@
+"""
+Links the tracklets ByteTrack splits one ant into, after tracking.
+
+When the tracker loses an ant (occlusion, missed detections, two ants
+touching) the ant continues under a new ID. This stage treats every track ID
+as a tracklet and links the end of one tracklet to the start of a later one
+when the gap, the position (extrapolated with the tracklet's last velocity)
+and the box size agree. All candidate links of the run are scored at once and
+solved as an assignment problem, so every tracklet gets at most one
+predecessor and one successor; chains of linked tracklets are then merged
+into the ID of their first tracklet.
+
+The result is written as the run's ID remap table (track_store.REMAP_NAME),
+which TrackStore applies on load, so false_positive, ant_interactions and
+test_track all see the stitched IDs. Re-running replaces the table; the
+stitching always starts from the tracker's own IDs.
+
+Usage:
+  python tracklet_stitching.py runs/detect/track1/labels
+  python tracklet_stitching.py runs/detect/track1/labels --max-gap 60 --dry-run
+  python tracklet_stitching.py runs/detect/track1/labels --clear
+  python tracklet_stitching.py            # the most recent run in the run catalog
+"""
+import argparse
+import os
+import time
+
+import numpy as np #type:ignore
+from scipy.optimize import linear_sum_assignment #type:ignore
+from scipy.sparse import coo_matrix #type:ignore
+from scipy.sparse.csgraph import connected_components #type:ignore
+import run_catalog
+import track_store
+
+# Longest gap (frames) between the end of a tracklet and the start of its continuation.
+MAX_GAP = 30
+# Allowed distance (normalized image coordinates) between the predicted and the actual
+# start position: MAX_DISTANCE plus MAX_SPEED per frame of gap.
+MAX_DISTANCE = 0.03
+MAX_SPEED = 0.005
+# Largest ratio between the box areas at the end and at the start of a link.
+MAX_AREA_RATIO = 2.0
+# Weights of the gap and size terms of a link's cost (the distance term is at most 1).
+GAP_WEIGHT = 0.5
+SIZE_WEIGHT = 0.5
+# Links costing more than this are never made.
+MAX_COST = 1.0
+# Rows at the end of a tracklet used to estimate its velocity.
+VELOCITY_WINDOW = 5
+
+
+def tracklets(rows):
+    """
+    Start and end of every tracklet (track ID) of a store's rows.
+
+    Returns:
+      - table (dict of np.ndarray): ids, first/last frame, x/y and box area at the first
+        and the last detection, and the velocity (per frame) over the last VELOCITY_WINDOW
+        detections, one entry per track ID in ID order.
+    """
+    rows = rows[np.asarray(rows['track_id']) >= 0]
+    ids = np.asarray(rows['track_id'], dtype=np.int64)
+    frames = np.asarray(rows['frame'], dtype=np.int64)
+    order = np.lexsort((frames, ids))
+    ids, frames = ids[order], frames[order]
+    x = np.asarray(rows['x'])[order]
+    y = np.asarray(rows['y'])[order]
+    area = np.asarray(rows['w'])[order] * np.asarray(rows['h'])[order]
+
+    track_ids, first = np.unique(ids, return_index=True)
+    last = np.append(first[1:], len(ids)) - 1
+    back = np.maximum(first, last - VELOCITY_WINDOW + 1)
+    span = np.maximum(frames[last] - frames[back], 1)
+    return {
+        'ids': track_ids,
+        'first_frame': frames[first],
+        'last_frame': frames[last],
+        'first_x': x[first], 'first_y': y[first], 'first_area': area[first],
+        'last_x': x[last], 'last_y': y[last], 'last_area': area[last],
+        'vx': (x[last] - x[back]) / span,
+        'vy': (y[last] - y[back]) / span,
+    }
+
+
+def candidate_links(table, max_gap=MAX_GAP, max_distance=MAX_DISTANCE, max_speed=MAX_SPEED,
+                    max_area_ratio=MAX_AREA_RATIO):
+    """
+    Every (end, start) tracklet pair that could be one ant, with its cost.
+
+    Tracklet j may continue tracklet i if it starts 1..max_gap frames after i ends, close
+    to where i was heading and with a similar box size.
+
+    Returns:
+      - ends, starts (np.ndarray): Tracklet indices (into table) of each candidate link.
+      - cost (np.ndarray): Cost of each link, below MAX_COST.
+    """
+    # Tracklets sorted by first frame, so the starts following an end form one slice.
+    by_start = np.argsort(table['first_frame'], kind="stable")
+    start_frames = table['first_frame'][by_start]
+    lo = np.searchsorted(start_frames, table['last_frame'], side="right")
+    hi = np.searchsorted(start_frames, table['last_frame'] + max_gap, side="right")
+    counts = hi - lo
+    ends = np.repeat(np.arange(len(counts)), counts)
+    # Position of each link within its end's slice: 0, 1, ..., count - 1.
+    within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    starts = by_start[np.repeat(lo, counts) + within]
+
+    gap = table['first_frame'][starts] - table['last_frame'][ends]
+    predicted_x = table['last_x'][ends] + table['vx'][ends] * gap
+    predicted_y = table['last_y'][ends] + table['vy'][ends] * gap
+    distance = np.hypot(table['first_x'][starts] - predicted_x, table['first_y'][starts] - predicted_y)
+    allowed = max_distance + max_speed * gap
+    area_ratio = np.abs(np.log(np.maximum(table['first_area'][starts], 1e-12)
+                               / np.maximum(table['last_area'][ends], 1e-12)))
+
+    cost = (distance / allowed
+            + GAP_WEIGHT * gap / max_gap
+            + SIZE_WEIGHT * area_ratio / np.log(max_area_ratio))
+    feasible = (distance <= allowed) & (area_ratio <= np.log(max_area_ratio)) & (cost < MAX_COST)
+    return ends[feasible], starts[feasible], cost[feasible]
+
+
+def solve_links(n, ends, starts, cost):
+    """
+    Chooses links so that every tracklet has at most one successor and one
+    predecessor, minimizing the total cost minus MAX_COST per link made.
+
+    Candidate links split into independent groups (connected components of the
+    end/start graph); each group is one small assignment problem.
+
+    Returns:
+      - successor (np.ndarray): For every tracklet, the index of its continuation or -1.
+    """
+    successor = np.full(n, -1, dtype=np.int64)
+    if len(ends) == 0:
+        return successor
+    # Nodes 0..n-1 are tracklet ends, n..2n-1 tracklet starts.
+    graph = coo_matrix((np.ones(len(ends)), (ends, starts + n)), shape=(2 * n, 2 * n))
+    _, labels = connected_components(graph, directed=False)
+    component = labels[ends]
+    order = np.argsort(component, kind="stable")
+    bounds = np.flatnonzero(np.diff(component[order])) + 1
+    for group in np.split(order, bounds):
+        if len(group) == 1:
+            successor[ends[group[0]]] = starts[group[0]]
+            continue
+        group_ends, end_index = np.unique(ends[group], return_inverse=True)
+        group_starts, start_index = np.unique(starts[group], return_inverse=True)
+        # Pairs that are no candidate cost 0, i.e. the same as not linking.
+        matrix = np.zeros((len(group_ends), len(group_starts)))
+        matrix[end_index, start_index] = cost[group] - MAX_COST
+        rows, cols = linear_sum_assignment(matrix)
+        linked = matrix[rows, cols] < 0
+        successor[group_ends[rows[linked]]] = group_starts[cols[linked]]
+    return successor
+
+
+def chain_roots(successor):
+    """For every tracklet, the index of the first tracklet of its chain."""
+    root = np.arange(len(successor))
+    linked = successor >= 0
+    root[successor[linked]] = np.flatnonzero(linked)
+    # Pointer jumping: follow predecessors until every tracklet points at its chain's start.
+    while True:
+        jumped = root[root]
+        if np.array_equal(jumped, root):
+            return root
+        root = jumped
+
+
+def stitch_tracks(store, **options):
+    """
+    Computes the ID remap of a track store (opened with remap=False).
+
+    Returns:
+      - old_ids, new_ids (np.ndarray): The IDs that change and the ID they are merged into.
+    """
+    table = tracklets(store.rows)
+    ends, starts, cost = candidate_links(table, **options)
+    successor = solve_links(len(table['ids']), ends, starts, cost)
+    new_ids = table['ids'][chain_roots(successor)]
+    changed = new_ids != table['ids']
+    return table['ids'][changed], new_ids[changed]
+
+
+def stitch_run(labels_dir, dry_run=False, **options):
+    """
+    Stitches the tracklets of a run and writes its ID remap table.
+
+    Parameters:
+      - labels_dir (str): Labels directory of the run.
+      - dry_run (bool): Only report, do not write the table.
+      - options: max_gap, max_distance, max_speed, max_area_ratio (see candidate_links).
+
+    Returns:
+      - report (dict): Tracklets before and after stitching, links made, the table path and seconds taken.
+    """
+    start = time.perf_counter()
+    store_path = track_store.open_tracks(labels_dir).path
+    store = track_store.TrackStore(store_path, remap=False)
+    old_ids, new_ids = stitch_tracks(store, **options)
+    remap_path = track_store.remap_path_for(store_path)
+    if not dry_run:
+        track_store.write_remap(remap_path, old_ids, new_ids)
+    n_tracklets = len(store.track_ids())
+    return {
+        'tracklets': n_tracklets,
+        'tracks': n_tracklets - len(old_ids),
+        'links': len(old_ids),
+        'remap_path': None if dry_run else remap_path,
+        'seconds': time.perf_counter() - start,
+    }
+
+
+def clear_run(labels_dir):
+    """Removes the ID remap table of a run, restoring the tracker's IDs."""
+    remap_path = track_store.remap_path_for(track_store.store_path_for(labels_dir))
+    if os.path.exists(remap_path):
+        os.remove(remap_path)
+    return remap_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge the track IDs the tracker split one ant into.")
+    parser.add_argument("labels_dir", nargs="?", default="latest",
+                        help="Labels or run directory, tracking job ID, or 'latest' run in the run catalog.")
+    parser.add_argument("--max-gap", type=int, default=MAX_GAP, help="Longest gap in frames between two tracklets.")
+    parser.add_argument("--max-distance", type=float, default=MAX_DISTANCE,
+                        help="Allowed normalized distance from the predicted position, plus --max-speed per frame.")
+    parser.add_argument("--max-speed", type=float, default=MAX_SPEED, help="Normalized distance per frame of gap.")
+    parser.add_argument("--max-area-ratio", type=float, default=MAX_AREA_RATIO,
+                        help="Largest box area ratio between the two ends of a link.")
+    parser.add_argument("--dry-run", action="store_true", help="Report the links without writing the table.")
+    parser.add_argument("--clear", action="store_true", help="Remove the run's ID remap table.")
+    args = parser.parse_args()
+
+    args.labels_dir = run_catalog.resolve_labels(args.labels_dir)
+    if args.clear:
+        print(f"Removed {clear_run(args.labels_dir)}")
+    else:
+        report = stitch_run(args.labels_dir, args.dry_run, max_gap=args.max_gap, max_distance=args.max_distance,
+                            max_speed=args.max_speed, max_area_ratio=args.max_area_ratio)
+        print(f"{report['tracklets']} tracklets -> {report['tracks']} tracks ({report['links']} links) "
+              f"in {report['seconds']:.2f}s")
+        if report['remap_path']:
+            print(f"ID remap table written to {report['remap_path']}")
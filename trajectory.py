@@ -1,64 +1,240 @@
+"""
+Draws the trajectories of tracked ants over a whole video.
+
+The trajectories come either from tracking the video (render_video) or from
+the labels of an earlier run (render_labels, no inference). Only the last
+position of every track is kept, and the trails live in an overlay layer that
+is only drawn into, never redrawn: each pixel of the layer holds the frame its
+last trail segment was drawn in (the frame of the segment's newer end), and a
+pixel is shown while that frame is one of the last tail - 1 frames. Per frame,
+only the new segment of every tracked ant is drawn, so the drawing cost does
+not grow with the tail length or with the number of tracks seen so far. Showing
+the trails still takes one comparison of the whole overlay per frame (visible),
+whose cost grows with the frame size.
+
+An ant tracked in every frame therefore trails its positions of the last
+`tail` frames, as the original polyline through a track's last 30 positions
+did. Trails now follow frames rather than positions: the trail of a lost
+track fades out over the following frames instead of vanishing while the ant
+is not detected, and positions more than tail - 1 frames apart are not joined.
+
+Usage:
+  python trajectory.py --video 2ants_cropped.mp4                                  # tracks the video
+  python trajectory.py --video 2ants_cropped.mp4 --labels runs/detect/track/labels # reuses a run
+  python trajectory.py --labels runs/detect/track/labels --size 1280x720           # trails on black
+  python trajectory.py --labels latest --size 1280x720                             # latest run in the run catalog
+"""
+import argparse
 import os
 os.environ["KMP_DUPLICATE_LIB_OK"]="TRUE"
 
-from collections import defaultdict
-
 import cv2 #type:ignore
 import numpy as np #type:ignore
-from ultralytics import YOLO #type:ignore
+import inference_backend
+import model_registry
+import run_catalog
+import run_metrics
+import track_store
 
-# Load the YOLO11 model
-model = YOLO('best3-3(v11m_50).pt')
+TRAJECTORY_WEIGHTS = 'best3-3(v11m_50).pt'
+OUTPUT_PATH = "trajectory.mp4"
+SNAPSHOT_PATH = "trajectory.jpg"
+# An ant tracked in every frame trails its positions of the last TAIL frames.
+TAIL = 30
+TRACK_COLOR = (230, 230, 230)
+TRACK_THICKNESS = 10
+# Overlay value of pixels no trail was ever drawn on.
+NEVER = np.iinfo(np.int32).min
 
-# Open the video file
-video_path = "2ants_cropped.mp4"
-cap = cv2.VideoCapture(video_path)
+class TrajectoryRenderer:
+    """
+    Trails of every track over the last `tail` frames (see the module
+    docstring), for frames of one size.
 
-# Store the track history
-track_history = defaultdict(lambda: [])
+    Call update() with the tracked centers of each frame (in order), then draw()
+    to paint the trails onto the frame. The trail of a lost track fades out
+    over the following frames instead of disappearing at once.
+    """
 
-i = 0
-# Loop through the video frames
-while cap.isOpened() and i < 100:
-    # Read a frame from the video
-    success, frame = cap.read()
+    def __init__(self, size, tail=TAIL, color=TRACK_COLOR, thickness=TRACK_THICKNESS):
+        width, height = size
+        self.tail = tail
+        self.color = np.array(color, dtype=np.uint8)
+        self.thickness = thickness
+        # Last (frame, x, y) of every track seen in the last `tail` frames.
+        self.last_positions = {}
+        # Frame in which the most recent segment covering each pixel was drawn.
+        self.overlay = np.full((height, width), NEVER, dtype=np.int32)
+        # Solid trail color, copied onto frames through the visible mask.
+        self.color_layer = np.empty((height, width, 3), dtype=np.uint8)
+        self.color_layer[:] = self.color
+        self.frame_index = -1
 
-    if success:
-        i = i+1
-        # Run YOLO11 tracking on the frame, persisting tracks between frames
-        result = model.track(frame, persist=True, conf=0.1)[0]
+    def update(self, frame_index, track_ids, centers):
+        """
+        Adds the (x, y) pixel centers of the tracks in frame_index and draws the
+        segment from each track's previous position to the new one.
+        """
+        self.frame_index = frame_index
+        for track_id, (x, y) in zip(track_ids, centers):
+            last = self.last_positions.get(track_id)
+            if last is not None and frame_index - last[0] < self.tail:
+                cv2.line(self.overlay, (int(last[1]), int(last[2])), (int(x), int(y)), int(frame_index),
+                         self.thickness)
+            self.last_positions[track_id] = (frame_index, x, y)
+        if frame_index % self.tail == 0:
+            # Tracks gone for longer than the tail have nothing left to draw.
+            for track_id in [t for t, last in self.last_positions.items() if frame_index - last[0] >= self.tail]:
+                del self.last_positions[track_id]
 
-        # Get the boxes and track IDs
+    def visible(self):
+        """
+        Mask of the pixels covered by a trail segment drawn in the last tail - 1
+        frames, i.e. joining positions of the last `tail` frames. Compares the
+        whole overlay, so it costs the same for every frame of one size.
+        """
+        return self.overlay > self.frame_index - self.tail + 1
+
+    def draw(self, frame):
+        """Paints the visible trails onto frame (in place) and returns it."""
+        # copyTo with a mask is far cheaper than boolean-index assignment of a color.
+        cv2.copyTo(self.color_layer, self.visible().view(np.uint8), frame)
+        return frame
+
+def label_frames(labels_dir, size, video_path=None, max_frames=None):
+    """
+    Yields (frame, track_ids, centers) for a tracking run's labels, over the
+    frames of video_path with the boxes drawn, or over black frames of `size`.
+    """
+    import false_positive
+    width, height = size
+    cap = cv2.VideoCapture(video_path) if video_path else None
+    if cap is not None and not cap.isOpened():
+        raise IOError(f"Cannot open video file: {video_path}")
+    try:
+        tracks = track_store.open_tracks(labels_dir, int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) if cap else None)
+        frame_index = 0
+        while max_frames is None or frame_index < max_frames:
+            if cap is not None:
+                success, frame = cap.read()
+                if not success:
+                    break
+            elif frame_index < len(tracks):
+                frame = np.zeros((height, width, 3), dtype=np.uint8)
+            else:
+                break
+            rows = tracks.frame(frame_index)
+            rows = rows[rows['track_id'] >= 0]
+            false_positive.draw_boxes(frame, rows)
+            centers = np.column_stack([rows['x'] * width, rows['y'] * height])
+            yield frame, rows['track_id'].tolist(), centers
+            frame_index += 1
+    finally:
+        if cap is not None:
+            cap.release()
+
+def tracked_frames(video_path, weights=TRAJECTORY_WEIGHTS, conf=0.1, max_frames=None):
+    """Yields (frame, track_ids, centers) while tracking the video, boxes drawn by ultralytics."""
+    import run_tracking
+    model = model_registry.get_model(inference_backend.resolve_weights(weights), slot='track')
+    run_tracking.reset_trackers(model)
+    results = model.track(source=video_path, stream=True, persist=True, conf=conf, verbose=False)
+    for frame_index, result in enumerate(results):
+        if max_frames is not None and frame_index >= max_frames:
+            break
         if result.boxes and result.boxes.id is not None:
-            boxes = result.boxes.xywh.cpu()
-            track_ids = result.boxes.id.int().cpu().tolist()
-
-            # Visualize the result on the frame
-            frame = result.plot()
-
-            # Plot the tracks
-            for box, track_id in zip(boxes, track_ids):
-                x, y, w, h = box
-                track = track_history[track_id]
-                track.append((float(x), float(y)))  # x, y center point
-                if len(track) > 30:  # retain 30 tracks for 30 frames
-                    track.pop(0)
-
-                # Draw the tracking lines
-                points = np.hstack(track).astype(np.int32).reshape((-1, 1, 2))
-                cv2.polylines(frame, [points], isClosed=False, color=(230, 230, 230), thickness=10)
-
-        # Display the annotated frame
-        #cv2.imshow("YOLO11 Tracking", frame)
-
-        # Break the loop if 'q' is pressed
-        # if cv2.waitKey(1) & 0xFF == ord("q"):
-        #     break
-    else:
-        # Break the loop if the end of the video is reached
-        break
-
-# Release the video capture object and close the display window
-cap.release()
-cv2.imwrite('trajectory.jpg', frame)
-cv2.destroyAllWindows()
\ No newline at end of file
+            yield (result.plot(), result.boxes.id.int().cpu().tolist(),
+                   result.boxes.xywh[:, :2].cpu().numpy())
+        else:
+            yield result.orig_img.copy(), [], np.empty((0, 2))
+
+def render(frames, output_path, size, fps=30, tail=TAIL, snapshot_path=SNAPSHOT_PATH, metrics=None):
+    """
+    Draws the trails onto every frame of `frames` ((frame, track_ids, centers) tuples)
+    and writes them to output_path; the last frame is also saved to snapshot_path.
+
+    Returns:
+      - frames_written (int): Number of frames rendered.
+    """
+    if metrics is None:
+        metrics = run_metrics.RunMetrics(os.path.basename(output_path))
+    renderer = TrajectoryRenderer(size, tail)
+    out = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+    frame = None
+    frame_index = 0
+    frames = iter(frames)
+    try:
+        while True:
+            with metrics.time("source"):
+                item = next(frames, None)
+            if item is None:
+                break
+            frame, track_ids, centers = item
+            with metrics.time("draw"):
+                renderer.update(frame_index, track_ids, centers)
+                renderer.draw(frame)
+            with metrics.time("encode"):
+                out.write(frame)
+            frame_index += 1
+            metrics.frame_done()
+    finally:
+        out.release()
+    if frame is not None and snapshot_path:
+        cv2.imwrite(snapshot_path, frame)
+    metrics.finish()
+    return frame_index
+
+def video_info(video_path):
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise IOError(f"Cannot open video file: {video_path}")
+    size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    cap.release()
+    return size, fps
+
+def render_video(video_path, output_path=OUTPUT_PATH, tail=TAIL, max_frames=None, snapshot_path=SNAPSHOT_PATH,
+                 weights=TRAJECTORY_WEIGHTS, metrics=None):
+    """Tracks a whole video and writes it with the trajectories drawn in."""
+    size, fps = video_info(video_path)
+    return render(tracked_frames(video_path, weights, max_frames=max_frames), output_path, size, fps, tail,
+                  snapshot_path, metrics)
+
+def render_labels(labels_dir, output_path=OUTPUT_PATH, video_path=None, size=None, tail=TAIL, max_frames=None,
+                  snapshot_path=SNAPSHOT_PATH, metrics=None):
+    """
+    Writes the trajectories of an existing tracking run, over its video if
+    video_path is given and over black frames of `size` otherwise.
+    """
+    fps = 30
+    if video_path:
+        size, fps = video_info(video_path)
+    elif size is None:
+        raise ValueError("A frame size is needed to render labels without their video.")
+    return render(label_frames(labels_dir, size, video_path, max_frames), output_path, size, fps, tail,
+                  snapshot_path, metrics)
+
+def main(video_path="2ants_cropped.mp4", labels_dir=None, output_path=OUTPUT_PATH, tail=TAIL, max_frames=None,
+         size=None, snapshot_path=SNAPSHOT_PATH):
+    if labels_dir:
+        return render_labels(labels_dir, output_path, video_path, size, tail, max_frames, snapshot_path)
+    return render_video(video_path, output_path, tail, max_frames, snapshot_path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render the trajectories of tracked ants into a video.")
+    parser.add_argument("--video", help="Video to track (default 2ants_cropped.mp4), or the background for --labels.")
+    parser.add_argument("--labels", help="Labels or run directory of an earlier run, a tracking job ID or 'latest' "
+                                         "(run catalog); no inference is run.")
+    parser.add_argument("--output", default=OUTPUT_PATH, help="Output video.")
+    parser.add_argument("--snapshot", default=SNAPSHOT_PATH, help="Image the last frame is written to.")
+    parser.add_argument("--tail", type=int, default=TAIL, help="Ants trail their positions of the last TAIL frames.")
+    parser.add_argument("--max-frames", type=int, help="Stop after this many frames.")
+    parser.add_argument("--size", help="WIDTHxHEIGHT of the black frames used with --labels and no --video.")
+    args = parser.parse_args()
+
+    if not args.video and not args.labels:
+        args.video = "2ants_cropped.mp4"
+    size = tuple(int(v) for v in args.size.lower().split('x')) if args.size else None
+    if args.labels:
+        args.labels = run_catalog.resolve_labels(args.labels)
+    main(args.video, args.labels, args.output, args.tail, args.max_frames, size, args.snapshot)